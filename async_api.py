@@ -0,0 +1,333 @@
+#Asyncio (ASGI) server for the image API - same routes, token auth and responses as image_api
+#Started with `python3 image_api.py --server async`; needs starlette, python-multipart and uvicorn
+import os
+import json
+import itertools
+import tempfile
+import asyncio
+import weakref
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from models.utils import DecodedImage, ImageDecodeError, save_image_async, temp_upload_path
+from models.object_detector.video import VideoFrames
+from models.image_archive import archive_kind, archive_images, file_images
+from models.object_detector.detection_config import parse_quality
+from models.object_detector.detections import parse_response_format
+
+try:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import Response, StreamingResponse
+    from starlette.routing import Route
+except ImportError as e:
+    raise ImportError('--server async needs starlette, python-multipart and uvicorn ({})'.format(e))
+
+
+class ServerBusy(Exception):
+    pass
+
+
+_END = object()
+
+
+class _StreamState:
+    # Iterator of an iterate() stream and its cleanup, shared with the stream's finalizer
+
+    def __init__(self, executor, iterator, release, on_close=None):
+        self.executor = executor
+        self.iterator = iterator
+        self.release = release
+        self.on_close = on_close
+        self.pending = None  # concurrent future of the next() running on the pool
+        self.closed = False
+        self._lock = threading.Lock()
+
+    def _cleanup(self):
+        try:
+            if hasattr(self.iterator, 'close'):
+                self.iterator.close()
+            if self.on_close is not None:
+                self.on_close()
+        finally:
+            self.release()
+
+    def close(self):
+        """Close the iterator and free the slot once, after a next() still running on the pool has returned"""
+        with self._lock:
+            if self.closed:
+                return
+            self.closed = True
+        pending = self.pending
+        if pending is not None and not pending.done():
+            pending.add_done_callback(lambda _: self._cleanup())
+            return
+        try:
+            self.executor.submit(self._cleanup)
+        except RuntimeError:  # pool shut down
+            self._cleanup()
+
+
+class PoolStream:
+    """Async iterator over a blocking iterator advanced on the pool, holding one slot.
+
+    The iterator is closed and the slot freed when the iteration ends or fails, when the client goes
+    away (the response task is cancelled, possibly while next() runs on the pool) or, for a response
+    whose body never started, when the stream is garbage collected.
+    """
+
+    def __init__(self, state):
+        self._state = state
+        weakref.finalize(self, state.close)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        state = self._state
+        if state.closed:
+            raise StopAsyncIteration
+        state.pending = state.executor.submit(next, state.iterator, _END)
+        try:
+            item = await asyncio.wrap_future(state.pending)
+        except BaseException:
+            state.close()
+            raise
+        if item is _END:
+            state.close()
+            raise StopAsyncIteration
+        return item
+
+    async def aclose(self):
+        self._state.close()
+
+
+class BoundedExecutor:
+    """Thread pool that rejects work instead of queueing it without limit.
+
+    At most max_workers jobs run and max_queue more wait; submit() raises ServerBusy beyond that,
+    so a burst of uploads turns into fast 503 responses instead of an ever growing backlog.
+    """
+
+    def __init__(self, max_workers, max_queue):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='inference')
+
+    def submit(self, func, *args):
+        """asyncio future of func(*args) run on the pool"""
+        if not self._slots.acquire(blocking=False):
+            raise ServerBusy()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+    def iterate(self, iterator, on_close=None):
+        """PoolStream over a blocking iterator, holding one slot until it is closed; on_close runs after the iterator closes"""
+        if not self._slots.acquire(blocking=False):
+            raise ServerBusy()
+        return PoolStream(_StreamState(self._executor, iterator, self._slots.release, on_close))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+# api - the image_api module (its routes, templates and settings are reused as they are)
+def create_app(api, max_workers=4, max_queue=16, retry_after=1):
+    """ASGI app serving the image_api routes with inference on a BoundedExecutor"""
+    executor = BoundedExecutor(max_workers, max_queue)
+    logger = api.app.logger
+
+    def unauthorized():
+        return Response('Unauthorized Access', status_code=401,
+                        headers={'WWW-Authenticate': 'Bearer realm="Authentication Required"'})
+
+    def busy():
+        logger.warning('Inference queue full, request rejected')
+        return Response('Server busy, retry later', status_code=503, headers={'Retry-After': str(retry_after)})
+
+    def authorized(request):
+        scheme, _, token = request.headers.get('authorization', '').partition(' ')
+        return scheme.lower() == 'bearer' and api.verify_token(token.strip())
+
+    async def read_image(request, prefix):
+        """DecodedImage from the multipart 'image' field (read without blocking the event loop)"""
+        form = await request.form()
+        upload = form.get('image')
+        if upload is None or isinstance(upload, str):
+            return None
+        image = DecodedImage(await upload.read(), upload.filename, api.decode_size())
+        if api.keep_files:
+            save_image_async(image, prefix, temp_dir=api.temp_dir, app_logger=logger)
+        return image
+
+    async def run(func, *args):
+        """Response with the JSON string returned by func, 503 if the inference queue is full, 400 for an unreadable image"""
+        try:
+            resp = await executor.submit(func, *args)
+        except ServerBusy:
+            return busy()
+        except ImageDecodeError as e:
+            return Response(str(e), status_code=400)
+        return Response(resp, media_type='text/html')
+
+    def model_route(endpoint):
+        async def detection(request):
+            if not authorized(request):
+                return unauthorized()
+            predictor, model_name, filter_list = api.get_models_dict()[endpoint]
+            try:
+                quality = parse_quality(request.query_params.get('quality'))
+                response_format = parse_response_format(request.query_params.get('format'))
+            except ValueError as e:
+                return Response(str(e), status_code=400)
+            image = await read_image(request, model_name)
+            if image is None:
+                return Response('No image provided', status_code=400)
+            return await run(lambda: json.dumps(api.prediction_template(predictor, model_name, filter_list=filter_list,
+                                                                        image=image, quality=quality).to_list(response_format)))
+        return Route('/' + endpoint, detection, methods=['POST'])
+
+    async def multiple_models(request):
+        if not authorized(request):
+            return unauthorized()
+        try:
+            quality = parse_quality(request.query_params.get('quality'))
+            response_format = parse_response_format(request.query_params.get('format'))
+        except ValueError as e:
+            return Response(str(e), status_code=400)
+        image = await read_image(request, 'multiple_models')
+        if image is None:
+            return Response('No image provided', status_code=400)
+        return await run(api.multiple_models_template, image, request.query_params.getlist('model'), quality, response_format)
+
+    async def video_detection(request):
+        if not authorized(request):
+            return unauthorized()
+        try:
+            models, quality, response_format, sample_rate = api.video_parameters(request.query_params)
+        except ValueError as e:
+            return Response(str(e), status_code=400)
+        form = await request.form()
+        upload = form.get('video')
+        if upload is None or isinstance(upload, str):
+            return Response('No video provided', status_code=400)
+
+        #Copied to a temporary file in chunks (OpenCV reads videos from files), removed once streamed
+        path = temp_upload_path(upload.filename)
+        with open(path, 'wb') as f:
+            while True:
+                chunk = await upload.read(2 ** 20)
+                if not chunk:
+                    break
+                f.write(chunk)
+        try:
+            frames = VideoFrames(path, sample_rate)
+        except ValueError as e:
+            os.remove(path)
+            return Response(str(e), status_code=400)
+        lines = api.video_template(frames, path, models, quality, response_format)
+        try:
+            return StreamingResponse(executor.iterate(lines, on_close=lambda: api.remove_video(frames, path)),
+                                     media_type='application/x-ndjson')
+        except ServerBusy:
+            api.remove_video(frames, path)
+            return busy()
+
+    async def batch_uploads(request):
+        """(ArchiveMembers, files to close) of a batch request - multipart 'image' and 'archive' fields or a tar/zip body"""
+        if request.headers.get('content-type', '').startswith('multipart/form-data'):
+            form = await request.form()
+            images = [(upload.filename, upload.file) for upload in form.getlist('image') if not isinstance(upload, str)]
+            archives = [upload for upload in form.getlist('archive') if not isinstance(upload, str)]
+            kinds = [archive_kind(upload.filename, upload.content_type) for upload in archives]
+            for upload, kind in zip(archives, kinds):
+                if kind is None:
+                    raise ValueError('Unsupported archive {!r}, expected tar or zip'.format(upload.filename))
+            if not images and not archives:
+                raise ValueError('No images provided')
+            uploads = itertools.chain(file_images(images),
+                                      *[archive_images(upload.file, kind, upload.filename) for upload, kind in zip(archives, kinds)])
+            return uploads, ()
+
+        #Raw archive body, spooled without blocking the event loop (the pool threads read it synchronously)
+        kind = archive_kind(content_type=request.headers.get('content-type'))
+        if kind is None:
+            raise ValueError('Expected multipart image/archive fields or a tar or zip body')
+        body = tempfile.SpooledTemporaryFile(max_size=int(api.batch_spool_mb * 2 ** 20))
+        async for chunk in request.stream():
+            body.write(chunk)
+        body.seek(0)
+        return archive_images(body, kind), (body,)
+
+    async def batch_detection(request):
+        if not authorized(request):
+            return unauthorized()
+        try:
+            models, quality, response_format = api.stream_parameters(request.query_params)
+            uploads, files = await batch_uploads(request)
+        except ValueError as e:
+            return Response(str(e), status_code=400)
+        lines = api.batch_template(uploads, models, quality, response_format, files)
+        try:
+            return StreamingResponse(executor.iterate(lines, on_close=lambda: [f.close() for f in files]),
+                                     media_type='application/x-ndjson')
+        except ServerBusy:
+            for f in files:
+                f.close()
+            return busy()
+
+    async def models_info(request):
+        if not authorized(request):
+            return unauthorized()
+        return Response(json.dumps(api.yd.get_model_registry()))
+
+    async def metrics(request):
+        if not authorized(request):
+            return unauthorized()
+        return Response(json.dumps(api.metrics.snapshot()))
+
+    async def memory_report(request):
+        if not authorized(request):
+            return unauthorized()
+        #Reads /proc of every worker - off the event loop
+        pids = api.sibling_pids() if api.workers > 1 else [os.getpid()]
+        report = await asyncio.get_running_loop().run_in_executor(None, api.memory_report, api.yd.get_resident_models(), pids)
+        return Response(json.dumps(report))
+
+    async def thresholds(request):
+        if not authorized(request):
+            return unauthorized()
+        return Response(json.dumps(api.thresholds.active()))
+
+    async def reload_thresholds(request):
+        if not authorized(request):
+            return unauthorized()
+        status = 200 if api.thresholds.reload() else 400
+        return Response(json.dumps(api.thresholds.active()), status_code=status)
+
+    routes = [model_route(endpoint) for endpoint in api.get_models_dict()]
+    routes += [Route('/multiple_models', multiple_models, methods=['POST']),
+               Route('/video_detection', video_detection, methods=['POST']),
+               Route('/batch_detection', batch_detection, methods=['POST']),
+               Route('/models_info', models_info, methods=['GET']),
+               Route('/metrics', metrics, methods=['GET']),
+               Route('/memory_report', memory_report, methods=['GET']),
+               Route('/thresholds', thresholds, methods=['GET']),
+               Route('/reload_thresholds', reload_thresholds, methods=['POST'])]
+    app = Starlette(routes=routes)
+    app.state.executor = executor
+    return app
+
+
+def serve(app, port, host='0.0.0.0', sock=None):
+    """Run app with uvicorn (one event loop, inference on the app's executor), on sock if given"""
+    if sock is not None:
+        uvicorn.run(app, fd=sock.fileno(), log_level='info')
+    else:
+        uvicorn.run(app, host=host, port=port, log_level='info')
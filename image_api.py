@@ -2,16 +2,33 @@ from flask import Flask, request, Response
 from waitress import serve
 import os
 import argparse
+import sys
+import io
 import json
+import shutil
+import tempfile
+import itertools
 
 #Auth
 from flask import Flask
 from flask_httpauth import HTTPTokenAuth
 
 import models.object_detector.yolo_detection as yd
+from models.object_detector.detection_config import reload_config_files, parse_quality
+from models.object_detector.parallel import ParallelDetectors
+from models.object_detector.fused import FusedDetectors
+from models.object_detector.detections import parse_response_format
+from models.object_detector.video import VideoFrames, detect_video, parse_sample_rate, prefetch
+from models.image_archive import archive_kind, archive_images, file_images
+from models.metrics import metrics
+from models.result_cache import ResultCache
+from models.thresholds import ThresholdStore
+from models.memory_report import memory_report, sibling_pids
 
 from models.utils import *
+from models.model_paths import *
 import logging
+import signal
 import torch
 
 
@@ -28,34 +45,20 @@ prod = False
 use_gpu = False
 temp_dir = 'temp_images'
 keep_files = False
-
-tokens_path = 'cfg/tokens.json'
-th_path = 'cfg/thresholds.json'
-
-# Config paths
-gr_weights_path = 'yolov3/weights/grounding.pt'
-gr_names_path = 'yolov3/data/grounding.names'
-gr_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
-
-sd_weights_path = 'yolov3/weights/satelite_dish.pt'
-sd_names_path = 'yolov3/data/satelite_dish.names'
-sd_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
-
-cj_weights_path = 'yolov3/weights/cable_jack.pt'
-cj_names_path = 'yolov3/data/cable_jack.names'
-cj_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
-
-ad_weights_path = 'yolov3/weights/antenna.pt'
-ad_names_path = 'yolov3/data/antenna.names'
-ad_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
-
-fe_weights_path = 'yolov3/weights/fire_extinguisher.pt'
-fe_names_path = 'yolov3/data/fire_extinguisher.names'
-fe_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
-
-sn_weights_path = 'yolov3/weights/screw_nuts.pt'
-sn_names_path = 'yolov3/data/screw_nuts.names'
-sn_config_path = 'yolov3/cfg/yolov3-spp-2cls.cfg'
+fanout_workers = None
+fused_models = False
+batch_size = 1
+batch_wait_ms = 10
+server = None
+workers = 1
+fused_detectors = None
+result_cache_mb = 64
+result_cache_ttl = 600
+result_cache = None
+reduced_decode = True
+video_batch_size = 4
+image_batch_size = 4
+batch_spool_mb = 16
 
 
 #Define app
@@ -72,59 +75,344 @@ def verify_token(token):
     if token in tokens:
         return tokens[token]
 
-# save_path - None means that the image is read from request using the Flask API, 
-# othervise the save_path path is used to read the image from disk
-# take_first - a flag used to extract the prediction of the first image
-# temp_dir - it is a global variable pointing to the temp location for saving received images
-def prediction_template(predictor, model_name, take_first=True, filter_list=[], save_path=None, **kwargs):
-    """Template function for detection and response generation"""
-
-#---------------------Save image part--------------------------
-
-    # if save path is None get the image from the HTTP request using Flask API , save the image and set the multiple_models_mode flag
-    # othervise use the save_path as it is for reading the image file from disk and set the multiple_models_mode flag
-    if save_path == None:
-        image = request.files.get('image')
-
-        #Save image to a temporary location using save_image function from utils.py
-        # image is an request flask object
-        # model_name is a string used to generate descriptive file name
-        # temp dir is the temporary directory at which the image will be saved
-        save_path, time_str = save_image(image, model_name, temp_dir=temp_dir, app_logger=app.logger)
-        multiple_models_mode = False
-    else:
-        multiple_models_mode = True
-    
+#Confidence interval thresholds of every model - validated at startup, hot reloaded when the file changes
+thresholds = ThresholdStore(th_path, models=model_names, logger=app.logger)
+
+def reload_configs():
+    """Re-read the detection config and the thresholds (SIGHUP)"""
+    reload_config_files()
+    thresholds.reload()
+
+def decode_size():
+    """Long side large JPEG uploads are decoded down to (1/2, 1/4 or 1/8 scale) - the largest model input, None for full resolution"""
+    if not reduced_decode:
+        return None
+    sizes = [predictor.config.img_size for predictor, _, _ in get_models_dict().values()]
+    return max(max(size) if isinstance(size, tuple) else size for size in sizes)
+
+# image - DecodedImage, filter_list - classes kept, model_thresholds - th1/th2 of the model, quality - fast, accurate or None
+def result_key(image, predictor, filter_list, model_thresholds, quality=None):
+    """Result cache key - image content and decode scale, model version and parameters, confidence interval thresholds"""
+    return (image.digest, image.reduction, predictor.cache_key(quality), tuple(filter_list), tuple(sorted(model_thresholds.items())))
+
+# image - DecodedImage of the request
+# prediction - Detections already computed for image (multiple_models runs all models at once)
+# quality - fast, accurate or None (the model's config default)
+def prediction_template(predictor, model_name, filter_list=[], image=None, prediction=None, quality=None):
+    """Detections of one model for an image - filtered, with confidence intervals and boxes in the original orientation"""
+
+    #Active thresholds of the model, the same for the whole request
+    model_thresholds = thresholds.get(model_name)
+
+    #Stored result for the same image, model and parameters - no decoding or inference
+    key = None
+    if result_cache is not None and prediction is None:
+        key = result_key(image, predictor, filter_list, model_thresholds, quality)
+        detections = result_cache.get(key)
+        if detections is not None:
+            return detections
 
 #---------------------Prediction part--------------------------
     #Process the image
-    resp = predictor.predict(save_path, **kwargs)
-
+    if prediction is None:
+        detections = predictor.detect_image(image.img, predictor.get_config(quality), scale=image.scale)
+    else:
+        detections = prediction
 
 #---------------------Prediction processing part--------------------------
-    #Take first element
-    if take_first:
-        resp = json.loads(str(resp))
-        resp = take_first_element(resp)
-
     #Filter classes
     if len(filter_list) > 0:
-        resp = filter_response(resp, filter_list)
-    
+        detections = detections.filter_classes(filter_list)
+
     #Add CI - add confidence interval to result based on the threshold found in the configuration file
-    # it could be either low or high
-    resp = add_confidence_interval(resp, save_path, model_name)
+    # it could be either low or high, low ones are dropped
+    detections = detections.with_conf_intervals(model_thresholds['th1'], model_thresholds['th2'])
+
+    #Boxes back to the orientation of the uploaded image
+    detections = detections.rotate(image.exif_rotation, image.shape)
+
+    if key is not None:
+        result_cache.put(key, detections, size=detections.nbytes)
+    return detections
+
+# temp_dir - it is a global variable pointing to the temp location for kept images (--keep_files)
+def model_response(predictor, model_name, filter_list=[]):
+    """Single model endpoint - decode the uploaded image, detect and serialize the response"""
+
+    #Per request quality (?quality=fast|accurate, the model's config default when not given) and response format
+    try:
+        quality = parse_quality(request.args.get('quality'))
+        response_format = parse_response_format(request.args.get('format'))
+    except ValueError as e:
+        return Response(str(e), status=400)
+
+    #Decode once - pixels, EXIF rotation and shape all come from the uploaded bytes
+    upload = request.files.get('image')
+    if upload is None:
+        return Response('No image provided', status=400)
+    image = DecodedImage.from_upload(upload, min_size=decode_size())
+
+    #Keep a copy for debugging, written in the background
+    if keep_files:
+        save_image_async(image, model_name, temp_dir=temp_dir, app_logger=app.logger)
+
+    #Unreadable image - decoded lazily, so it shows here
+    try:
+        detections = prediction_template(predictor, model_name, filter_list=filter_list, image=image, quality=quality)
+    except ImageDecodeError as e:
+        return Response(str(e), status=400)
+    return Response(json.dumps(detections.to_list(response_format)))
+
+#Predictor, model name and class filter of each endpoint
+def get_models_dict():
+    return { 'grounding_detection':(ground_pred, 'grounding', []),
+             'satellite_dish_detection':(satd_pred, 'satellite_dish', []),
+             'cablejack_detection':(cjack_pred, 'cable_jack', []),
+             'antenna_detection':(antenna_pred, 'antenna_detection', []),
+             'fireextinguisher_detection':(fireext_pred, 'fire_ext', []),
+             'screwnuts_detection':(screwnuts_pred, 'screw_nuts', ['double_nut'])
+             }
+
+# image - DecodedImage, models - endpoint names of the requested models, quality - fast, accurate or None
+# response_format - legacy or compact
+def multiple_models_template(image, models, quality=None, response_format='legacy'):
+    """Run the requested models on one image and build the multiple_models response"""
+
+    #No Models provided
+    if len(models) == 0:
+        #Log resp
+        app.logger.info('Multiple Models:No Models provided')
+        return json.dumps([])
 
-    #Remove saved temporary image
-    if not keep_files and not multiple_models_mode:
-        os.remove(save_path)
+    #Models dict
+    models_dict = get_models_dict()
 
-    #Return the response
-    if not multiple_models_mode:
-        #Not used in multiple_models
-        return Response(resp)
-    else:
-        return resp
+    #Cached results, only the other models run (the image is not decoded when all are cached)
+    detections, keys, missing = dict(), dict(), []
+    for model in models:
+        if result_cache is not None:
+            predictor, model_name, filter_list = models_dict[model]
+            keys[model] = result_key(image, predictor, filter_list, thresholds.get(model_name), quality)
+            cached = result_cache.get(keys[model])
+            if cached is not None:
+                detections[model] = cached
+                continue
+        missing.append(model)
+
+    #Letterbox once and run all requested models concurrently
+    if missing:
+        predictions = parallel_detectors.predict({model: models_dict[model][0] for model in missing}, image.img,
+                                                 quality=quality, scale=image.scale)
+
+    #Iterate over all models
+    for model in missing:
+        predictor, model_name, filter_list = models_dict[model]
+        #Add response
+        detections[model] = prediction_template(predictor, model_name, filter_list=filter_list,
+                                                image=image, prediction=predictions[model])
+        if model in keys:
+            result_cache.put(keys[model], detections[model], size=detections[model].nbytes)
+    return json.dumps({model: detections[model].to_list(response_format) for model in models})
+
+# frames - VideoFrames of the uploaded video, path - its temporary file
+def remove_video(frames, path):
+    """Release the video and delete its temporary file - safe to call again (stream end and response close)"""
+    frames.close()
+    if os.path.exists(path):
+        os.remove(path)
+
+# frames - VideoFrames of the uploaded video, path - its temporary file (removed once streamed)
+# models - endpoint names of the requested models, quality - fast, accurate or None, response_format - legacy or compact
+def video_template(frames, path, models, quality=None, response_format='legacy'):
+    """NDJSON lines of the sampled frames, one per frame as soon as it is detected"""
+    models_dict = get_models_dict()
+
+    #Config and thresholds snapshot - a reload does not change parameters mid-video
+    detectors = {model: models_dict[model][0] for model in models}
+    configs = {model: detector.get_config(quality) for model, detector in detectors.items()}
+    model_thresholds = {model: thresholds.get(models_dict[model][1]) for model in models}
+
+    try:
+        for index, seconds, predictions in detect_video(frames, detectors, configs, batch_size=video_batch_size):
+            detections = {}
+            for model, prediction in predictions.items():
+                filter_list = models_dict[model][2]
+                if len(filter_list) > 0:
+                    prediction = prediction.filter_classes(filter_list)
+                th = model_thresholds[model]
+                detections[model] = prediction.with_conf_intervals(th['th1'], th['th2']).to_list(response_format)
+            yield json.dumps({'frame': index, 'time': seconds, 'detections': detections}) + '\n'
+    finally:
+        remove_video(frames, path)
+
+# args - request query parameters
+def stream_parameters(args):
+    """(models, quality, response_format) of a video or batch request; ValueError for bad parameters"""
+    quality = parse_quality(args.get('quality'))
+    response_format = parse_response_format(args.get('format'))
+    models = args.getlist('model')
+    if len(models) == 0:
+        raise ValueError('No models provided')
+    unknown = [model for model in models if model not in get_models_dict()]
+    if unknown:
+        raise ValueError('Unknown models {}'.format(unknown))
+    return models, quality, response_format
+
+# args - request query parameters
+def video_parameters(args):
+    """(models, quality, response_format, sample_rate) of a video request; ValueError for bad parameters"""
+    models, quality, response_format = stream_parameters(args)
+    return models, quality, response_format, parse_sample_rate(args.get('sample_rate'))
+
+class BatchItem:
+    """Image of a batch request: its position, name, DecodedImage (None if unreadable) and detections per model"""
+
+    def __init__(self, index, name, image=None, error=None):
+        self.index = index
+        self.name = name
+        self.image = image
+        self.error = error
+        self.detections = {}
+        self.keys = {}
+
+# uploads - ArchiveMembers of the request (models.image_archive), files - upload files closed once streamed
+# models - endpoint names of the requested models, quality - fast, accurate or None, response_format - legacy or compact
+def batch_template(uploads, models, quality=None, response_format='legacy', files=()):
+    """NDJSON lines of the uploaded images, one per image as soon as its batch is detected"""
+    models_dict = get_models_dict()
+
+    #Config snapshot - a reload does not change parameters mid-batch
+    configs = {model: models_dict[model][0].get_config(quality) for model in models}
+    min_size = decode_size()
+
+    def decode():
+        #Read and decoded in the prefetch thread while the previous batch runs through the models
+        for index, upload in enumerate(uploads):
+            item = BatchItem(index, upload.name, error=upload.error)
+            if item.error is None:
+                item.image = DecodedImage(upload.data, upload.name, min_size)
+                #Cached results, the image is not decoded when all models are cached
+                for model in models:
+                    if result_cache is not None:
+                        predictor, model_name, filter_list = models_dict[model]
+                        item.keys[model] = result_key(item.image, predictor, filter_list, thresholds.get(model_name), quality)
+                        cached = result_cache.get(item.keys[model])
+                        if cached is not None:
+                            item.detections[model] = cached
+                if len(item.detections) < len(models):
+                    try:
+                        item.image.img
+                    except ImageDecodeError:
+                        item.image, item.error = None, 'Image decode failed'
+            yield item
+
+    def detect(batch):
+        #Each model runs once per batch, images of the same input shape in one forward (results as for single images)
+        for model in models:
+            predictor, model_name, filter_list = models_dict[model]
+            missing = [item for item in batch if item.error is None and model not in item.detections]
+            if not missing:
+                continue
+            predictions = predictor.detect_images([item.image.img for item in missing], configs[model],
+                                                  [item.image.scale for item in missing], pad=False)
+            for item, prediction in zip(missing, predictions):
+                item.detections[model] = prediction_template(predictor, model_name, filter_list=filter_list,
+                                                             image=item.image, prediction=prediction)
+                if model in item.keys:
+                    result_cache.put(item.keys[model], item.detections[model], size=item.detections[model].nbytes)
+        for item in batch:
+            if item.error is not None:
+                line = {'index': item.index, 'image': item.name, 'error': item.error}
+            else:
+                line = {'index': item.index, 'image': item.name,
+                        'detections': {model: item.detections[model].to_list(response_format) for model in models}}
+            yield json.dumps(line) + '\n'
+
+    try:
+        batch = []
+        for item in prefetch(decode(), 2 * image_batch_size):
+            batch.append(item)
+            if len(batch) == image_batch_size:
+                yield from detect(batch)
+                batch = []
+        if batch:
+            yield from detect(batch)
+    finally:
+        for f in files:
+            f.close()
+
+def batch_uploads():
+    """(ArchiveMembers, files to close) of a batch request - multipart 'image' and 'archive' fields or a tar/zip body"""
+    if request.mimetype == 'multipart/form-data':
+        images = request.files.getlist('image')
+        archives = request.files.getlist('archive')
+        kinds = [archive_kind(upload.filename, upload.mimetype) for upload in archives]
+        for upload, kind in zip(archives, kinds):
+            if kind is None:
+                raise ValueError('Unsupported archive {!r}, expected tar or zip'.format(upload.filename))
+        if not images and not archives:
+            raise ValueError('No images provided')
+
+        #Flask closes the uploaded files when the view returns - their streams are taken over and closed once streamed
+        streams = []
+        for upload in images + archives:
+            streams.append(upload.stream)
+            upload.stream = io.BytesIO()
+        uploads = itertools.chain(file_images([(upload.filename, stream) for upload, stream in zip(images, streams)]),
+                                  *[archive_images(stream, kind, upload.filename)
+                                    for upload, stream, kind in zip(archives, streams[len(images):], kinds)])
+        return uploads, streams
+
+    #Raw archive body - a tar is read as it arrives, a zip (index at its end) is spooled first
+    kind = archive_kind(content_type=request.content_type)
+    if kind is None:
+        raise ValueError('Expected multipart image/archive fields or a tar or zip body')
+    if kind == 'tar':
+        return archive_images(request.stream, kind), ()
+    body = tempfile.SpooledTemporaryFile(max_size=int(batch_spool_mb * 2 ** 20))
+    shutil.copyfileobj(request.stream, body, 2 ** 20)
+    body.seek(0)
+    return archive_images(body, kind), (body,)
+
+#Batch
+@app.route('/batch_detection', methods=['POST'])
+@auth.login_required
+def batch_detection():
+    """Detections of the requested models on many images, streamed as NDJSON (one line per image)"""
+    try:
+        models, quality, response_format = stream_parameters(request.args)
+        uploads, files = batch_uploads()
+    except ValueError as e:
+        return Response(str(e), status=400)
+    response = Response(batch_template(uploads, models, quality, response_format, files), mimetype='application/x-ndjson')
+    response.call_on_close(lambda: [f.close() for f in files])
+    return response
+
+#Video
+@app.route('/video_detection', methods=['POST'])
+@auth.login_required
+def video_detection():
+    """Detections of the requested models on a video upload, streamed as NDJSON (one line per sampled frame)"""
+    try:
+        models, quality, response_format, sample_rate = video_parameters(request.args)
+    except ValueError as e:
+        return Response(str(e), status=400)
+    upload = request.files.get('video')
+    if upload is None:
+        return Response('No video provided', status=400)
+
+    #OpenCV reads videos from files - the upload goes to a temporary file, removed once streamed
+    path = temp_upload_path(upload.filename)
+    upload.save(path)
+    try:
+        frames = VideoFrames(path, sample_rate)
+    except ValueError as e:
+        os.remove(path)
+        return Response(str(e), status=400)
+    #Removed on close too - a generator that never started does not run its finally
+    response = Response(video_template(frames, path, models, quality, response_format), mimetype='application/x-ndjson')
+    response.call_on_close(lambda: remove_video(frames, path))
+    return response
 
 #Multiple Models
 @app.route('/multiple_models', methods=['POST'])
@@ -132,78 +420,106 @@ def prediction_template(predictor, model_name, take_first=True, filter_list=[],
 def multiple_models():
     """Function for mutiple models in a single API call"""
 
-    #Save image
-    image = request.files.get('image')
-    save_path, time_str = save_image(image, 'multiple_models', temp_dir=temp_dir, app_logger=app.logger)
+    #Per request quality and response format for all models
+    try:
+        quality = parse_quality(request.args.get('quality'))
+        response_format = parse_response_format(request.args.get('format'))
+    except ValueError as e:
+        return Response(str(e), status=400)
+
+    #Decode image once for all models
+    upload = request.files.get('image')
+    if upload is None:
+        return Response('No image provided', status=400)
+    image = DecodedImage.from_upload(upload, min_size=decode_size())
+    if keep_files:
+        save_image_async(image, 'multiple_models', temp_dir=temp_dir, app_logger=app.logger)
 
     #Models
     #Get key words
     models = request.args.getlist('model')
-    #No Models provided
-    if len(models) == 0:
-        #Log resp
-        app.logger.info('Multiple Models:No Models provided')
-        return Response(json.dumps([]))
-
-    #Models dict
-    models_dict = { 'grounding_detection':grounding_detection,
-                    'satellite_dish_detection':satellite_dish_detection,
-                    'cablejack_detection':cablejack_detection,
-                    'antenna_detection':antenna_detection,
-                    'fireextinguisher_detection':fireextinguisher_detection,
-                    'screwnuts_detection':screwnuts_detection
-                    }
-
-    #Iterate over all models
-    resp = dict()
-    for model in models:
-        #Add response
-        resp[model] = json.loads(models_dict[model](save_path=save_path))
 
-    #Delete file
-    if not keep_files:
-        os.remove(save_path)
-
-    #Response
-    return Response(json.dumps(resp))
+    #Response (400 for an unreadable image)
+    try:
+        return Response(multiple_models_template(image, models, quality, response_format))
+    except ImageDecodeError as e:
+        return Response(str(e), status=400)
 
 
 #Models
 # Grounding Detection
 @app.route('/grounding_detection', methods=['POST'])
 @auth.login_required
-def grounding_detection(save_path=None):
-    return prediction_template(ground_pred, 'grounding', take_first=True, save_path=save_path)
+def grounding_detection():
+    return model_response(ground_pred, 'grounding')
 
 # Satellite Dish Detection
 @app.route('/satellite_dish_detection', methods=['POST'])
 @auth.login_required
-def satellite_dish_detection(save_path=None):
-    return prediction_template(satd_pred, 'satellite_dish', take_first=True, save_path=save_path)
+def satellite_dish_detection():
+    return model_response(satd_pred, 'satellite_dish')
 
 # Cable Jack Detection
 @app.route('/cablejack_detection', methods=['POST'])
 @auth.login_required
-def cablejack_detection(save_path=None):
-    return prediction_template(cjack_pred, 'cable_jack', take_first=True, save_path=save_path)
+def cablejack_detection():
+    return model_response(cjack_pred, 'cable_jack')
 
 # Antenna Detection
 @app.route('/antenna_detection', methods=['POST'])
 @auth.login_required
-def antenna_detection(save_path=None):
-    return prediction_template(antenna_pred, 'antenna_detection', take_first=True, save_path=save_path)
+def antenna_detection():
+    return model_response(antenna_pred, 'antenna_detection')
 
 # Fire Extuinguisher Detection
 @app.route('/fireextinguisher_detection', methods=['POST'])
 @auth.login_required
-def fireextinguisher_detection(save_path=None):
-    return prediction_template(fireext_pred, 'fire_ext', take_first=True, save_path=save_path)
+def fireextinguisher_detection():
+    return model_response(fireext_pred, 'fire_ext')
 
 # Screw Nuts Detection
 @app.route('/screwnuts_detection', methods=['POST'])
 @auth.login_required
-def screwnuts_detection(save_path=None):
-    return prediction_template(screwnuts_pred, 'screw_nuts', take_first=True, save_path=save_path, filter_list=['double_nut'])
+def screwnuts_detection():
+    return model_response(screwnuts_pred, 'screw_nuts', filter_list=['double_nut'])
+
+# Resident models info
+@app.route('/models_info', methods=['GET'])
+@auth.login_required
+def models_info():
+    """Memory footprint and load timestamp of every resident model"""
+    return Response(json.dumps(yd.get_model_registry()))
+
+# Service metrics
+@app.route('/metrics', methods=['GET'])
+@auth.login_required
+def get_metrics():
+    """Current value of every service metric (batching queue depth, batch sizes, queue wait, ...)"""
+    return Response(json.dumps(metrics.snapshot()))
+
+# Weight memory per worker process
+@app.route('/memory_report', methods=['GET'])
+@auth.login_required
+def get_memory_report():
+    """Resident, proportional and private bytes of the model weights in every worker"""
+    pids = sibling_pids() if workers > 1 else [os.getpid()]
+    return Response(json.dumps(memory_report(yd.get_resident_models(), pids)))
+
+# Active confidence interval thresholds
+@app.route('/thresholds', methods=['GET'])
+@auth.login_required
+def get_thresholds():
+    """Thresholds in use per model, their version, load time and the error of a rejected edit"""
+    return Response(json.dumps(thresholds.active()))
+
+@app.route('/reload_thresholds', methods=['POST'])
+@auth.login_required
+def reload_thresholds():
+    """Re-read cfg/thresholds.json now; an invalid file is rejected and the active thresholds stay"""
+    if not thresholds.reload():
+        return Response(json.dumps(thresholds.active()), status=400)
+    app.logger.info('Thresholds reloaded (version {})'.format(thresholds.version))
+    return Response(json.dumps(thresholds.active()))
 
 # Server Shutdown
 def shutdown_server():
@@ -226,15 +542,79 @@ def shutdown_flask():
     else:
         return 'Shutdown method not available for Waitress'
 
+def init_models(start_runtime=True):
+    """Load all models (they stay resident) and, with start_runtime, the request handling threads"""
+    global ground_pred, satd_pred, cjack_pred, antenna_pred, fireext_pred, screwnuts_pred, fused_detectors
+
+    # Initialize yolo models   
+    ground_pred     = yd.YoloDetector(weights=gr_weights_path, names=gr_names_path, cfg=gr_config_path, name='grounding')
+    satd_pred       = yd.YoloDetector(weights=sd_weights_path, names=sd_names_path, cfg=sd_config_path, name='satellite_dish')
+    cjack_pred      = yd.YoloDetector(weights=cj_weights_path, names=cj_names_path, cfg=cj_config_path, name='cable_jack')
+    antenna_pred    = yd.YoloDetector(weights=ad_weights_path, names=ad_names_path, cfg=ad_config_path, name='antenna_detection')
+    fireext_pred    = yd.YoloDetector(weights=fe_weights_path, names=fe_names_path, cfg=fe_config_path, name='fire_ext')
+    screwnuts_pred  = yd.YoloDetector(weights=sn_weights_path, names=sn_names_path, cfg=sn_config_path, name='screw_nuts')
+
+    # Models sharing a cfg run as one fused forward pass in multiple_models (fused weights are views of the models')
+    fused_detectors = None
+    if fused_models:
+        fused_detectors = FusedDetectors({model: predictor for model, (predictor, _, _) in get_models_dict().items()})
+
+    if start_runtime:
+        init_runtime()
+
+def init_runtime():
+    """Batching and multiple_models threads - started in every worker process, after forking"""
+    global parallel_detectors, result_cache
+
+    # Coalesce concurrent single model requests into batches
+    if batch_size > 1:
+        for predictor in (ground_pred, satd_pred, cjack_pred, antenna_pred, fireext_pred, screwnuts_pred):
+            predictor.enable_batching(max_batch_size=batch_size, max_wait_ms=batch_wait_ms)
+
+    # Fan-out pool for multiple_models
+    parallel_detectors = ParallelDetectors(max_workers=fanout_workers, fused=fused_detectors)
+
+    # Responses of repeated uploads, per process
+    result_cache = ResultCache(max_bytes=int(result_cache_mb * 2 ** 20), ttl=result_cache_ttl or None) if result_cache_mb > 0 else None
+
+# sock - listening socket shared by all worker processes (None when serving from a single process)
+def run_server(sock=None):
+    """Serve the API with the server selected by --server"""
+    if server == 'async':
+        # Imported here, its dependencies are only needed for this mode
+        import async_api
+        async_app = async_api.create_app(sys.modules[__name__], max_workers=num_threads, max_queue=async_queue)
+        async_api.serve(async_app, port=port_num, host='0.0.0.0', sock=sock)
+    elif server == 'flask':
+        app.run(debug=False, port=port_num, threaded=False, host='0.0.0.0')
+    elif sock is not None:
+        serve(app, sockets=[sock], threads=num_threads)
+    else:
+        serve(app, port=port_num,  host='0.0.0.0', threads=num_threads)
+
 if __name__ == '__main__':
     #Arguments
     parser = argparse.ArgumentParser()
     parser.add_argument('-p','--port', type=int, default=8066, help='Port number for API hosting')
     parser.add_argument('-w','--prod', action='store_true', help='Serve using Waitress HTTP Server')
     parser.add_argument('-g','--use_gpu', action='store_true', help='Enable GPU usage')
-    parser.add_argument('-t','--temp_dir', default='temp_images', help='Directory for storing temporary images')
-    parser.add_argument('-k','--keep_files', action='store_true', help='Do not remove temporary image files')
-    parser.add_argument('-n','--num_threads', type=int, default=4, help='Number of threads for Waitress')
+    parser.add_argument('-t','--temp_dir', default='temp_images', help='Directory for images kept with --keep_files')
+    parser.add_argument('-k','--keep_files', action='store_true', help='Keep a copy of received images in temp_dir')
+    parser.add_argument('-n','--num_threads', type=int, default=4, help='Number of threads for Waitress (inference threads with --server async)')
+    parser.add_argument('-s','--server', choices=['flask', 'waitress', 'async'], default=None, help='HTTP server (default: waitress with --prod, flask otherwise)')
+    parser.add_argument('-W','--workers', type=int, default=1, help='Worker processes forked after loading the models (Linux, waitress or async server)')
+    parser.add_argument('--worker_threads', type=int, default=None, help='torch threads per worker (default: cores / workers)')
+    parser.add_argument('-q','--async_queue', type=int, default=16, help='Requests waiting for an inference thread before --server async answers 503')
+    parser.add_argument('-f','--fanout_workers', type=int, default=None, help='Models run concurrently by multiple_models (default: one per core, up to 6)')
+    parser.add_argument('-b','--batch_size', type=int, default=1, help='Max images per forward pass when requests to a model arrive together (1 disables batching)')
+    parser.add_argument('--batch_wait_ms', type=float, default=10, help='Max time a request waits for a batch to fill')
+    parser.add_argument('--result_cache_mb', type=float, default=64, help='Memory for cached responses of repeated images per process (0 disables the cache)')
+    parser.add_argument('--result_cache_ttl', type=float, default=600, help='Seconds a cached response stays valid (0 - until evicted)')
+    parser.add_argument('--full_decode', action='store_true', help='Decode large JPEG uploads at full resolution instead of at the scale closest to the model input size')
+    parser.add_argument('--video_batch_size', type=int, default=4, help='Sampled video frames per forward pass in video_detection')
+    parser.add_argument('--image_batch_size', type=int, default=4, help='Images per forward pass in batch_detection')
+    parser.add_argument('--batch_spool_mb', type=float, default=16, help='Memory for a zip body of batch_detection before it is spooled to disk')
+    parser.add_argument('-m','--fused_models', action='store_true', help='Run models with the same cfg as one fused network in multiple_models')
     
     #Get args
     args = parser.parse_args()
@@ -244,21 +624,55 @@ if __name__ == '__main__':
     temp_dir = args.temp_dir
     keep_files = args.keep_files
     num_threads = args.num_threads
+    server = args.server or ('waitress' if args.prod else 'flask')
+    prod = server != 'flask'
+    async_queue = args.async_queue
+    workers = args.workers
+    worker_threads = args.worker_threads
+    fanout_workers = args.fanout_workers
+    fused_models = args.fused_models
+    batch_size = args.batch_size
+    batch_wait_ms = args.batch_wait_ms
+    result_cache_mb = args.result_cache_mb
+    result_cache_ttl = args.result_cache_ttl
+    reduced_decode = not args.full_decode
+    video_batch_size = args.video_batch_size
+    image_batch_size = args.image_batch_size
+    batch_spool_mb = args.batch_spool_mb
+    if workers > 1 and (server == 'flask' or use_gpu):
+        parser.error('--workers needs --server waitress or async (or --prod) and runs on CPU only')
     
     if use_gpu == False:
         # disable GPU devices
         torch.backends.cudnn.enabled = False
         torch.cuda.is_available = lambda : False
     
-    # Initialize yolo models   
-    ground_pred     = yd.YoloDetector(weights=gr_weights_path, names=gr_names_path, cfg=gr_config_path)
-    satd_pred       = yd.YoloDetector(weights=sd_weights_path, names=sd_names_path, cfg=sd_config_path)
-    cjack_pred      = yd.YoloDetector(weights=cj_weights_path, names=cj_names_path, cfg=cj_config_path)
-    antenna_pred    = yd.YoloDetector(weights=ad_weights_path, names=ad_names_path, cfg=ad_config_path)
-    fireext_pred    = yd.YoloDetector(weights=fe_weights_path, names=fe_names_path, cfg=fe_config_path)
-    screwnuts_pred  = yd.YoloDetector(weights=sn_weights_path, names=sn_names_path, cfg=sn_config_path)
-
-    if not prod:
-        app.run(debug=False, port=port_num, threaded=False, host='0.0.0.0')
+    # Initialize yolo models
+    if workers > 1:
+        # Load once, then fork - workers share the weight pages copy-on-write (inference never writes them)
+        import worker_pool
+        # Single threaded until the fork - GNU OpenMP threads started by the warm-up forwards do not survive
+        # fork(), a worker running more intra-op threads than the parent would hang on its first forward
+        torch.set_num_threads(1)
+        init_models(start_runtime=False)
+        sock = worker_pool.bind_socket('0.0.0.0', port_num)
+
+        def serve_worker(sock):
+            signal.signal(signal.SIGHUP, lambda signum, frame: reload_configs())
+            init_runtime()
+            run_server(sock)
+
+        def log_memory(pids):
+            report = memory_report(yd.get_resident_models(), pids)
+            app.logger.info('Worker memory: {}'.format(json.dumps(report)))
+
+        worker_pool.WorkerPool(workers, serve_worker, threads_per_worker=worker_threads,
+                               on_start=log_memory, logger=app.logger).run(sock)
     else:
-        serve(app, port=port_num,  host='0.0.0.0', threads=num_threads)
\ No newline at end of file
+        init_models()
+
+        # Reload detection config and thresholds on SIGHUP (also reloaded automatically when the files change)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, lambda signum, frame: reload_configs())
+
+        run_server()
@@ -0,0 +1,68 @@
+import os
+import json
+import time
+import logging
+import threading
+
+
+class ReloadableJsonFile:
+    """JSON config file parsed once and re-parsed when its mtime changes or on request.
+
+    parse(data) turns the raw JSON into a validated object and raises ValueError on bad
+    input. A failed reload keeps the previously active value, so a bad edit never reaches
+    live requests. The file is stat-ed at most once every check_interval seconds.
+    """
+
+    def __init__(self, path, parse, check_interval=1.0, logger=None):
+        self.path = path
+        self._parse = parse
+        self._check_interval = check_interval
+        self._logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self._mtime = None
+        self._failed_mtime = None
+        self.version = 0
+        self.loaded_at = None
+        self.last_error = None
+
+        #First load must succeed
+        self._value = self._load()
+
+    def _load(self):
+        """Read, parse and validate the file"""
+        mtime = os.stat(self.path).st_mtime_ns
+        with open(self.path, 'r') as f:
+            value = self._parse(json.load(f))
+        self._mtime = mtime
+        self.version += 1
+        self.loaded_at = time.time()
+        return value
+
+    def reload(self, force=True):
+        """Re-parse the file (if changed, unless force) and swap it in atomically; returns True if swapped"""
+        with self._lock:
+            self._last_check = time.time()
+            mtime = None
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+                if not force and mtime in (self._mtime, self._failed_mtime):
+                    return False
+                value = self._load()
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                #Log a broken edit once, not on every check
+                self._failed_mtime = mtime
+                self.last_error = str(e)
+                self._logger.error('Config reload failed, keeping previous values for {}: {}'.format(self.path, e))
+                return False
+            self._value = value
+            self.last_error = None
+            self._logger.info('Config reloaded: {} (version {})'.format(self.path, self.version))
+            return True
+
+    @property
+    def value(self):
+        """Currently active parsed value, checking the file mtime at most once per check_interval"""
+        if self._check_interval is not None and time.time() - self._last_check >= self._check_interval:
+            self.reload(force=False)
+        return self._value
@@ -0,0 +1,103 @@
+#Images of a batch_detection upload - multipart files or the members of a tar/zip, read one at a time
+import os
+import zlib
+import tarfile
+import zipfile
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.tif', '.tiff', '.webp')
+MAX_IMAGE_BYTES = 64 * 2 ** 20
+
+ARCHIVE_TYPES = {'application/x-tar': 'tar', 'application/tar': 'tar', 'application/gzip': 'tar',
+                 'application/x-gzip': 'tar', 'application/x-gtar': 'tar', 'application/zip': 'zip',
+                 'application/x-zip-compressed': 'zip'}
+
+#A truncated or corrupt archive ends the listing with one error member
+ARCHIVE_ERRORS = (tarfile.TarError, zipfile.BadZipFile, zlib.error, EOFError, OSError)
+
+
+class ArchiveMember:
+    """Image of an archive: its name and bytes, or the error that kept it from being read"""
+
+    def __init__(self, name, data=None, error=None):
+        self.name = name
+        self.data = data
+        self.error = error
+
+
+def is_image_name(name):
+    return os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS
+
+
+def _member(name, size, read):
+    if size > MAX_IMAGE_BYTES:
+        return ArchiveMember(name, error='Image larger than {} MB'.format(MAX_IMAGE_BYTES // 2 ** 20))
+    return ArchiveMember(name, read())
+
+
+def _error(name, e):
+    return ArchiveMember(name, error='Archive read failed: {}'.format(e))
+
+
+class _StrictTarInfo(tarfile.TarInfo):
+    # tarfile ends the listing silently when the data stops inside a header, a cut off upload is an error here
+    @classmethod
+    def fromtarfile(cls, tar):
+        try:
+            return super(_StrictTarInfo, cls).fromtarfile(tar)
+        except (tarfile.EmptyHeaderError, tarfile.TruncatedHeaderError):
+            raise tarfile.ReadError('unexpected end of data')
+
+
+def tar_images(fileobj, name='archive'):
+    """ArchiveMembers of the image files of a (optionally gzip/bz2/xz compressed) tar, in order.
+
+    The tar is read as a stream - fileobj need not be seekable and only one member is held at a time.
+    """
+    try:
+        with tarfile.open(fileobj=fileobj, mode='r|*', tarinfo=_StrictTarInfo) as tar:
+            for info in tar:
+                if info.isfile() and is_image_name(info.name):
+                    yield _member(info.name, info.size, lambda: tar.extractfile(info).read())
+    except ARCHIVE_ERRORS as e:
+        yield _error(name, e)
+
+
+def zip_images(fileobj, name='archive'):
+    """ArchiveMembers of the image files of a zip, in order (fileobj must be seekable)"""
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if not info.is_dir() and is_image_name(info.filename):
+                    yield _member(info.filename, info.file_size, lambda: archive.read(info))
+    except ARCHIVE_ERRORS as e:
+        yield _error(name, e)
+
+
+# files - (file name, file object) of each multipart image field
+def file_images(files):
+    """ArchiveMembers of uploaded image files, each read when it is reached"""
+    for name, fileobj in files:
+        data = fileobj.read(MAX_IMAGE_BYTES + 1)
+        if len(data) > MAX_IMAGE_BYTES:
+            yield ArchiveMember(name, error='Image larger than {} MB'.format(MAX_IMAGE_BYTES // 2 ** 20))
+        else:
+            yield ArchiveMember(name, data)
+
+
+def archive_kind(filename=None, content_type=None):
+    """tar or zip from a file name or content type, None if neither"""
+    name = (filename or '').lower()
+    if name.endswith('.zip'):
+        return 'zip'
+    if name.endswith(('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')):
+        return 'tar'
+    return ARCHIVE_TYPES.get((content_type or '').split(';')[0].strip().lower())
+
+
+def archive_images(fileobj, kind, name='archive'):
+    """ArchiveMembers of a tar or zip archive"""
+    if kind == 'zip':
+        return zip_images(fileobj, name)
+    if kind == 'tar':
+        return tar_images(fileobj, name)
+    raise ValueError('Unsupported archive {!r}, expected tar or zip'.format(kind))
@@ -0,0 +1,139 @@
+#Image size and EXIF orientation read from the JPEG/PNG headers only, without decoding pixels
+import io
+import struct
+
+ORIENTATION_TAG = 274
+
+#JPEG start of frame markers (baseline, progressive, lossless, ...) - not DHT (C4), JPG (C8) or DAC (CC)
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+class ImageInfo:
+    """Format (jpeg or png), width and height of the stored pixels and EXIF orientation (0 when there is no tag)"""
+
+    def __init__(self, format, width, height, orientation=0):
+        self.format = format
+        self.width = width
+        self.height = height
+        self.orientation = orientation
+
+    @property
+    def shape(self):
+        """(height, width, 3) of the image as cv2 decodes it with the orientation applied"""
+        if self.orientation in (5, 6, 7, 8):  # transposed
+            return self.width, self.height, 3
+        return self.height, self.width, 3
+
+    def __repr__(self):
+        return 'ImageInfo(format={!r}, width={}, height={}, orientation={})'.format(
+            self.format, self.width, self.height, self.orientation)
+
+
+def exif_orientation(tiff):
+    """Orientation tag of IFD0 in a TIFF structure (the EXIF payload), 0 if missing"""
+    if len(tiff) < 8 or tiff[:2] not in (b'II', b'MM'):
+        return 0
+    order = '<' if tiff[:2] == b'II' else '>'
+    offset = struct.unpack(order + 'I', tiff[4:8])[0]
+    if offset + 2 > len(tiff):
+        return 0
+    count = struct.unpack(order + 'H', tiff[offset:offset + 2])[0]
+    for i in range(count):
+        entry = offset + 2 + 12 * i
+        if entry + 12 > len(tiff):
+            break
+        tag, type_, n = struct.unpack(order + 'HHI', tiff[entry:entry + 8])
+        if tag == ORIENTATION_TAG:
+            if type_ == 3:  # SHORT
+                return struct.unpack(order + 'H', tiff[entry + 8:entry + 10])[0]
+            if type_ == 4:  # LONG
+                return struct.unpack(order + 'I', tiff[entry + 8:entry + 12])[0]
+            return 0
+    return 0
+
+
+def probe_jpeg(f):
+    """ImageInfo from the JPEG markers up to the start of frame, None if not a JPEG"""
+    if f.read(2) != b'\xff\xd8':
+        return None
+    orientation, exif = 0, False
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':  # garbage between segments
+            byte = f.read(1)
+        while byte == b'\xff':  # fill bytes
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # no length
+            continue
+        if marker in (0xD9, 0xDA):  # end of image or start of scan before a frame header
+            return None
+        header = f.read(2)
+        if len(header) < 2:
+            return None
+        length = struct.unpack('>H', header)[0] - 2
+        if marker in SOF_MARKERS:
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>HH', frame[1:5])
+            if not height or not width:  # height defined later by a DNL marker
+                return None
+            return ImageInfo('jpeg', width, height, orientation)
+        if marker == 0xE1 and not exif:
+            segment = f.read(length)
+            if segment[:6] == b'Exif\x00\x00':  # the first EXIF segment counts, as for PIL
+                orientation, exif = exif_orientation(segment[6:]), True
+        else:
+            f.seek(length, io.SEEK_CUR)
+
+
+def probe_png(f):
+    """ImageInfo from the PNG IHDR and eXIf chunks, None if not a PNG"""
+    if f.read(8) != PNG_SIGNATURE:
+        return None
+    width = height = None
+    orientation = 0
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, kind = struct.unpack('>I4s', header)
+        if kind == b'IHDR':
+            width, height = struct.unpack('>II', f.read(8))
+            f.seek(length - 8 + 4, io.SEEK_CUR)
+        elif kind == b'eXIf':
+            orientation = exif_orientation(f.read(length))
+            f.seek(4, io.SEEK_CUR)
+        elif kind in (b'IDAT', b'IEND'):  # eXIf must come before the image data
+            break
+        else:
+            f.seek(length + 4, io.SEEK_CUR)
+    return ImageInfo('png', width, height, orientation) if width and height else None
+
+
+def probe_image(image):
+    """ImageInfo of a JPEG or PNG from its headers - image is bytes, a path or a binary file object.
+
+    Returns None for other formats or malformed headers (decode the image instead).
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    elif isinstance(image, str):
+        with open(image, 'rb') as f:
+            return probe_image(f)
+    start = image.tell()
+    try:
+        for probe in (probe_jpeg, probe_png):
+            image.seek(start)
+            info = probe(image)
+            if info is not None:
+                return info
+        return None
+    except (struct.error, ValueError, OSError):
+        return None
+    finally:
+        image.seek(start)
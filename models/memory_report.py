@@ -0,0 +1,113 @@
+import os
+import weakref
+
+import torch
+
+
+def read_smaps(pid='self'):
+    """Memory mappings of a process: list of (start, end, fields) with fields in bytes (Linux only)"""
+    regions = []
+    with open('/proc/{}/smaps'.format(pid), 'r') as f:
+        for line in f:
+            parts = line.split()
+            if '-' in parts[0] and not parts[0].endswith(':'):
+                start, end = (int(x, 16) for x in parts[0].split('-'))
+                regions.append((start, end, {}))
+            elif len(parts) == 3 and parts[2] == 'kB':
+                regions[-1][2][parts[0][:-1]] = int(parts[1]) * 1024
+    return regions
+
+
+def tensor_storage(t):
+    """Device, start address and bytes of the storage behind a tensor (untyped_storage needs torch >= 2.0)"""
+    storage = t.untyped_storage() if hasattr(t, 'untyped_storage') else t.storage()
+    return storage.device, storage.data_ptr(), storage.size() * storage.element_size()
+
+
+def tensor_ranges(models):
+    """Distinct (start, end) address ranges of the storages behind the models' parameters and buffers"""
+    ranges = set()
+    for model in models:
+        for t in list(model.parameters()) + list(model.buffers()):
+            device, start, nbytes = tensor_storage(t)
+            if device.type != 'cpu' or not nbytes:
+                continue
+            ranges.add((start, start + nbytes))
+    return sorted(ranges)
+
+
+def weight_memory(models, pid='self'):
+    """Resident memory of the mappings holding model weights in process pid.
+
+    rss counts every resident page, pss splits shared pages between the processes mapping them
+    and private is what the process would free by exiting. Mappings are counted whole; large
+    tensors get a mapping of their own, small ones share heap mappings with other data.
+    """
+    ranges = tensor_ranges(models)
+    report = {'weight_bytes': sum(end - start for start, end in ranges), 'rss': 0, 'pss': 0, 'shared': 0, 'private': 0}
+    for start, end, fields in read_smaps(pid):
+        if not any(s < end and e > start for s, e in ranges):
+            continue
+        report['rss'] += fields.get('Rss', 0)
+        report['pss'] += fields.get('Pss', 0)
+        report['shared'] += fields.get('Shared_Clean', 0) + fields.get('Shared_Dirty', 0)
+        report['private'] += fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return report
+
+
+def process_memory(pid='self'):
+    """Whole process rss/pss/private bytes"""
+    totals = {'rss': 0, 'pss': 0, 'private': 0}
+    for _, _, fields in read_smaps(pid):
+        totals['rss'] += fields.get('Rss', 0)
+        totals['pss'] += fields.get('Pss', 0)
+        totals['private'] += fields.get('Private_Clean', 0) + fields.get('Private_Dirty', 0)
+    return totals
+
+
+def sibling_pids():
+    """Pids of all children of this process' parent (the workers of a forking launcher)"""
+    ppid = os.getppid()
+    with open('/proc/{0}/task/{0}/children'.format(ppid), 'r') as f:
+        return [int(pid) for pid in f.read().split()]
+
+
+def memory_report(models, pids):
+    """Weight and process memory of each pid, plus totals over all of them"""
+    workers = {}
+    for pid in pids:
+        try:
+            workers[str(pid)] = {'weights': weight_memory(models, pid), 'process': process_memory(pid)}
+        except (OSError, IndexError):
+            continue  # worker exited
+    totals = {k: sum(w['weights'][k] for w in workers.values()) for k in ('rss', 'pss', 'private')}
+    return {'workers': workers, 'weights_total': totals}
+
+
+def peak_activation_memory(model, img, **kwargs):
+    """Peak bytes of live activations (input and module outputs) during model(img, **kwargs).
+
+    Sampled after every module call; a storage shared by in-place ops and views counts once and
+    temporaries inside a single module are not included. Device independent, weights excluded.
+    """
+    tracked, peak = [weakref.ref(img)], [0]
+
+    def hook(module, inputs, output):
+        tracked.extend(weakref.ref(t) for t in (output if isinstance(output, (tuple, list)) else (output,))
+                       if torch.is_tensor(t))
+        storages = {}
+        for ref in tracked:
+            t = ref()
+            if t is not None:
+                _, start, nbytes = tensor_storage(t)
+                storages[start] = nbytes
+        peak[0] = max(peak[0], sum(storages.values()))
+
+    handles = [m.register_forward_hook(hook) for m in model.modules()]
+    try:
+        with torch.no_grad():
+            model(img, **kwargs)
+    finally:
+        for handle in handles:
+            handle.remove()
+    return peak[0]
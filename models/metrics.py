@@ -0,0 +1,93 @@
+import bisect
+import threading
+
+
+class Counter:
+    """Monotonic count"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    """Value that goes up and down (queue depth, memory, ...)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        return self.value
+
+
+class Histogram:
+    """Count of observations per bucket (upper bounds, inclusive) plus their count and sum"""
+
+    def __init__(self, buckets):
+        self._lock = threading.Lock()
+        self.buckets = sorted(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            buckets = dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts))
+            return {'buckets': buckets, 'count': self.count, 'sum': self.sum}
+
+
+class MetricsRegistry:
+    """Named metrics, created on first use and reported together by snapshot()"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, name, factory):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = factory()
+            return self._metrics[name]
+
+    def counter(self, name):
+        return self._get(name, Counter)
+
+    def gauge(self, name):
+        return self._get(name, Gauge)
+
+    def histogram(self, name, buckets):
+        return self._get(name, lambda: Histogram(buckets))
+
+    def snapshot(self):
+        """Dict name -> current value (histograms as buckets/count/sum)"""
+        with self._lock:
+            metrics = dict(self._metrics)
+        return {name: metric.snapshot() for name, metric in sorted(metrics.items())}
+
+
+#Process wide registry served by /metrics
+metrics = MetricsRegistry()
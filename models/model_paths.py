@@ -0,0 +1,32 @@
+#Files of the served models, shared by the API, the stream monitor and the export script (importing it loads nothing)
+
+tokens_path = 'cfg/tokens.json'
+th_path = 'cfg/thresholds.json'
+
+# Config paths
+gr_weights_path = 'yolov3/weights/grounding.pt'
+gr_names_path = 'yolov3/data/grounding.names'
+gr_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
+
+sd_weights_path = 'yolov3/weights/satelite_dish.pt'
+sd_names_path = 'yolov3/data/satelite_dish.names'
+sd_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
+
+cj_weights_path = 'yolov3/weights/cable_jack.pt'
+cj_names_path = 'yolov3/data/cable_jack.names'
+cj_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
+
+ad_weights_path = 'yolov3/weights/antenna.pt'
+ad_names_path = 'yolov3/data/antenna.names'
+ad_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
+
+fe_weights_path = 'yolov3/weights/fire_extinguisher.pt'
+fe_names_path = 'yolov3/data/fire_extinguisher.names'
+fe_config_path = 'yolov3/cfg/yolov3-spp-1cls.cfg'
+
+sn_weights_path = 'yolov3/weights/screw_nuts.pt'
+sn_names_path = 'yolov3/data/screw_nuts.names'
+sn_config_path = 'yolov3/cfg/yolov3-spp-2cls.cfg'
+
+#Model names with an entry in thresholds.json
+model_names = ('grounding', 'satellite_dish', 'cable_jack', 'antenna_detection', 'fire_ext', 'screw_nuts')
@@ -0,0 +1,139 @@
+import os
+import inspect
+
+import torch
+import torch.nn as nn
+
+from yolov3.models import Darknet, get_augmentations, augment_images, decode_heads, precompute_grids
+
+
+#Inference backends of YoloDetector: torch runs the Darknet model, the others run an artefact
+#written by models/object_detector/export.py and decode its raw head outputs with torch
+#(int8 is a statically quantized TorchScript graph, see quantization.py)
+BACKENDS = ('torch', 'torchscript', 'onnxruntime', 'int8')
+ARTEFACT_EXTENSIONS = {'torchscript': '.torchscript', 'onnxruntime': '.onnx', 'int8': '.int8.torchscript'}
+
+
+def artefact_path(weights, backend):
+    """Exported model next to its weights, e.g. yolov3/weights/grounding.onnx"""
+    return os.path.splitext(weights)[0] + ARTEFACT_EXTENSIONS[backend]
+
+
+class DarknetHeads(nn.Module):
+    # Darknet up to the YOLO layers (raw head outputs), traced/exported with dynamic batch and image size
+    def __init__(self, model):
+        super(DarknetHeads, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return tuple(self.model.forward_heads(x))
+
+
+def yolo_layers_from_cfg(cfg):
+    """YOLO (decode) layers of a cfg, the only part of the torch model the exported backends need"""
+    model = Darknet(cfg).eval()
+    return [model.module_list[i] for i in model.yolo_layers]
+
+
+def export_model(model, path, backend, img_size=608, calibration=None, engine=None):
+    """Write the raw head graph of a loaded (fused, eval) Darknet model for backend.
+
+    int8 needs calibration, a list of preprocessed input images (quantization.calibration_images).
+    """
+    shape = (img_size, img_size) if isinstance(img_size, int) else tuple(img_size)
+    img = torch.zeros((1, 3) + shape)
+    heads = DarknetHeads(model).eval()  # eval before export - export restores the wrapper's mode recursively
+    with torch.no_grad():
+        if backend == 'torchscript':
+            torch.jit.save(torch.jit.trace(heads, img), path)
+        elif backend == 'int8':
+            if not calibration:
+                raise ValueError('int8 export needs calibration images')
+            from models.object_detector.quantization import quantize_heads  # torch.ao, only needed for int8
+            torch.jit.save(torch.jit.trace(quantize_heads(model, calibration, engine), img), path)
+        elif backend == 'onnxruntime':
+            names = ['head%g' % i for i in range(len(model.yolo_layers))]
+            dynamic_axes = {'images': {0: 'batch', 2: 'height', 3: 'width'}}
+            dynamic_axes.update({name: {0: 'batch', 2: name + '_height', 3: name + '_width'} for name in names})
+            kwargs = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+            torch.onnx.export(heads, img, path, input_names=['images'], output_names=names,
+                              dynamic_axes=dynamic_axes, opset_version=11, **kwargs)
+        else:
+            raise ValueError('Cannot export for backend {!r}'.format(backend))
+    return path
+
+
+class HeadsBackend:
+    """Runs an exported head graph and decodes it like Darknet.forward (called the same way).
+
+    Test-time augmentation happens around the graph: the augmented copies are added to the batch
+    before it and the outputs de-augmented after it.
+    """
+
+    def __init__(self, cfg, path):
+        self.path = path
+        self.yolo_layers = yolo_layers_from_cfg(cfg)
+
+    def run_heads(self, x):
+        raise NotImplementedError
+
+    def precompute_grids(self, shapes, device, dtype=torch.float32):
+        precompute_grids(self.yolo_layers, shapes, device, dtype)
+
+    def __call__(self, img, augment=False):
+        img_size = img.shape[-2:]
+        augmentations = get_augmentations(augment)
+        x = augment_images(img, augmentations) if augmentations else img
+        with torch.no_grad():
+            return decode_heads(self.yolo_layers, self.run_heads(x), img_size, img.shape[0], augmentations), None
+
+
+class TorchScriptBackend(HeadsBackend):
+    def __init__(self, cfg, path, device):
+        super(TorchScriptBackend, self).__init__(cfg, path)
+        self.module = torch.jit.load(path, map_location=device)
+
+    def run_heads(self, x):
+        return list(self.module(x))
+
+
+class OnnxRuntimeBackend(HeadsBackend):
+    def __init__(self, cfg, path, device, num_threads=None):
+        super(OnnxRuntimeBackend, self).__init__(cfg, path)
+        import onnxruntime  # optional, only needed for this backend
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = num_threads or torch.get_num_threads()
+        providers = ['CPUExecutionProvider']
+        if device.type == 'cuda' and 'CUDAExecutionProvider' in onnxruntime.get_available_providers():
+            providers.insert(0, 'CUDAExecutionProvider')
+        self.session = onnxruntime.InferenceSession(path, options, providers=providers)
+        self.device = device
+
+    def run_heads(self, x):
+        heads = self.session.run(None, {'images': x.cpu().float().numpy()})
+        return [torch.from_numpy(h).to(self.device) for h in heads]
+
+
+class Int8Backend(TorchScriptBackend):
+    def __init__(self, cfg, path, device):
+        if device.type != 'cpu':
+            raise ValueError('The int8 backend runs on CPU only, set "device": "cpu"')
+        from models.object_detector.quantization import default_engine  # torch.ao, only needed for int8
+        torch.backends.quantized.engine = default_engine()
+        super(Int8Backend, self).__init__(cfg, path, device)
+
+
+def load_backend(backend, cfg, weights, device):
+    """Callable running the exported model of weights with backend"""
+    path = artefact_path(weights, backend)
+    if not os.path.exists(path):
+        raise FileNotFoundError('{} not found, export it first: python3 -m models.object_detector.export --backend {}'.format(path, backend))
+    if backend == 'torchscript':
+        return TorchScriptBackend(cfg, path, device)
+    if backend == 'onnxruntime':
+        return OnnxRuntimeBackend(cfg, path, device)
+    if backend == 'int8':
+        return Int8Backend(cfg, path, device)
+    raise ValueError('Unknown backend {!r}, expected one of {}'.format(backend, ', '.join(BACKENDS)))
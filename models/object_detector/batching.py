@@ -0,0 +1,134 @@
+import time
+import queue
+import threading
+
+import torch
+
+from models.metrics import metrics as default_metrics
+
+
+#Letterbox border color (114, 114, 114) after normalization, used to pad inputs to a common shape
+PAD_VALUE = 114 / 255.0
+
+BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+WAIT_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class _Request:
+    # One image waiting for its batch
+    def __init__(self, img, img0_shape, config, scale=None):
+        self.img = img
+        self.img0_shape = img0_shape
+        self.scale = scale
+        self.config = config
+        self.enqueued = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class BatchScheduler:
+    """Coalesces concurrent requests to one YoloDetector into batched forward passes.
+
+    Callers letterbox their own image and block in submit(); a worker thread collects up to
+    max_batch_size queued inputs, waiting at most max_wait_ms after the first one, pads them
+    bottom/right with the letterbox color to a common shape, runs one forward and one
+    batched_non_max_suppression over the batch and hands each caller its own detections (boxes are
+    scaled back with each image's unpadded shape). A request that finds the queue empty
+    still waits up to max_wait_ms for company, so keep it small.
+
+    Metrics (prefix batch_<name>_): queue_depth, batch_size histogram, queue_wait_ms histogram.
+    """
+
+    def __init__(self, detector, max_batch_size=8, max_wait_ms=10, name=None, metrics=None):
+        self.detector = detector
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name or detector._name
+        metrics = metrics or default_metrics
+        prefix = 'batch_{}_'.format(self.name)
+        self._queue_depth = metrics.gauge(prefix + 'queue_depth')
+        self._batch_size = metrics.histogram(prefix + 'batch_size', BATCH_SIZE_BUCKETS)
+        self._queue_wait = metrics.histogram(prefix + 'queue_wait_ms', WAIT_MS_BUCKETS)
+
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='batch-' + self.name, daemon=True)
+        self._thread.start()
+
+    def submit(self, img0, config=None, scale=None):
+        """Detections (as YoloDetector.detect returns them) for a BGR image, computed in a shared batch"""
+        config = config or self.detector.config
+        request = _Request(self.detector.preprocess(img0, config), img0.shape, config, scale)
+        self._queue_depth.inc()
+        self._queue.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def shutdown(self):
+        """Stop the worker once the queued requests are served"""
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self, first):
+        """first plus whatever arrives before the batch is full or the wait expires"""
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                request = self._queue.get(timeout=max(0.0, deadline - time.time()))
+            except queue.Empty:
+                break
+            if request is None:
+                self._queue.put(None)  # stop after this batch
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = self._collect(first)
+            self._queue_depth.dec(len(batch))
+            self._batch_size.observe(len(batch))
+            start = time.time()
+            for request in batch:
+                self._queue_wait.observe((start - request.enqueued) * 1000)
+
+            #Requests made before and after a config reload do not share a forward
+            groups = {}
+            for request in batch:
+                groups.setdefault(id(request.config), []).append(request)
+            for requests in groups.values():
+                try:
+                    self._process(requests)
+                except Exception as e:
+                    for request in requests:
+                        request.error = e
+                finally:
+                    for request in requests:
+                        request.done.set()
+
+    def _process(self, requests):
+        """One forward and NMS for requests sharing a config"""
+        config = requests[0].config
+        if len(requests) == 1:
+            request = requests[0]
+            request.result = self.detector.detect(request.img, request.img0_shape, config, request.scale)
+            return
+
+        #Pad to a common shape at the bottom/right, so each image keeps its top-left origin
+        height = max(r.img.shape[2] for r in requests)
+        width = max(r.img.shape[3] for r in requests)
+        img = requests[0].img.new_full((len(requests), 3, height, width), PAD_VALUE)
+        for i, request in enumerate(requests):
+            img[i, :, :request.img.shape[2], :request.img.shape[3]] = request.img[0]
+
+        pred = self.detector.infer(img, config)
+        results = self.detector.postprocess_batch(pred, [r.img.shape[2:] for r in requests],
+                                                  [r.img0_shape for r in requests], config, [r.scale for r in requests])
+        for request, result in zip(requests, results):
+            request.result = result
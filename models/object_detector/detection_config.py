@@ -0,0 +1,228 @@
+import copy
+import threading
+
+from models.config_store import ReloadableJsonFile
+
+
+DEFAULT_CONFIG_PATH = 'models/object_detector/config/yolo_detection_config.json'
+
+#Parameters a model entry in the "models" section may override
+OVERRIDABLE = ('img_size', 'shape_buckets', 'conf_thres', 'iou_thres', 'classes_filter', 'agnostic_nms', 'nms',
+               'nms_top_k', 'augment', 'augmentations', 'backend')
+
+#NMS methods: merge - kept boxes are the score weighted mean of the boxes they suppress, vision - plain NMS
+NMS_METHODS = ('merge', 'vision')
+
+#Per request quality: fast runs without test-time augmentation, accurate with the configured augmentations
+QUALITIES = ('fast', 'accurate')
+
+#Test-time augmentations when a config does not list them - flip-lr + 0.9 scale and 0.7 scale
+DEFAULT_AUGMENTATIONS = [{'flip': True, 'scale': 0.9}, {'flip': False, 'scale': 0.7}]
+
+
+def parse_bool(value, key):
+    """Accept JSON booleans as well as the legacy "True"/"False" strings"""
+    if isinstance(value, bool):
+        return value
+    if value in ('True', 'False'):
+        return value == 'True'
+    raise ValueError('{} must be a boolean, got {!r}'.format(key, value))
+
+
+def parse_float(value, key, low=0.0, high=1.0):
+    """Float in [low, high], legacy strings accepted"""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        raise ValueError('{} must be a number, got {!r}'.format(key, value))
+    if not low <= value <= high:
+        raise ValueError('{} must be in [{}, {}], got {}'.format(key, low, high, value))
+    return value
+
+
+def parse_img_size(value):
+    """Inference size: int (long side, minimum rectangle padding) or (height, width)"""
+    if isinstance(value, str):
+        value = value.strip()
+        if value.startswith('('):
+            value = [x for x in value[1:-1].split(',') if x.strip()]
+    try:
+        if isinstance(value, (list, tuple)):
+            size = tuple(int(x) for x in value)
+            if len(size) != 2:
+                raise ValueError
+        else:
+            size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('img_size must be an int or (height, width), got {!r}'.format(value))
+    if any(x <= 0 or x % 32 for x in (size if isinstance(size, tuple) else (size,))):
+        raise ValueError('img_size must be positive multiples of 32, got {!r}'.format(value))
+    return size
+
+
+def parse_shape_buckets(value, img_size):
+    """None (minimum rectangle per image) or the (height, width) input shapes images are snapped to.
+
+    Buckets need an int img_size and a long side equal to it, so the image scale stays the same.
+    """
+    if value is None:
+        return None
+    if isinstance(img_size, tuple):
+        raise ValueError('shape_buckets needs an int img_size, got {!r}'.format(img_size))
+    if not isinstance(value, (list, tuple)) or not value:
+        raise ValueError('shape_buckets must be a list of [height, width], got {!r}'.format(value))
+    buckets = []
+    for bucket in value:
+        try:
+            bucket = parse_img_size(list(bucket))
+        except (TypeError, ValueError):
+            raise ValueError('shape_buckets entries must be [height, width] multiples of 32, got {!r}'.format(bucket))
+        if max(bucket) != img_size:
+            raise ValueError('shape_buckets entries must have a long side of img_size ({}), got {!r}'.format(img_size, bucket))
+        buckets.append(bucket)
+    return tuple(sorted(set(buckets), key=lambda b: (b[0] * b[1], b)))
+
+
+def parse_classes_filter(value):
+    """None (keep all classes) or a list of class indices"""
+    if value is None or value == 'None':
+        return None
+    if isinstance(value, int):
+        return [value]
+    if isinstance(value, list) and all(isinstance(x, int) for x in value):
+        return value
+    raise ValueError('classes_filter must be None or a list of class indices, got {!r}'.format(value))
+
+
+def parse_nms_top_k(value):
+    """None (no limit) or the number of highest confidence boxes per image kept before NMS"""
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, int) or value <= 0:
+        raise ValueError('nms_top_k must be null or a positive integer, got {!r}'.format(value))
+    return value
+
+
+def parse_augmentations(value):
+    """List of {"flip": bool, "scale": number} to a tuple of (flip, scale)"""
+    if not isinstance(value, list):
+        raise ValueError('augmentations must be a list of {{"flip": ..., "scale": ...}}, got {!r}'.format(value))
+    augmentations = []
+    for item in value:
+        if not isinstance(item, dict) or set(item) - {'flip', 'scale'}:
+            raise ValueError('augmentation must be {{"flip": ..., "scale": ...}}, got {!r}'.format(item))
+        flip = parse_bool(item.get('flip', False), 'flip')
+        scale = parse_float(item.get('scale', 1.0), 'scale', low=0.1, high=2.0)
+        augmentations.append((flip, scale))
+    return tuple(augmentations)
+
+
+def parse_quality(value):
+    """None (model default) or one of QUALITIES"""
+    if value is None or value == '':
+        return None
+    if value not in QUALITIES:
+        raise ValueError('quality must be one of {}, got {!r}'.format(', '.join(QUALITIES), value))
+    return value
+
+
+class DetectionConfig:
+    """Typed and validated yolo detection parameters"""
+
+    def __init__(self, data):
+        self.img_size = parse_img_size(data['img_size'])
+        self.shape_buckets = parse_shape_buckets(data.get('shape_buckets'), self.img_size)
+        self.half = parse_bool(data['half'], 'half')
+        self.conf_thres = parse_float(data['conf_thres'], 'conf_thres')
+        self.iou_thres = parse_float(data['iou_thres'], 'iou_thres')
+        self.classes_filter = parse_classes_filter(data['classes_filter'])
+        self.agnostic_nms = parse_bool(data['agnostic_nms'], 'agnostic_nms')
+        self.nms = data.get('nms', 'merge')
+        self.nms_top_k = parse_nms_top_k(data.get('nms_top_k'))
+        self.augment = parse_bool(data['augment'], 'augment')
+        self.augmentations = parse_augmentations(data.get('augmentations', DEFAULT_AUGMENTATIONS))
+        self.fuse = parse_bool(data.get('fuse', True), 'fuse')
+        self.torchscript = parse_bool(data.get('torchscript', False), 'torchscript')
+        self.backend = data.get('backend', 'torch')
+        self.device = str(data['device'])
+        self.input_type = data['input_type']
+        self.fourcc = data['fourcc']
+
+        if self.nms not in NMS_METHODS:
+            raise ValueError('nms must be one of {}, got {!r}'.format(', '.join(NMS_METHODS), self.nms))
+        if self.backend not in ('torch', 'torchscript', 'onnxruntime', 'int8'):
+            raise ValueError('backend must be torch, torchscript, onnxruntime or int8, got {!r}'.format(self.backend))
+        if self.input_type not in ('img', 'vid', 'webcam'):
+            raise ValueError('input_type must be img, vid or webcam, got {!r}'.format(self.input_type))
+
+        #Per request quality variants, filled in by parse_detection_config
+        self.variants = {}
+
+    @property
+    def tta(self):
+        """Augmentations to run - the augment argument of Darknet.forward"""
+        return self.augmentations if self.augment else ()
+
+    def for_quality(self, quality):
+        """Copy with test-time augmentation off (fast) or on (accurate)"""
+        config = copy.copy(self)
+        config.augment = quality == 'accurate'
+        return config
+
+    def __repr__(self):
+        return 'DetectionConfig({})'.format(', '.join('{}={!r}'.format(k, v) for k, v in vars(self).items() if k != 'variants'))
+
+
+def parse_detection_config(data):
+    """Build the default config and one config per entry of the "models" section"""
+    models = data.get('models', {})
+    if not isinstance(models, dict):
+        raise ValueError('models must be an object mapping model names to overrides')
+
+    configs = {None: DetectionConfig(data)}
+    for name, overrides in models.items():
+        unknown = [k for k in overrides if k not in OVERRIDABLE]
+        if unknown:
+            raise ValueError('Model {}: parameters {} cannot be overridden'.format(name, unknown))
+        merged = dict(data)
+        merged.update(overrides)
+        configs[name] = DetectionConfig(merged)
+
+    #Variants are built once per load, so requests of the same quality share one config object
+    for config in configs.values():
+        config.variants.update({quality: config.for_quality(quality) for quality in QUALITIES})
+    return configs
+
+
+class DetectionConfigFile(ReloadableJsonFile):
+    """yolo_detection_config.json, parsed once and hot reloaded on change"""
+
+    def __init__(self, path=DEFAULT_CONFIG_PATH, check_interval=1.0, logger=None):
+        super(DetectionConfigFile, self).__init__(path, parse_detection_config,
+                                                  check_interval=check_interval, logger=logger)
+
+    def get(self, name=None, quality=None):
+        """Effective config for model name (defaults when the model has no overrides) and request quality"""
+        configs = self.value
+        config = configs.get(name, configs[None])
+        return config.variants[quality] if quality else config
+
+
+#One instance per path so all detectors share a single parse and reload
+_config_files = {}
+_config_files_lock = threading.Lock()
+
+
+def get_config_file(path=DEFAULT_CONFIG_PATH):
+    """Shared DetectionConfigFile for path"""
+    with _config_files_lock:
+        if path not in _config_files:
+            _config_files[path] = DetectionConfigFile(path)
+        return _config_files[path]
+
+
+def reload_config_files():
+    """Force a reload of every loaded detection config (e.g. from a SIGHUP handler)"""
+    with _config_files_lock:
+        files = list(_config_files.values())
+    return [f.reload() for f in files]
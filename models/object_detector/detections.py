@@ -0,0 +1,119 @@
+import numpy as np
+
+
+#Response formats: legacy - the original schema (strings and four box corners), compact - numbers and one xyxy box
+RESPONSE_FORMATS = ('legacy', 'compact')
+
+
+def parse_response_format(value):
+    """Per request response format (?format=...), legacy when not given"""
+    if value is None or value == '':
+        return 'legacy'
+    if value not in RESPONSE_FORMATS:
+        raise ValueError('format must be one of {}, got {!r}'.format(', '.join(RESPONSE_FORMATS), value))
+    return value
+
+
+class Detections:
+    """Objects found in one image, array backed: it is passed through NMS, class filtering, confidence
+    intervals and box rotation, and serialized once with to_list(format) for the response.
+
+    boxes - nx4 int64 x1, y1, x2, y2 in original image pixels, scores - n float32 confidences,
+    classes - n class indices into names, conf_intervals - n 'low'/'high' once assigned (None before).
+    oriented marks boxes moved to the EXIF orientation by rotate(); the legacy format then writes
+    coordinates as numbers, as the original responses did for rotated boxes.
+    """
+
+    def __init__(self, boxes, scores, classes, names, conf_intervals=None, oriented=False):
+        self.boxes = boxes
+        self.scores = scores
+        self.classes = classes
+        self.names = names
+        self.conf_intervals = conf_intervals
+        self.oriented = oriented
+
+    @classmethod
+    def empty(cls, names):
+        return cls(np.zeros((0, 4), dtype=np.int64), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int64), names)
+
+    @classmethod
+    def from_tensor(cls, det, names):
+        """From an NMS output (nx6 x1, y1, x2, y2, conf, cls) rescaled and rounded to image pixels, or None"""
+        if det is None or not len(det):
+            return cls.empty(names)
+        det = det.cpu().numpy()
+        return cls(det[:, :4].astype(np.int64), det[:, 4].astype(np.float32), det[:, 5].astype(np.int64), names)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def __eq__(self, other):
+        return (isinstance(other, Detections) and np.array_equal(self.boxes, other.boxes) and
+                np.array_equal(self.scores, other.scores) and np.array_equal(self.classes, other.classes))
+
+    @property
+    def class_names(self):
+        return [self.names[c] for c in self.classes]
+
+    @property
+    def nbytes(self):
+        """Approximate memory held (result cache accounting)"""
+        return self.boxes.nbytes + self.scores.nbytes + self.classes.nbytes + 8 * len(self)
+
+    def select(self, keep):
+        """Detections at the boolean mask or indices keep"""
+        return Detections(self.boxes[keep], self.scores[keep], self.classes[keep], self.names,
+                          None if self.conf_intervals is None else self.conf_intervals[keep], self.oriented)
+
+    def filter_classes(self, classes_to_keep):
+        """Only the objects whose class name is in classes_to_keep"""
+        keep = np.array([name in classes_to_keep for name in self.class_names], dtype=bool)
+        return self.select(keep)
+
+    def with_conf_intervals(self, th1, th2, drop_low=True):
+        """Objects labelled low (confidence below th1) or high, low ones dropped (th2 is not used yet)"""
+        intervals = np.where(self.scores.astype(np.float64) < th1, 'low', 'high')
+        detections = Detections(self.boxes, self.scores, self.classes, self.names, intervals, self.oriented)
+        return detections.select(intervals != 'low') if drop_low else detections
+
+    def rotate(self, exif_rotation, img_shape):
+        """Boxes translated back to the original image for an EXIF orientation (0 to 8), img_shape oriented"""
+        height, width = img_shape[:2]
+        x1, y1, x2, y2 = self.boxes.T
+        if len(self) == 0:  # nothing to move, whatever the orientation
+            boxes = self.boxes
+        elif exif_rotation in (0, 1):
+            boxes = self.boxes
+        elif exif_rotation == 2:
+            boxes = np.stack((width - x2, y1, width - x1, y2), 1)
+        elif exif_rotation == 3:
+            boxes = np.stack((width - x2, height - y2, width - x1, height - y1), 1)
+        elif exif_rotation == 4:
+            boxes = np.stack((x1, height - y2, x2, height - y1), 1)
+        elif exif_rotation == 5:
+            boxes = np.stack((y1, x1, y2, x2), 1)
+        elif exif_rotation == 6:
+            boxes = np.stack((y1, width - x2, y2, width - x1), 1)
+        elif exif_rotation == 7:
+            boxes = np.stack((height - y2, width - x2, height - y1, width - x1), 1)
+        elif exif_rotation == 8:
+            boxes = np.stack((height - y2, x1, height - y1, x2), 1)
+        else:
+            raise ValueError('Boxes cannot be rotated for EXIF orientation {}'.format(exif_rotation))
+        return Detections(boxes, self.scores, self.classes, self.names, self.conf_intervals, oriented=True)
+
+    def to_list(self, format='legacy'):
+        """JSON ready list of objects in a response format"""
+        objects = []
+        names = self.class_names
+        for i, (x1, y1, x2, y2) in enumerate(self.boxes.tolist()):
+            if format == 'compact':
+                obj = {'class': names[i], 'conf': round(float(self.scores[i]), 4), 'box': [x1, y1, x2, y2]}
+            else:
+                corners = [[x1, y1], [x1, y2], [x2, y2], [x2, y1]]
+                obj = {'class': names[i], 'conf': str(float(self.scores[i])),
+                       'coordinates': [[float(x), float(y)] if self.oriented else [str(x), str(y)] for x, y in corners]}
+            if self.conf_intervals is not None:
+                obj['conf_interval'] = str(self.conf_intervals[i])
+            objects.append(obj)
+        return objects
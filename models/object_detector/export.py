@@ -0,0 +1,50 @@
+#Offline export of the API models for the torchscript, onnxruntime and int8 backends
+#Run from the repository root: python3 -m models.object_detector.export --backend onnxruntime
+#int8 also needs calibration images: --backend int8 --calibration <dir with ~32 representative images>
+import argparse
+
+import torch
+
+from models.object_detector.backends import ARTEFACT_EXTENSIONS, artefact_path, export_model
+from models.object_detector.quantization import QUANTIZED_ENGINES, calibration_images
+from models.object_detector.yolo_detection import build_model
+
+
+def export(cfg, weights, backend, img_size=608, calibration=None, engine=None):
+    """Export one cfg/weights pair (fused float model on CPU), returns the artefact path"""
+    model = build_model(cfg, weights, torch.device('cpu'), img_size=img_size, fuse=True)
+    return export_model(model, artefact_path(weights, backend), backend, img_size=img_size,
+                        calibration=calibration, engine=engine)
+
+
+if __name__ == '__main__':
+    import models.model_paths as paths
+
+    #Model files used by the API
+    models = {'grounding': (paths.gr_config_path, paths.gr_weights_path),
+              'satellite_dish': (paths.sd_config_path, paths.sd_weights_path),
+              'cable_jack': (paths.cj_config_path, paths.cj_weights_path),
+              'antenna_detection': (paths.ad_config_path, paths.ad_weights_path),
+              'fire_ext': (paths.fe_config_path, paths.fe_weights_path),
+              'screw_nuts': (paths.sn_config_path, paths.sn_weights_path)}
+
+    parser = argparse.ArgumentParser(description='Export the API models for other inference backends')
+    parser.add_argument('-b','--backend', choices=sorted(ARTEFACT_EXTENSIONS) + ['all'], default='all', help='Backend to export for')
+    parser.add_argument('-m','--models', nargs='+', choices=sorted(models), default=sorted(models), help='Models to export')
+    parser.add_argument('--img_size', type=int, default=608, help='Example input size (the exported graphs accept any size)')
+    parser.add_argument('--calibration', default=None, help='Directory of calibration images for int8')
+    parser.add_argument('--calibration_images', type=int, default=32, help='Max calibration images used')
+    parser.add_argument('--engine', choices=QUANTIZED_ENGINES, default=None, help='int8 kernels (default: x86, fbgemm on older torch, qnnpack on ARM)')
+    args = parser.parse_args()
+
+    backends = sorted(ARTEFACT_EXTENSIONS) if args.backend == 'all' else [args.backend]
+    if 'int8' in backends and not args.calibration:
+        if args.backend == 'int8':
+            parser.error('--backend int8 needs --calibration')
+        backends.remove('int8')
+    calibration = calibration_images(args.calibration, args.img_size, args.calibration_images) if 'int8' in backends else None
+    for name in args.models:
+        cfg, weights = models[name]
+        for backend in backends:
+            print('{}: {}'.format(name, export(cfg, weights, backend, img_size=args.img_size,
+                                               calibration=calibration, engine=args.engine)))
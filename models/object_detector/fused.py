@@ -0,0 +1,245 @@
+import torch
+import torch.nn as nn
+
+from yolov3.models import YOLOLayer, get_augmentations, augment_images, decode_heads
+from yolov3.utils.layers import FeatureConcat, WeightedFeatureFusion
+
+
+def topology_key(model):
+    """Hashable description of a Darknet architecture - models with equal keys can be fused"""
+    key = []
+    for mdef in model.module_defs:
+        items = []
+        for k, v in sorted(mdef.items()):
+            if hasattr(v, 'tolist'):  # anchors
+                v = v.tolist()
+            items.append((k, repr(v)))
+        key.append(tuple(items))
+    return tuple(key)
+
+
+class FusedFeatureConcat(nn.Module):
+    # Route layer over N models whose channels are laid out model-major (model 0 channels, model 1 channels, ...)
+    def __init__(self, layers, n):
+        super(FusedFeatureConcat, self).__init__()
+        self.layers = layers
+        self.n = n
+
+    def forward(self, x, outputs):
+        if len(self.layers) == 1:
+            return outputs[self.layers[0]]
+        bs, _, h, w = outputs[self.layers[0]].shape
+        x = torch.cat([outputs[i].view(bs, self.n, -1, h, w) for i in self.layers], 2)  # concat per model
+        return x.view(bs, -1, h, w)
+
+
+class FusedYOLOLayer(nn.Module):
+    # Splits the fused head output into the raw head of each model, decoded with the model's own YOLOLayer
+    def __init__(self, yolo_layers):
+        super(FusedYOLOLayer, self).__init__()
+        self.yolo_layers = nn.ModuleList(yolo_layers)
+
+    def forward(self, p):
+        return torch.split(p, p.shape[1] // len(self.yolo_layers), dim=1)
+
+
+def fuse_convs(convs, shared_input):
+    """One grouped Conv2d computing N convolutions side by side.
+
+    With shared_input (the first layer, all models read the same image) the fused conv is a
+    plain conv with the N output channel blocks stacked; otherwise input and output channels
+    are both laid out model-major and the conv uses N times the original groups.
+    """
+    c = convs[0]
+    n = len(convs)
+    groups = c.groups if shared_input else c.groups * n
+    fused = nn.Conv2d(c.in_channels if shared_input else c.in_channels * n,
+                      c.out_channels * n,
+                      kernel_size=c.kernel_size,
+                      stride=c.stride,
+                      padding=c.padding,
+                      groups=groups,
+                      bias=c.bias is not None).to(c.weight.device, c.weight.dtype)
+    with torch.no_grad():
+        fused.weight.copy_(torch.cat([x.weight for x in convs], 0))
+        if c.bias is not None:
+            fused.bias.copy_(torch.cat([x.bias for x in convs], 0))
+    return fused
+
+
+def fuse_batchnorms(bns):
+    """One BatchNorm2d over the concatenated channels of N BatchNorm2d layers"""
+    b = bns[0]
+    fused = nn.BatchNorm2d(b.num_features * len(bns), eps=b.eps, momentum=b.momentum).to(b.weight.device, b.weight.dtype)
+    with torch.no_grad():
+        for name in ('weight', 'bias', 'running_mean', 'running_var'):
+            getattr(fused, name).copy_(torch.cat([getattr(x, name) for x in bns], 0))
+    return fused
+
+
+def share_storage(modules, fused, names):
+    """Point each model's tensors at its slice of the fused tensors, so fusing costs no extra memory"""
+    for k, m in enumerate(modules):
+        for name in names:
+            t = getattr(m, name)
+            if t is None:
+                continue
+            view = getattr(fused, name).data[k * t.shape[0]:(k + 1) * t.shape[0]]
+            if isinstance(t, nn.Parameter):
+                setattr(m, name, nn.Parameter(view, requires_grad=t.requires_grad))
+            else:
+                setattr(m, name, view)
+
+
+class FusedDarknet(nn.Module):
+    """N Darknet models of identical topology executed as one wide network.
+
+    Convolutions become grouped convolutions (one group per model), batch norms are
+    concatenated, route layers concatenate per model and the YOLO heads are split back into
+    per-model outputs. forward() returns one inference output per model, equal to what each
+    model returns on its own. Raises ValueError for layers it cannot fuse.
+    """
+
+    def __init__(self, models, share_weights=True):
+        super(FusedDarknet, self).__init__()
+        keys = set(topology_key(m) for m in models)
+        if len(keys) != 1:
+            raise ValueError('Only models with identical cfg topology can be fused')
+
+        self.n = len(models)
+        self.routs = models[0].routs
+        self.releases = models[0].releases
+        self.module_list = nn.ModuleList()
+        first = True
+        for i, modules in enumerate(zip(*[m.module_list for m in models])):
+            m0 = modules[0]
+            if isinstance(m0, nn.Sequential) and len(m0) and isinstance(m0[0], nn.Conv2d):
+                fused = nn.Sequential()
+                for name, layer in m0.named_children():
+                    layers = [getattr(m, name) for m in modules]
+                    if isinstance(layer, nn.Conv2d):
+                        f = fuse_convs(layers, shared_input=first)
+                        if share_weights:
+                            share_storage(layers, f, ('weight', 'bias'))
+                    elif isinstance(layer, nn.BatchNorm2d):
+                        f = fuse_batchnorms(layers)
+                        if share_weights:
+                            share_storage(layers, f, ('weight', 'bias', 'running_mean', 'running_var'))
+                    elif isinstance(layer, (nn.LeakyReLU, nn.ReLU)):
+                        f = layer
+                    else:
+                        raise ValueError('Cannot fuse layer %g: %s' % (i, layer.__class__.__name__))
+                    fused.add_module(name, f)
+                first = False
+            elif isinstance(m0, (nn.MaxPool2d, nn.Upsample)) or \
+                    (isinstance(m0, nn.Sequential) and all(isinstance(x, (nn.ZeroPad2d, nn.MaxPool2d)) for x in m0)):
+                fused = m0  # channel agnostic
+            elif isinstance(m0, FeatureConcat):
+                fused = FusedFeatureConcat(m0.layers, self.n)
+            elif isinstance(m0, WeightedFeatureFusion) and not m0.weight:
+                fused = m0  # elementwise sum, layouts match (channel counts checked at run time)
+            elif isinstance(m0, YOLOLayer):
+                fused = FusedYOLOLayer(modules)
+            else:
+                raise ValueError('Cannot fuse layer %g: %s' % (i, m0.__class__.__name__))
+            if first and not isinstance(fused, (nn.MaxPool2d, nn.Upsample)):
+                raise ValueError('Fused models must start with a convolution')
+            self.module_list.append(fused)
+
+    def forward(self, x, augment=False):
+        """List with the inference output of every model (same as Darknet.forward(x)[0] per model)"""
+        img_size = x.shape[-2:]  # height, width
+
+        # Augment images (inference and test only) - once for all models
+        augmentations = get_augmentations(augment)
+        nb = x.shape[0]  # batch size
+        if augmentations:
+            x = augment_images(x, augmentations)
+
+        yolo_out, yolo_layers, out = [], [], []
+        for i, module in enumerate(self.module_list):
+            if isinstance(module, (FusedFeatureConcat, WeightedFeatureFusion)):
+                if isinstance(module, WeightedFeatureFusion) and any(out[j].shape[1] != x.shape[1] for j in module.layers):
+                    raise ValueError('Cannot fuse shortcut layer %g with different channel counts' % i)
+                x = module(x, out)
+            elif isinstance(module, FusedYOLOLayer):
+                yolo_out.append(module(x))
+                yolo_layers.append(module.yolo_layers)
+            else:
+                x = module(x)
+            out.append(x if self.routs[i] else [])
+            for j in self.releases[i]:
+                out[j] = []  # release outputs no later layer reads
+
+        #Decode (and de-augment) per model
+        return [decode_heads(layers, heads, img_size, nb, augmentations)
+                for layers, heads in zip(zip(*yolo_layers), zip(*yolo_out))]
+
+
+class FusedDetectors:
+    """Groups YoloDetectors by cfg topology and runs each group of two or more as one FusedDarknet.
+
+    Detectors whose topology differs from every other detector stay on per-model execution.
+    A group's fused pass computes all of its models, so it is only used when a request needs
+    more than half of them.
+    """
+
+    def __init__(self, detectors, share_weights=True):
+        groups = {}
+        for name, detector in detectors.items():
+            if detector.model is None:
+                continue  # exported backend, no torch model to fuse
+            param = next(detector.model.parameters())
+            key = (topology_key(detector.model), str(param.device), param.dtype)
+            groups.setdefault(key, []).append(name)
+
+        self.groups = []
+        for names in groups.values():
+            if len(names) < 2:
+                continue
+            model = FusedDarknet([detectors[name].model for name in names], share_weights=share_weights).eval()
+            self.groups.append((names, model))
+
+    def plan(self, names, input_keys):
+        """Split requested model names into fused groups (names, model) and names to run per model.
+
+        input_keys maps each name to its detector's current input_key(); a group is only fused
+        when all of its requested models take the same input tensor.
+        """
+        fused, rest = [], set(names)
+        for group_names, model in self.groups:
+            requested = [name for name in group_names if name in rest]
+            if len(set(input_keys[name] for name in requested)) > 1:
+                continue
+            if len(requested) >= 2 and 2 * len(requested) > len(group_names):
+                fused.append((group_names, model))
+                rest.difference_update(requested)
+        return fused, [name for name in names if name in rest]
+
+    @staticmethod
+    def infer(model, group_names, img, configs):
+        """Raw output per model name of fused passes (configs: name -> DetectionConfig of requested models).
+
+        One pass per distinct set of augmentations among the requested models; models without
+        TTA take the un-augmented part of any pass.
+        """
+        needed = set(config.tta for config in configs.values())
+        if len(needed) > 1:
+            needed.discard(())
+        with torch.no_grad():
+            runs = {tta: model(img, augment=tta) for tta in needed}
+
+        preds = {}
+        for i, name in enumerate(group_names):
+            if name not in configs:
+                continue
+            tta = configs[name].tta
+            if tta in runs:
+                pred = runs[tta][i]
+            else:
+                # Keep only the un-augmented copy of the batch
+                tta = next(iter(runs))
+                pred = runs[tta][i]
+                pred = pred[:, :pred.shape[1] // (1 + len(tta))]
+            preds[name] = pred.float()
+        return preds
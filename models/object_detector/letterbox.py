@@ -0,0 +1,97 @@
+import threading
+import collections
+
+import cv2
+import numpy as np
+import torch
+
+
+#Letterbox border color, as yolov3.utils.datasets.letterbox pads
+PAD_COLOR = 114
+
+
+def letterbox_geometry(shape, new_shape, auto=True):
+    """Placement of an image of shape (height, width) by yolov3 letterbox at new_shape (int or (height, width)).
+
+    Returns ((height, width) of the padded input, (height, width) of the resized image, top, left),
+    with the same rounding as letterbox, so both produce identical inputs.
+    """
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    new_unpad = int(round(shape[1] * r)), int(round(shape[0] * r))
+    dw, dh = new_shape[1] - new_unpad[0], new_shape[0] - new_unpad[1]
+    if auto:  # minimum rectangle
+        dw, dh = np.mod(dw, 64), np.mod(dh, 64)
+    dw /= 2
+    dh /= 2
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    height, width = new_unpad[1], new_unpad[0]
+    return (height + top + bottom, width + left + right), (height, width), top, left
+
+
+class InputBuffers(threading.local):
+    """Per thread float32 NCHW input tensors and uint8 scratch buffers, reused across requests.
+
+    letterbox() resizes and splits the image into the scratch and writes the padded, RGB, 0-1 input
+    straight into the tensor of its (slot, shape), so steady-state serving allocates no image sized
+    arrays. The tensor is overwritten by the thread's next letterbox() for the same slot and shape:
+    use it (forward pass) before letterboxing the next image, and give inputs needed at the same
+    time distinct slots.
+    """
+
+    max_tensors = 16
+
+    def __init__(self):
+        self.tensors = collections.OrderedDict()  # (slot, height, width) -> 1x3xHxW float32
+        self.scratch = {}  # name -> flat uint8 array, grown to the largest image seen
+        self.pad = torch.full((), PAD_COLOR, dtype=torch.uint8).div(255.0)  # as the uint8 input normalizes
+
+    def tensor(self, slot, shape):
+        key = (slot,) + tuple(shape)
+        tensor = self.tensors.get(key)
+        if tensor is None:
+            tensor = self.tensors[key] = torch.empty((1, 3) + tuple(shape), dtype=torch.float32)
+            if len(self.tensors) > self.max_tensors:
+                self.tensors.popitem(last=False)
+        else:
+            self.tensors.move_to_end(key)
+        return tensor
+
+    def array(self, name, shape):
+        """uint8 array of shape in the scratch buffer name"""
+        size = int(np.prod(shape))
+        buffer = self.scratch.get(name)
+        if buffer is None or buffer.size < size:
+            buffer = self.scratch[name] = np.empty(size, dtype=np.uint8)
+        return buffer[:size].reshape(shape)
+
+    def planes(self, img0, shape):
+        """B, G and R planes of img0 resized (INTER_LINEAR) to shape (height, width), in scratch buffers"""
+        if img0.shape[:2] != tuple(shape):
+            img0 = cv2.resize(img0, (shape[1], shape[0]), dst=self.array('resized', tuple(shape) + (3,)),
+                              interpolation=cv2.INTER_LINEAR)
+        planes = self.array('planes', (3,) + tuple(shape))
+        cv2.split(img0, list(planes))
+        return planes
+
+    def letterbox(self, img0, new_shape, auto=True, slot=None):
+        """1x3xHxW float32 input of a BGR uint8 image, equal to letterbox + BGR to RGB + CHW + float / 255"""
+        shape, (height, width), top, left = letterbox_geometry(img0.shape[:2], new_shape, auto)
+        tensor = self.tensor(slot, shape)
+        img = tensor[0]
+
+        #Border strips only, the image area is overwritten below
+        img[:, :top].fill_(self.pad)
+        img[:, top + height:].fill_(self.pad)
+        img[:, top:top + height, :left].fill_(self.pad)
+        img[:, top:top + height, left + width:].fill_(self.pad)
+
+        #Channel swap by plane order, uint8 to float and scaling in one pass per channel
+        planes = torch.from_numpy(self.planes(img0, (height, width)))
+        for c in range(3):
+            torch.div(planes[2 - c], 255.0, out=img[c, top:top + height, left:left + width])
+        return tensor
+
+input_buffers = InputBuffers()
@@ -0,0 +1,69 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+
+
+class ParallelDetectors:
+    """Runs several YoloDetectors on one decoded image concurrently.
+
+    The image is letterboxed and normalized once per distinct detector input (img_size,
+    device, precision) and the shared tensor is dispatched to all detectors on a thread pool.
+    Each pool thread limits torch intra-op parallelism to its share of the cores, so the
+    models run side by side instead of oversubscribing the CPU (the limit is per thread on
+    OpenMP builds of torch). With a FusedDetectors engine, models sharing a cfg topology run as
+    one wide forward pass instead of one pass each.
+    """
+
+    def __init__(self, max_workers=None, intra_op_threads=None, fused=None):
+        self.fused = fused
+        total_threads = torch.get_num_threads()
+        self.max_workers = max_workers or max(1, min(6, os.cpu_count() or 1))
+        self.intra_op_threads = intra_op_threads or max(1, total_threads // self.max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                            thread_name_prefix='detector',
+                                            initializer=torch.set_num_threads,
+                                            initargs=(self.intra_op_threads,))
+
+    def predict(self, detectors, img0, quality=None, scale=None):
+        """Run detectors (dict name -> YoloDetector) on a BGR image, returns dict name -> Detections.
+
+        scale - (x, y) factors from img0 pixels to original image pixels when img0 was decoded reduced
+        """
+        #Config snapshot per model, so a hot reload cannot change parameters mid-request
+        configs = {name: detector.get_config(quality) for name, detector in detectors.items()}
+
+        #Letterbox and normalize once per distinct input
+        keys = {name: detector.input_key(configs[name]) for name, detector in detectors.items()}
+        inputs = {}
+        for name, detector in detectors.items():
+            if keys[name] not in inputs:
+                inputs[keys[name]] = detector.preprocess(img0, configs[name])
+
+        def run(name):
+            img = inputs[keys[name]]
+            return {name: detectors[name].detect(img, img0.shape, configs[name], scale)}
+
+        def run_fused(group_names, model):
+            requested = {name: configs[name] for name in group_names if name in detectors}
+            img = inputs[keys[next(iter(requested))]]
+            preds = self.fused.infer(model, group_names, img, requested)
+            return {name: detectors[name].postprocess(preds[name], img.shape[2:], img0.shape, configs[name], scale)
+                    for name in requested}
+
+        #Same-topology groups run fused, the rest per model
+        fused_groups, names = self.fused.plan(list(detectors), keys) if self.fused else ([], list(detectors))
+        tasks = [(run_fused, group) for group in fused_groups] + [(run, (name,)) for name in names]
+
+        #Single task or single worker - no thread hop
+        results = {}
+        if len(tasks) == 1 or self.max_workers == 1:
+            for func, args in tasks:
+                results.update(func(*args))
+        else:
+            for future in [self._executor.submit(func, *args) for func, args in tasks]:
+                results.update(future.result())
+        return {name: results[name] for name in detectors}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
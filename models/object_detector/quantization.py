@@ -0,0 +1,128 @@
+import copy
+import glob
+import os
+
+import cv2
+import torch
+import torch.nn as nn
+try:
+    from torch.ao import quantization
+except ImportError:  # torch < 1.10
+    from torch import quantization
+
+from yolov3.utils.layers import FeatureConcat, WeightedFeatureFusion
+
+
+#Quantized engines by CPU architecture: x86 (fbgemm/onednn kernels) and qnnpack for ARM
+QUANTIZED_ENGINES = ('x86', 'fbgemm', 'qnnpack')
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class QuantizableConcat(nn.Module):
+    # Route layer on quantized tensors - the inputs are requantized to a common scale
+    def __init__(self, layers):
+        super(QuantizableConcat, self).__init__()
+        self.layers = layers
+        self.op = nn.quantized.FloatFunctional()
+
+    def forward(self, x, outputs):
+        if len(self.layers) == 1:
+            return outputs[self.layers[0]]
+        return self.op.cat([outputs[i] for i in self.layers], 1)
+
+
+class QuantizableShortcut(nn.Module):
+    # Unweighted shortcut on quantized tensors (all shortcuts of the yolov3 cfgs add equal shapes)
+    def __init__(self, layers):
+        super(QuantizableShortcut, self).__init__()
+        self.layers = layers
+        self.ops = nn.ModuleList(nn.quantized.FloatFunctional() for _ in layers)
+
+    def forward(self, x, outputs):
+        for i, op in zip(self.layers, self.ops):
+            x = op.add(x, outputs[i])
+        return x
+
+
+class QuantizableHeads(nn.Module):
+    # Darknet up to the raw YOLO head outputs (like backends.DarknetHeads) with quantize/dequantize stubs
+    def __init__(self, model):
+        super(QuantizableHeads, self).__init__()
+        self.module_list = nn.ModuleList()
+        for module in model.module_list:
+            if isinstance(module, FeatureConcat):
+                module = QuantizableConcat(module.layers)
+            elif isinstance(module, WeightedFeatureFusion):
+                if module.weight:
+                    raise ValueError('Weighted shortcuts cannot be quantized')
+                module = QuantizableShortcut(module.layers)
+            else:
+                module = copy.deepcopy(module)
+                for m in module.modules():
+                    if isinstance(m, nn.LeakyReLU):
+                        m.inplace = False  # not supported by quantized::leaky_relu
+            self.module_list.append(module)
+        self.routs = model.routs
+        self.releases = model.releases
+        self.yolo_layers = model.yolo_layers
+        self.quant = quantization.QuantStub()
+        self.dequant = nn.ModuleList(quantization.DeQuantStub() for _ in model.yolo_layers)
+
+    def forward(self, x):
+        x = self.quant(x)
+        heads, out = [], []
+        for i, module in enumerate(self.module_list):
+            if isinstance(module, (QuantizableConcat, QuantizableShortcut)):
+                x = module(x, out)
+            elif i in self.yolo_layers:
+                heads.append(self.dequant[len(heads)](x))
+            else:
+                x = module(x)
+            out.append(x if self.routs[i] else [])
+            for j in self.releases[i]:
+                out[j] = []  # release outputs no later layer reads
+        return tuple(heads)
+
+
+def default_engine():
+    """Quantized engine for this CPU and torch build - x86, then fbgemm (older torch), then qnnpack (ARM)"""
+    supported = torch.backends.quantized.supported_engines
+    return next((engine for engine in QUANTIZED_ENGINES if engine in supported), 'qnnpack')
+
+
+def calibration_images(directory, img_size, limit=32):
+    """Letterboxed and normalized 1x3xHxW float inputs for the images in directory"""
+    from models.object_detector.yolo_detection import letterbox_image
+
+    paths = sorted(p for p in glob.glob(os.path.join(directory, '*')) if p.lower().endswith(IMAGE_EXTENSIONS))
+    if not paths:
+        raise FileNotFoundError('No calibration images in {}'.format(directory))
+    images = []
+    for path in paths[:limit]:
+        img = torch.from_numpy(letterbox_image(cv2.imread(path), img_size)).float()
+        images.append((img / 255.0).unsqueeze(0))
+    return images
+
+
+def quantize_heads(model, images, engine=None):
+    """Statically quantized int8 head graph of a fused (Conv+BN folded) float Darknet model.
+
+    Weights are quantized per output channel, activations per tensor with ranges observed while
+    running images (calibration inputs) through the model.
+    """
+    engine = engine or default_engine()
+    if engine not in torch.backends.quantized.supported_engines:
+        raise ValueError('Quantized engine {!r} not supported here, available: {}'.format(
+            engine, ', '.join(torch.backends.quantized.supported_engines)))
+    torch.backends.quantized.engine = engine
+
+    heads = QuantizableHeads(model).eval()
+    heads.qconfig = quantization.get_default_qconfig(engine)  # per channel weights, histogram activations
+    for module in heads.modules():
+        if isinstance(module, nn.Sequential) and 'BatchNorm2d' in module._modules:
+            raise ValueError('Fuse Conv+BN before quantizing (build_model(..., fuse=True))')
+    quantization.prepare(heads, inplace=True)
+    with torch.no_grad():
+        for img in images:
+            heads(img.float())
+    return quantization.convert(heads, inplace=True)
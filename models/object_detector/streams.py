@@ -0,0 +1,216 @@
+import time
+import threading
+
+import cv2
+
+from models.metrics import metrics as default_metrics
+
+
+LAG_MS_BUCKETS = (50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+
+
+class Frame:
+    """Decoded frame of a stream: its index in the stream, wall clock capture time and BGR image"""
+
+    def __init__(self, stream, index, captured_at, img):
+        self.stream = stream
+        self.index = index
+        self.captured_at = captured_at
+        self.img = img
+
+
+class LatestFrame:
+    """Single slot holding the newest frame of a stream.
+
+    A frame that is not taken before the next one arrives is replaced (dropped), so the consumer
+    always gets the freshest frame and memory holds at most one frame per stream.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._frame = None
+
+    def put(self, frame):
+        """Store frame, True if it replaced one that was never taken"""
+        with self._lock:
+            dropped = self._frame is not None
+            self._frame = frame
+        return dropped
+
+    def take(self):
+        """Newest frame not taken yet, None if there is none"""
+        with self._lock:
+            frame, self._frame = self._frame, None
+        return frame
+
+
+class StreamReader:
+    """Decoder thread of one camera (RTSP/HTTP URL) or video file writing into a LatestFrame.
+
+    Every frame is grabbed to keep up with the source; at most fps frames per second are
+    retrieved (decoded to BGR), the others are skipped. A live source that fails is reopened
+    after reconnect_delay. A file stands in for a camera: it is read at its own frame rate
+    (realtime, the default for files) and, with loop, restarted at its end; otherwise the reader
+    stops there.
+
+    Metrics (prefix stream_<name>_): frames_decoded, frames_dropped (replaced before inference), reconnects.
+    """
+
+    def __init__(self, name, source, fps=None, realtime=None, loop=False, reconnect_delay=2.0,
+                 on_frame=None, metrics=None, logger=None):
+        self.name = name
+        self.source = source
+        self.fps = fps
+        self.live = '://' in source
+        self.realtime = not self.live if realtime is None else realtime
+        self.loop = loop
+        self.reconnect_delay = reconnect_delay
+        self.on_frame = on_frame  # called after each new frame (wakes the scheduler)
+        self.logger = logger
+        self.latest = LatestFrame()
+        self.finished = False
+
+        metrics = metrics or default_metrics
+        prefix = 'stream_{}_'.format(name)
+        self._decoded = metrics.counter(prefix + 'frames_decoded')
+        self._dropped = metrics.counter(prefix + 'frames_dropped')
+        self._reconnects = metrics.counter(prefix + 'reconnects')
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stream-' + name, daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _log(self, message):
+        if self.logger is not None:
+            self.logger.warning('Stream {}: {}'.format(self.name, message))
+
+    def _run(self):
+        index = 0
+        while not self._stop.is_set():
+            cap = cv2.VideoCapture(self.source)
+            if cap.isOpened():
+                index = self._read(cap, index)
+            else:
+                self._log('cannot open {}'.format(self.source))
+            cap.release()
+            if self._stop.is_set() or not (self.live or self.loop):
+                break
+            if self.live:
+                self._reconnects.inc()
+                self._stop.wait(self.reconnect_delay)
+        self.finished = True
+        if self.on_frame is not None:
+            self.on_frame()
+
+    def _read(self, cap, index):
+        """Grab frames of an opened capture until it ends or the reader stops, returns the next frame index"""
+        source_fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+        start, position = time.time(), 0
+        next_due = 0.0
+        while not self._stop.is_set():
+            if self.realtime:  # a file plays at its frame rate, like a camera
+                delay = start + position / source_fps - time.time()
+                if delay > 0:
+                    self._stop.wait(delay)
+            if not cap.grab():
+                if self.live:
+                    self._log('stream lost')
+                return index
+            now = time.time()
+            frame_index = index
+            position += 1
+            index += 1
+            if self.fps and now < next_due:
+                continue
+            ok, img = cap.retrieve()
+            if not ok:
+                continue
+            next_due = max(next_due + 1.0 / self.fps, now) if self.fps else now
+            self._decoded.inc()
+            if self.latest.put(Frame(self.name, frame_index, now, img)):
+                self._dropped.inc()
+            if self.on_frame is not None:
+                self.on_frame()
+        return index
+
+
+class StreamMonitor:
+    """Runs one detector on the freshest frame of every stream, the streams batched in one forward pass.
+
+    Each step takes the newest frame of each reader that has one (older frames were dropped by the
+    readers), up to max_batch_size frames, letterboxes them to a common shape and calls
+    on_result(frame, detections, lag_ms) per stream, lag being the time from the frame's capture
+    to its detections.
+
+    Metrics: stream_<name>_frames_processed and stream_<name>_lag_ms per stream,
+    stream_monitor_batch_size histogram.
+    """
+
+    def __init__(self, detector, readers, quality=None, max_batch_size=8, on_result=None, metrics=None):
+        self.detector = detector
+        self.readers = readers
+        self.quality = quality
+        self.max_batch_size = max_batch_size
+        self._next = 0  # reader the next step starts with
+        self.on_result = on_result
+        self._wake = threading.Event()
+        for reader in readers:
+            reader.on_frame = self._wake.set
+
+        metrics = metrics or default_metrics
+        self._processed = {r.name: metrics.counter('stream_{}_frames_processed'.format(r.name)) for r in readers}
+        self._lag = {r.name: metrics.histogram('stream_{}_lag_ms'.format(r.name), LAG_MS_BUCKETS) for r in readers}
+        self._batch_size = metrics.histogram('stream_monitor_batch_size', BATCH_SIZE_BUCKETS)
+
+    def step(self, timeout=1.0):
+        """One forward over the newest frames, number of frames processed (0 if none arrived within timeout)"""
+        self._wake.wait(timeout)
+        self._wake.clear()
+
+        #Round robin start, so with more streams than max_batch_size every stream gets its turn
+        frames = []
+        for i in range(len(self.readers)):
+            reader = self.readers[(self._next + i) % len(self.readers)]
+            frame = reader.latest.take()
+            if frame is not None:
+                frames.append(frame)
+                if len(frames) == self.max_batch_size:
+                    self._next = (self._next + i + 1) % len(self.readers)
+                    self._wake.set()  # frames may be left for the next step
+                    break
+        if not frames:
+            return 0
+
+        #Config snapshot per step, so a reload applies from the next batch
+        config = self.detector.get_config(self.quality)
+        detections = self.detector.detect_images([frame.img for frame in frames], config)
+        done = time.time()
+        self._batch_size.observe(len(frames))
+        for frame, result in zip(frames, detections):
+            lag_ms = (done - frame.captured_at) * 1000
+            self._processed[frame.stream].inc()
+            self._lag[frame.stream].observe(lag_ms)
+            if self.on_result is not None:
+                self.on_result(frame, result, lag_ms)
+        return len(frames)
+
+    def run(self, stop=None):
+        """Process frames until stop (threading.Event) is set or every reader has finished"""
+        stop = stop or threading.Event()
+        for reader in self.readers:
+            reader.start()
+        try:
+            while not stop.is_set():
+                if not self.step() and all(reader.finished for reader in self.readers):
+                    break
+        finally:
+            for reader in self.readers:
+                reader.stop()
@@ -0,0 +1,123 @@
+import math
+import queue
+import threading
+
+import cv2
+
+
+def parse_sample_rate(value, default=1.0):
+    """Frames per second analysed (?sample_rate=...), default when not given"""
+    if value is None or value == '':
+        return default
+    try:
+        rate = float(value)
+    except ValueError:
+        rate = 0.0
+    if not rate > 0 or math.isinf(rate):
+        raise ValueError('sample_rate must be a positive number of frames per second, got {!r}'.format(value))
+    return rate
+
+
+class VideoFrames:
+    """Sampled frames of a video file, decoded once and in order.
+
+    With sample_rate (frames per second kept) only every step-th frame is retrieved, as
+    YoloDetector.predict(video=True) samples them; the others are only grabbed, so they are
+    never converted to BGR, copied or letterboxed.
+    Iterating yields (frame index, seconds from the start or None if the fps is unknown, BGR image).
+    """
+
+    def __init__(self, path, sample_rate=None):
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            self.cap.release()
+            raise ValueError('Not a readable video')
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 0.0
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        self.step = int(math.ceil(self.fps / sample_rate)) if sample_rate and self.fps else 1
+        self.step = max(1, self.step)
+
+    def __iter__(self):
+        index = 0
+        while self.cap.grab():
+            if index % self.step == 0:
+                ok, img = self.cap.retrieve()
+                if not ok:
+                    break
+                yield index, index / self.fps if self.fps else None, img
+            index += 1
+
+    def close(self):
+        self.cap.release()
+
+
+def prefetch(iterable, size):
+    """Items of iterable produced by a background thread at most size items ahead of the consumer.
+
+    Decoding continues while the consumer runs the models. Closing the generator (or a client
+    going away) stops the thread at its next item.
+    """
+    items = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item, error=None):
+        """False once the consumer is gone"""
+        while not stop.is_set():
+            try:
+                items.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in iterable:
+                if not put(item):
+                    return
+            put(done)
+        except Exception as e:
+            put(done, e)
+
+    thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+    thread.start()
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is done:
+                return
+            yield item
+    finally:
+        stop.set()
+        thread.join()
+
+
+def detect_video(frames, detectors, configs, batch_size=4):
+    """Detections of every sampled frame, frame by frame as the video is decoded.
+
+    frames - VideoFrames, detectors - dict name -> YoloDetector, configs - their config snapshots.
+    Sampled frames are run through each model batch_size at a time; memory is bounded by the
+    batch and the prefetched frames, whatever the video length.
+    Yields (frame index, seconds, dict name -> Detections).
+    """
+    batch = []
+    for frame in prefetch(frames, 2 * batch_size):
+        if batch and frame[2].shape != batch[0][2].shape:  # a stream changing resolution
+            yield from _detect_batch(batch, detectors, configs)
+            batch = []
+        batch.append(frame)
+        if len(batch) == batch_size:
+            yield from _detect_batch(batch, detectors, configs)
+            batch = []
+    if batch:
+        yield from _detect_batch(batch, detectors, configs)
+
+
+def _detect_batch(batch, detectors, configs):
+    imgs = [img for _, _, img in batch]
+    results = {name: detector.detect_images(imgs, configs[name]) for name, detector in detectors.items()}
+    for i, (index, seconds, _) in enumerate(batch):
+        yield index, seconds, {name: results[name][i] for name in detectors}
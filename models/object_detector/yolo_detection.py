@@ -1,12 +1,239 @@
 import os
 import json
 import cv2
+import datetime
+import hashlib
+import warnings
+import threading
+import collections
 
 from yolov3.models import *
 from yolov3.utils.datasets import *
 from yolov3.utils.utils import *
 import torch
 
+from models.object_detector.detection_config import DEFAULT_CONFIG_PATH, get_config_file
+from models.object_detector.batching import BatchScheduler, PAD_VALUE
+from models.object_detector.backends import load_backend
+from models.object_detector.detections import Detections
+from models.object_detector.letterbox import input_buffers, letterbox_geometry
+
+
+#Process-wide registry of resident models, keyed by (cfg, weights, device, half)
+#Detectors built from the same files share one model instance
+_model_registry = {}
+_registry_lock = threading.Lock()
+
+
+def model_memory_bytes(model):
+    """Bytes held by model parameters and buffers"""
+    tensors = list(model.parameters()) + list(model.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+
+def file_checksum(path, chunk_size=2 ** 20):
+    """SHA-256 of a file's contents"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def build_model(cfg, weights, device, img_size=608, half=False, warmup_augment=False, fuse=True):
+    """Build, load and warm up a Darknet model for inference (not registered, see load_model)"""
+    # Initialize model
+    model = Darknet(cfg, img_size)
+
+    # Load weights
+    attempt_download(weights)
+    if weights.endswith('.pt'):  # pytorch format
+        model.load_state_dict(torch.load(weights, map_location=device)['model'])
+    else:  # darknet format
+        load_darknet_weights(model, weights)
+
+    # Eval mode
+    model.to(device).eval()
+
+    # Inference only - fold BatchNorm into the convolutions and freeze the weights
+    if fuse:
+        model.fuse()
+    model.requires_grad_(False)
+
+    # Half precision
+    if half:
+        model.half()
+
+    # Warm up - first forward pays for allocator and kernel initialization
+    with torch.no_grad():
+        shape = (img_size, img_size) if isinstance(img_size, int) else tuple(img_size)
+        img = torch.zeros((1, 3) + shape, device=device)
+        model(img.half() if half else img, augment=warmup_augment)
+    return model
+
+
+def load_model(cfg, weights, device, img_size=608, half=False, warmup_augment=False, fuse=True, backend='torch'):
+    """Return the resident model for cfg/weights, building, loading and warming it on first use.
+
+    With a backend other than torch the exported artefact of weights is loaded instead (see backends.py).
+    """
+    key = (cfg, weights, str(device), half, fuse, backend)
+    with _registry_lock:
+        if key in _model_registry:
+            entry = _model_registry[key]
+            entry['users'] += 1
+            return entry['model']
+
+        t0 = time.time()
+        if backend == 'torch':
+            model = build_model(cfg, weights, device, img_size=img_size, half=half,
+                                warmup_augment=warmup_augment, fuse=fuse)
+            parameters, memory_bytes = sum(p.numel() for p in model.parameters()), model_memory_bytes(model)
+            path = weights
+        else:
+            model = load_backend(backend, cfg, weights, device)
+
+            # Warm up - the runtime allocates and optimizes on the first run
+            shape = (img_size, img_size) if isinstance(img_size, int) else tuple(img_size)
+            model(torch.zeros((1, 3) + shape, device=device), augment=warmup_augment)
+            parameters, memory_bytes = None, os.path.getsize(model.path)
+            path = model.path
+
+        _model_registry[key] = {
+            'model': model,
+            'cfg': cfg,
+            'weights': weights,
+            'backend': backend,
+            'device': str(device),
+            'half': half,
+            'fused': fuse,
+            'parameters': parameters,
+            'memory_bytes': memory_bytes,
+            'sha256': file_checksum(path),
+            'loaded_at': datetime.datetime.now().isoformat(),
+            'load_seconds': round(time.time() - t0, 3),
+            'users': 1,
+        }
+        return model
+
+
+class TracedModel:
+    """Darknet inference as TorchScript graphs, traced and frozen on first use of each input.
+
+    Called like the model (model(img, augment)[0] is the inference output). A graph is specific
+    to an input shape, dtype and augment flag; the max_graphs most recently used are kept.
+    """
+
+    def __init__(self, model, max_graphs=32):
+        self.model = model
+        self.max_graphs = max_graphs
+        self._graphs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _trace(self, img, augment):
+        model = self.model
+
+        class Inference(nn.Module):
+            def __init__(self):
+                super(Inference, self).__init__()
+                self.model = model
+
+            def forward(self, x):
+                return self.model(x, augment=augment)[0]
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')  # shape dependent python values are expected to be constants
+            with torch.no_grad():
+                return torch.jit.freeze(torch.jit.trace(Inference().eval(), img))
+
+    def __call__(self, img, augment=False):
+        key = (tuple(img.shape), img.dtype, augment)
+        with self._lock:
+            graph = self._graphs.get(key)
+            if graph is None:
+                graph = self._graphs[key] = self._trace(img, augment)
+                if len(self._graphs) > self.max_graphs:
+                    self._graphs.popitem(last=False)
+            else:
+                self._graphs.move_to_end(key)
+        with torch.no_grad():
+            return graph(img), None
+
+
+def snap_shape(shape, img_size, shape_buckets):
+    """Smallest bucket (height, width) holding an image of shape (height, width) resized to img_size.
+
+    Falls back to the img_size square, which holds any image.
+    """
+    r = img_size / max(shape[:2])
+    h, w = round(shape[0] * r), round(shape[1] * r)
+    for bucket in shape_buckets:  # sorted by area
+        if bucket[0] >= h and bucket[1] >= w:
+            return bucket
+    return img_size, img_size
+
+
+def input_shapes(config):
+    """Every letterboxed input shape a config can produce, None if not a fixed set"""
+    if isinstance(config.img_size, tuple):
+        return [config.img_size]
+    if config.shape_buckets:
+        return list(config.shape_buckets) + [(config.img_size, config.img_size)]
+    return None
+
+
+def letterbox_target(shape, img_size, shape_buckets=None):
+    """letterbox new_shape and auto (minimum rectangle) for an image of shape.
+
+    With shape_buckets the image is padded to its bucket instead of the minimum rectangle.
+    """
+    if shape_buckets:
+        return snap_shape(shape, img_size, shape_buckets), False
+    return img_size, True
+
+
+def letterbox_image(img0, img_size, shape_buckets=None):
+    """Padded resize and BGR HWC to RGB CHW of an in-memory image, as LoadImages does for files"""
+    new_shape, auto = letterbox_target(img0.shape, img_size, shape_buckets)
+    img = letterbox(img0, new_shape=new_shape, auto=auto)[0]
+    img = img[:, :, ::-1].transpose(2, 0, 1)  # BGR to RGB, to 3x416x416
+    return np.ascontiguousarray(img)
+
+
+def format_detection(xyxy, conf, cls, names):
+    """Response object of one detection - class name, confidence and the four box corners, as strings"""
+    x0, y0 = int(xyxy[0]), int(xyxy[1])
+    x1, y1 = int(xyxy[0]), int(xyxy[3])
+    x2, y2 = int(xyxy[2]), int(xyxy[3])
+    x3, y3 = int(xyxy[2]), int(xyxy[1])
+
+    return {
+            'class': names[int(cls)],
+            'conf': str(float(conf)),
+            'coordinates': [[str(x0), str(y0)],
+                            [str(x1), str(y1)],
+                            [str(x2), str(y2)],
+                            [str(x3), str(y3)]]
+        }
+
+
+def get_model_registry():
+    """Describe resident models: memory footprint, load timestamp and number of detectors using them"""
+    with _registry_lock:
+        return [{k: v for k, v in entry.items() if k != 'model'} for entry in _model_registry.values()]
+
+
+def get_model_checksum(model):
+    """SHA-256 of the weights (or exported artefact) a resident model was loaded from"""
+    with _registry_lock:
+        return next(entry['sha256'] for entry in _model_registry.values() if entry['model'] is model)
+
+
+def get_resident_models():
+    """Every resident torch model instance"""
+    with _registry_lock:
+        return [entry['model'] for entry in _model_registry.values() if entry['backend'] == 'torch']
+
 
 class YoloDetector:
 
@@ -15,69 +242,212 @@ class YoloDetector:
                  names,
                  cfg,
                  mode='str',
+                 name=None,
+                 yolo_config=DEFAULT_CONFIG_PATH,
+                 backend=None,
                 ):
         
         self._mode = mode
         self._weights = weights
         self._cfg = cfg
         self._names = names
+        self._name = name
 
-        
+        # Detection config - parsed once, shared by all detectors, hot reloaded on change
+        self._config_file = get_config_file(yolo_config)
+        config = self.config
+
+        # Initialize
+        self.backend = backend or config.backend
+        self._device = torch_utils.select_device(config.device)
+        self._half = config.half and self._device.type != 'cpu' and self.backend == 'torch'  # half precision only supported on CUDA
+
+        # Build, load and warm up the model once, it stays resident for all predict calls
+        model = load_model(self._cfg, self._weights, self._device, img_size=config.img_size, half=self._half,
+                           warmup_augment=config.tta, fuse=config.fuse, backend=self.backend)
+
+        # Version of the loaded model, part of the result cache key
+        self.checksum = get_model_checksum(model)
+
+        # Forward callable - the model itself, its TorchScript graphs or an exported backend
+        # (model is the torch Darknet, None for exported backends)
+        if self.backend == 'torch':
+            self.model = model
+            self._forward = TracedModel(model) if config.torchscript else model
+        else:
+            self.model = None
+            self._forward = model
+
+        # Grids of the fixed input shapes are made once here, not on the first requests
+        shapes = input_shapes(config)
+        if shapes:
+            model.precompute_grids(shapes, self._device, torch.float16 if self._half else torch.float32)
+
+        # Get names and colors
+        self._class_names = load_classes(self._names)
+        self._colors = [[random.randint(0, 255) for _ in range(3)] for _ in range(len(self._class_names))]
+
+        # Micro-batching of concurrent requests, off until enable_batching
+        self.scheduler = None
+
+    @property
+    def config(self):
+        """Effective detection config for this model (defaults plus per-model overrides)"""
+        return self._config_file.get(self._name)
+
+    def get_config(self, quality=None):
+        """Effective config for a request quality (fast - no TTA, accurate - TTA, None - model default)"""
+        return self._config_file.get(self._name, quality)
+
+    def input_key(self, config=None):
+        """Detectors with equal keys accept the same preprocessed input tensor"""
+        config = config or self.config
+        return (config.img_size, config.shape_buckets, str(self._device), self._half)
+
+    def cache_key(self, quality=None):
+        """Model version and effective detection parameters - equal keys give equal results for an image"""
+        config = self.get_config(quality)
+        return (self._name, self.checksum, self.backend, config.img_size, config.shape_buckets, config.conf_thres,
+                config.iou_thres, config.classes_filter, config.agnostic_nms, config.nms, config.nms_top_k, config.tta)
+
+    def preprocess(self, img0, config=None):
+        """Letterboxed and normalized 1x3xHxW input tensor for an in-memory BGR image.
+
+        On CPU it is written into a per thread buffer of this input key (see letterbox.InputBuffers),
+        overwritten by the thread's next preprocess with the same key and input shape.
+        """
+        config = config or self.config
+        if self._device.type == 'cpu':
+            new_shape, auto = letterbox_target(img0.shape, config.img_size, config.shape_buckets)
+            return input_buffers.letterbox(img0, new_shape, auto, slot=self.input_key(config))
+        img = torch.from_numpy(letterbox_image(img0, config.img_size, config.shape_buckets)).to(self._device)
+        img = img.half() if self._half else img.float()  # uint8 to fp16/32
+        img /= 255.0  # 0 - 255 to 0.0 - 1.0
+        return img.unsqueeze(0)
+
+    def infer(self, img, config=None):
+        """Raw (float) model output for a preprocessed input"""
+        config = config or self.config
+        with torch.no_grad():
+            pred = self._forward(img, augment=config.tta)[0]
+        return pred.float() if self._half else pred
+
+    def postprocess_batch(self, pred, img_shapes, img0_shapes, config=None, scales=None):
+        """NMS over a batch of raw outputs - Detections per image.
+
+        img_shapes are the letterboxed (unpadded) input shapes, img0_shapes the shapes of the decoded images
+        and scales their optional (x, y) factors to original image pixels (reduced JPEG decode).
+        """
+        config = config or self.config
+        with torch.no_grad():
+            dets = batched_non_max_suppression(pred, config.conf_thres, config.iou_thres, multi_label=False,
+                                               classes=config.classes_filter, agnostic=config.agnostic_nms,
+                                               method=config.nms, max_candidates=config.nms_top_k)
+
+        results = []
+        for det, img_shape, img0_shape, scale in zip(dets, img_shapes, img0_shapes, scales or [None] * len(dets)):
+            if det is not None and len(det):
+                # Rescale boxes from img_size to im0 size (and on to the original image)
+                det[:, :4] = scale_coords(img_shape, det[:, :4], img0_shape)
+                if scale is not None:
+                    det[:, [0, 2]] *= scale[0]
+                    det[:, [1, 3]] *= scale[1]
+                det[:, :4] = det[:, :4].round()
+            results.append(Detections.from_tensor(det, self._class_names))
+        return results
+
+    def postprocess(self, pred, img_shape, img0_shape, config=None, scale=None):
+        """NMS of the raw output of one image - Detections of the objects found in the image"""
+        return self.postprocess_batch(pred, [img_shape], [img0_shape], config, [scale])[0]
+
+    def detect(self, img, img0_shape, config=None, scale=None):
+        """Forward and NMS of a preprocessed input - Detections of the objects found in the image"""
+        return self.postprocess(self.infer(img, config), img.shape[2:], img0_shape, config, scale)
+
+    def detect_image(self, img0, config=None, scale=None):
+        """Detections of an in-memory BGR image, in a shared batch when batching is enabled.
+
+        scale - (x, y) factors from img0 pixels to original image pixels when img0 was decoded reduced
+        """
+        config = config or self.config
+        if self.scheduler is not None:
+            return self.scheduler.submit(img0, config, scale)
+        return self.detect(self.preprocess(img0, config), img0.shape, config, scale)
+
+    def detect_images(self, imgs0, config=None, scales=None, pad=True):
+        """Detections of each of several BGR images (video or camera frames) in one forward and NMS.
+
+        Inputs of different shapes are padded bottom/right to a common shape, as BatchScheduler pads them;
+        with pad=False they are grouped by input shape instead, one forward per shape, so each result
+        equals detect_image. scales are the optional (x, y) factors to original image pixels.
+        """
+        config = config or self.config
+        shapes = [letterbox_geometry(img0.shape[:2], *letterbox_target(img0.shape, config.img_size, config.shape_buckets))[0]
+                  for img0 in imgs0]
+        scales = scales or [None] * len(imgs0)
+        if not pad and len(set(shapes)) > 1:
+            results = [None] * len(imgs0)
+            for shape in dict.fromkeys(shapes):
+                group = [i for i, s in enumerate(shapes) if s == shape]
+                detections = self.detect_images([imgs0[i] for i in group], config, [scales[i] for i in group])
+                for i, det in zip(group, detections):
+                    results[i] = det
+            return results
+        img = None
+        for i, img0 in enumerate(imgs0):
+            frame = self.preprocess(img0, config)  # reused buffer, copied out before the next image
+            if img is None:
+                height, width = max(h for h, _ in shapes), max(w for _, w in shapes)
+                img = frame.new_full((len(imgs0), 3, height, width), PAD_VALUE)
+            img[i, :, :frame.shape[2], :frame.shape[3]] = frame[0]
+        pred = self.infer(img, config)
+        return self.postprocess_batch(pred, shapes, [img0.shape for img0 in imgs0], config, scales)
+
+    def enable_batching(self, max_batch_size=8, max_wait_ms=10):
+        """Coalesce concurrent in-memory predict calls into batched forwards (see BatchScheduler)"""
+        self.scheduler = BatchScheduler(self, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+    # path - image/video file path or an already decoded BGR image (numpy array)
     def predict(self, path,
                 save_img=False, save_txt=False, output_path='test_data/output',
-                yolo_config='models/object_detector/config/yolo_detection_config.json',
+                yolo_config=None,
                 video = False,
-                video_sample_rate = 1
+                video_sample_rate = 1,
+                quality = None
                ):
         
-        # parse config file that contains parameters for yolo detection process
-        with open(yolo_config, 'r') as f:
-            data = json.load(f)
-            img_size = tuple(int(x) for x in data['img_size'][1:-1].split(','))
-            half = data['half'] == 'True'
-            conf_thres = float(data['conf_thres'])
-            iou_thres = float(data['iou_thres'])
-            classes_filter = None if data['classes_filter'] == 'None' else data['classes_filter']
-            agnostic_nms = data['agnostic_nms'] == 'True'
-            augment = data['augment'] == 'True'
-            device = data['device']
-            input_type = data['input_type']
-            fourcc = data['fourcc']
-#             print(img_size, half, conf_thres, iou_thres, classes_filter, augment, agnostic_nms, device)
+        # detection parameters - parsed once and cached, yolo_config only needed to use a different file
+        # quality - fast (no TTA), accurate (TTA) or None (model default)
+        config = self.get_config(quality) if yolo_config is None else get_config_file(yolo_config).get(self._name, quality)
+
+        # In-memory image - preprocess, forward, NMS and formatting only
+        if isinstance(path, np.ndarray) and not (save_img or save_txt or video):
+            return json.dumps({'image': self.detect_image(path, config).to_list()})
+        img_size = config.img_size  # int (long side) or (height, width)
+        conf_thres = config.conf_thres
+        iou_thres = config.iou_thres
+        classes_filter = config.classes_filter
+        agnostic_nms = config.agnostic_nms
+        augment = config.tta
+        input_type = config.input_type
+        fourcc = config.fourcc
         
         with torch.no_grad():
-            img_size = 608  # if ONNX_EXPORT else img_size  # (320, 192) or (416, 256) or (608, 352) for (height, width)
 
-            # Initialize
-            if ONNX_EXPORT or ("CUDA_VISIBLE_DEVICES" in os.environ and os.environ["CUDA_VISIBLE_DEVICES"] == "-1"):
-                device = 'cpu'
-            
-            device = torch_utils.select_device()
+            # Resident model
+            device = self._device
+            model = self._forward
+            half = self._half
             if save_img or save_txt:
                 if os.path.exists(output_path):
                     shutil.rmtree(output_path)  # delete output folder
                 os.makedirs(output_path)  # make new output folder
 
-            # Initialize model
-            model = Darknet(self._cfg, img_size)
-
-            # Load weights
-            attempt_download(self._weights)
-            if self._weights.endswith('.pt'):  # pytorch format
-                model.load_state_dict(torch.load(self._weights, map_location=device)['model'])
-            else:  # darknet format
-                load_darknet_weights(model, self._weights)
-
-            # Eval mode
-            model.to(device).eval()
-
-            # Fuse Conv2d + BatchNorm2d layers
-            # model.fuse()
-
             # Export mode
             if ONNX_EXPORT:
-                model.fuse()
-                img = torch.zeros((1, 3) + img_size)  # (1, 3, 320, 192)
+                model = self.model
+                model.fuse()  # no-op when already fused at load
+                img = torch.zeros((1, 3) + ((img_size, img_size) if isinstance(img_size, int) else img_size))  # (1, 3, 320, 192)
                 f = self._weights.replace(self._weights.split('.')[-1], 'onnx')  # *.onnx filename
                 torch.onnx.export(model, img, f, verbose=False, opset_version=11)
 
@@ -88,11 +458,6 @@ class YoloDetector:
                 print(onnx.helper.printable_graph(model.graph))  # Print a human readable representation of the graph
                 return
 
-            # Half precision
-            half = half and device.type != 'cpu'  # half precision only supported on CUDA
-            if half:
-                model.half()
-
             # Set Dataloader
             vid_path, vid_writer = None, None
             view_img = False
@@ -101,12 +466,17 @@ class YoloDetector:
                 view_img = True
                 torch.backends.cudnn.benchmark = True  # set True to speed up constant image size inference
                 dataset = LoadStreams(path, img_size=img_size)
+            elif isinstance(path, np.ndarray):
+                # In-memory image - no disk round trip
+                img0 = path
+                path = 'image'
+                dataset = [(path, letterbox_image(img0, img_size, config.shape_buckets), img0, None)]
             else:
                 dataset = LoadImages(path, img_size=img_size)
 
             # Get names and colors
-            names = load_classes(self._names)
-            colors = [[random.randint(0, 255) for _ in range(3)] for _ in range(len(names))]
+            names = self._class_names
+            colors = self._colors
 
             # Run inference
             t0 = time.time()
@@ -149,8 +519,9 @@ class YoloDetector:
                     pred = pred.float()
 
                 # Apply NMS
-                pred = non_max_suppression(pred, conf_thres, iou_thres, multi_label=False,
-                                           classes=classes_filter, agnostic=agnostic_nms)
+                pred = batched_non_max_suppression(pred, conf_thres, iou_thres, multi_label=False,
+                                                   classes=classes_filter, agnostic=agnostic_nms,
+                                                   method=config.nms, max_candidates=config.nms_top_k)
                 # Process detections
                 for i, det in enumerate(pred):  # detections per image
                     if input_type == 'webcam':  # batch_size >= 1
@@ -179,19 +550,7 @@ class YoloDetector:
                                 label = '%s %.2f' % (names[int(cls)], conf)
                                 plot_one_box(xyxy, im0, label=label, color=colors[int(cls)])
 
-                            x0, y0 = int(xyxy[0]), int(xyxy[1])
-                            x1, y1 = int(xyxy[0]), int(xyxy[3])
-                            x2, y2 = int(xyxy[2]), int(xyxy[3])
-                            x3, y3 = int(xyxy[2]), int(xyxy[1])
-                            
-                            to_add = {
-                                    'class': names[int(cls)],
-                                    'conf': str(float(conf)),
-                                    'coordinates': [[str(x0), str(y0)],
-                                                    [str(x1), str(y1)],
-                                                    [str(x2), str(y2)],
-                                                    [str(x3), str(y3)]]                            
-                                }
+                            to_add = format_detection(xyxy, conf, cls, names)
                             if video:
                                 to_add['frame'] = str(frame)
                             
@@ -212,7 +571,7 @@ class YoloDetector:
 
                     # Save results (image with detections)
                     if save_img:
-                        if dataset.mode == 'images':
+                        if getattr(dataset, 'mode', 'images') == 'images':
                             cv2.imwrite(save_path, im0)
                         else:
                             if vid_path != save_path:  # new video
@@ -0,0 +1,80 @@
+import time
+import threading
+import collections
+
+from models.metrics import metrics
+
+
+class ResultCache:
+    """LRU cache of API results (Detections or response strings) with a memory bound and a time to live.
+
+    Keys describe everything a response depends on (image content hash, model version,
+    effective parameters, confidence thresholds), so a changed model or config never
+    hits an old entry; old entries are evicted as the least recently used or expired.
+    Entries are accounted at their size (len of a string unless given) plus a fixed overhead.
+
+    Metrics (prefix result_cache_): hits, misses, evictions, entries, bytes.
+    """
+
+    ENTRY_OVERHEAD = 256  # bytes of key, hash and bookkeeping per entry (approximate)
+
+    def __init__(self, max_bytes=64 * 2 ** 20, ttl=None, name='result_cache'):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()  # key -> (response, expires_at, size)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._hits = metrics.counter(name + '_hits')
+        self._misses = metrics.counter(name + '_misses')
+        self._evictions = metrics.counter(name + '_evictions')
+        self._entries_gauge = metrics.gauge(name + '_entries')
+        self._bytes_gauge = metrics.gauge(name + '_bytes')
+
+    def _remove(self, key):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+    def _update_gauges(self):
+        self._entries_gauge.set(len(self._entries))
+        self._bytes_gauge.set(self._bytes)
+
+    def get(self, key):
+        """Cached response for key, None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.monotonic():
+                self._remove(key)
+                self._update_gauges()
+                entry = None
+            if entry is None:
+                self._misses.inc()
+                return None
+            self._entries.move_to_end(key)
+        self._hits.inc()
+        return entry[0]
+
+    def put(self, key, response, size=None):
+        """Store response for key, evicting least recently used entries beyond max_bytes"""
+        size = (len(response) if size is None else size) + self.ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (response, expires_at, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._evictions.inc()
+            self._update_gauges()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self._update_gauges()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,47 @@
+from models.config_store import ReloadableJsonFile
+
+
+def parse_model_thresholds(name, value):
+    """{"th1": low/high confidence boundary, "th2": ...} of one model, both in [0, 1] and th1 <= th2"""
+    if not isinstance(value, dict):
+        raise ValueError('Thresholds of {} must be an object with th1 and th2, got {!r}'.format(name, value))
+    thresholds = {}
+    for key in ('th1', 'th2'):
+        th = value.get(key)
+        if isinstance(th, bool) or not isinstance(th, (int, float)) or not 0 <= th <= 1:
+            raise ValueError('{} of {} must be a number between 0 and 1, got {!r}'.format(key, name, th))
+        thresholds[key] = float(th)
+    if thresholds['th1'] > thresholds['th2']:
+        raise ValueError('th1 of {} must not exceed th2, got {th1} > {th2}'.format(name, **thresholds))
+    return thresholds
+
+
+def parse_thresholds(data, models=()):
+    """Validated thresholds per model name; every name in models must be present"""
+    if not isinstance(data, dict):
+        raise ValueError('Thresholds must be an object mapping model names to thresholds')
+    missing = [name for name in models if name not in data]
+    if missing:
+        raise ValueError('No thresholds for models {}'.format(missing))
+    return {name: parse_model_thresholds(name, value) for name, value in data.items()}
+
+
+class ThresholdStore(ReloadableJsonFile):
+    """thresholds.json held in memory: validated once, hot reloaded when the file changes or on reload().
+
+    A reload replaces the whole table at once, so a request sees either the old or the new
+    thresholds of a model, and an invalid edit keeps the previous ones active.
+    """
+
+    def __init__(self, path, models=(), check_interval=1.0, logger=None):
+        super(ThresholdStore, self).__init__(path, lambda data: parse_thresholds(data, models),
+                                             check_interval=check_interval, logger=logger)
+
+    def get(self, model):
+        """{"th1": ..., "th2": ...} of model"""
+        return self.value[model]
+
+    def active(self):
+        """Active thresholds with their version and load time"""
+        return {'path': self.path, 'version': self.version, 'loaded_at': self.loaded_at,
+                'last_error': self.last_error, 'thresholds': self.value}
@@ -1,93 +1,160 @@
 import numpy as np
 import datetime
 import os
-import json
+import io
+import hashlib
+import threading
+import tempfile
 from PIL import Image
 import cv2
 
+from models.image_probe import probe_image
 
-def save_image(image, prefix, temp_dir, app_logger, debug=False):
-    """Save image"""
+
+def temp_image_path(filename, prefix, temp_dir):
+    """Descriptive unique path in temp_dir for a received file"""
     #Time str
     rand_ext = np.random.randint(10e6)
     time_str = datetime.datetime.now().strftime("%Y_%m_%d_%H:%M:%S_%f") + '_' + str(rand_ext)
     
     #Extension
-    suffix = image.filename.split('.')[-1].lower()
-    
-    #For debug
-    if debug:
-        app_logger.info('Received File Name: {}'.format(image.filename))
-    
-    #Save image
-    save_path = os.path.join(temp_dir, '{}_{}.{}'.format(prefix, time_str, suffix))
-    image.save(save_path)
-            
-    return save_path, time_str
-
-def take_first_element(resp):
-    """Reformat Yolo results"""
-    keys = list(resp.keys())
-    if len(keys) > 0:
-        return json.dumps(resp[keys[0]])
-    else:
-        return json.dumps([])
-
-def load_parameter_from_config(config_path, param):
-    """Return value of a parameter from config file"""
-    with open(config_path, 'r') as f:
-        params = json.load(f)
-    return params[param]
-
-def add_ci(c, th1, th2):
-    """Add Confidence Interval"""
-    if c < th1:
-        return 'low'
-#     elif c < th2:
-#         return 'mid'
-    else:
-        return 'high'
-
-def add_confidence_interval(resp, img_path, model, cfg_path='cfg/thresholds.json', rotate_boxes=True):
-    """Add low/high, optionally rotate boxes"""
-    objects = json.loads(resp)
-    if len(objects) == 0:
-        return resp
-    else:
-        #Load params
-        th_dict = load_parameter_from_config(cfg_path, model)
-        #Add CI for each object
-        new_objects = []
-        #For BB rotation
-        if rotate_boxes:
-            exif_rotation = get_image_exif_rotation(img_path)
-            img_shape = cv2.imread(img_path).shape
-        for obj in objects:
-            c = float(obj['conf'])
-            obj['conf_interval'] = add_ci(c, th_dict['th1'], th_dict['th2'])
-            #Rotate BBs
-            if 'coordinates' in obj:
-                if rotate_boxes and len(obj['coordinates']) != 0:
-                    obj['coordinates'] = rotate_box(obj['coordinates'], exif_rotation, img_shape)
-            #Filter low conf
-            if obj['conf_interval'] != 'low':
-                new_objects.append(obj)
-        #Return objects with CI
-        return json.dumps(new_objects)
-
-
-def filter_response(resp, classes_to_keep):
-    """Filter low conf objects"""
-    objects = json.loads(resp)
-
-    #Filtered objects
-    filtered_objects = [obj for obj in objects if obj['class'] in classes_to_keep]
-
-    #Return filtered
-    return json.dumps(filtered_objects)
+    suffix = filename.split('.')[-1].lower()
+
+    return os.path.join(temp_dir, '{}_{}.{}'.format(prefix, time_str, suffix)), time_str
+
+def save_image_async(image, prefix, temp_dir, app_logger):
+    """Write a decoded upload's original bytes to temp_dir in a background thread (debugging only)"""
+    save_path, _ = temp_image_path(image.filename, prefix, temp_dir)
+
+    def write():
+        try:
+            with open(save_path, 'wb') as f:
+                f.write(image.data)
+        except OSError as e:
+            app_logger.error('Could not keep file {}: {}'.format(save_path, e))
+
+    threading.Thread(target=write, daemon=True).start()
+    return save_path
+
+def temp_upload_path(filename, temp_dir=None):
+    """New empty temporary file, with the upload's extension, for an upload that is read from disk (videos)"""
+    suffix = os.path.splitext(filename or '')[1].lower()
+    fd, path = tempfile.mkstemp(suffix=suffix, dir=temp_dir)
+    os.close(fd)
+    return path
+
+def apply_exif_orientation(img, exif_rotation):
+    """Orient decoded pixels the way cv2.imread does for the EXIF orientation tag"""
+    if exif_rotation == 2:
+        return cv2.flip(img, 1)
+    elif exif_rotation == 3:
+        return cv2.flip(img, -1)
+    elif exif_rotation == 4:
+        return cv2.flip(img, 0)
+    elif exif_rotation == 5:
+        return cv2.transpose(img)
+    elif exif_rotation == 6:
+        return cv2.flip(cv2.transpose(img), 1)
+    elif exif_rotation == 7:
+        return cv2.flip(cv2.transpose(img), -1)
+    elif exif_rotation == 8:
+        return cv2.flip(cv2.transpose(img), 0)
+    return img
+
+class ImageDecodeError(ValueError):
+    """Uploaded bytes that are not a readable image"""
+
+#libjpeg DCT domain scaling: decode flags by reduction factor
+REDUCED_DECODE_FLAGS = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+
+def jpeg_reduction(info, min_size):
+    """Largest JPEG decode reduction (1, 2, 4 or 8) keeping the long image side at least min_size"""
+    if info is None or info.format != 'jpeg' or not min_size:
+        return 1
+    long_side = max(info.width, info.height)
+    return max(k for k in REDUCED_DECODE_FLAGS if -(-long_side // k) >= min_size or k == 1)
+
+class DecodedImage:
+    """Uploaded image decoded once in memory: BGR pixels (oriented as cv2.imread returns them), EXIF rotation and shape.
+
+    Pixels are decoded on first use of img, so a request answered from the result cache only
+    hashes the bytes (digest); exif_rotation and shape come from the JPEG/PNG headers until then.
+    With min_size, a large JPEG is decoded at 1/2, 1/4 or 1/8 scale in the DCT domain (long side
+    still at least min_size, e.g. the inference size); shape stays the original image shape and
+    scale maps img pixels back to it.
+    """
+
+    def __init__(self, data, filename='image.jpg', min_size=None):
+        self.data = data
+        self.filename = filename
+        self.min_size = min_size
+        self._img = None
+        self._exif_rotation = None
+        self._digest = None
+        self._info = None
+
+    @property
+    def digest(self):
+        """SHA-256 of the uploaded bytes"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    @property
+    def info(self):
+        """ImageInfo (size and EXIF orientation) read from the headers, None if not a JPEG/PNG"""
+        if self._info is None:
+            self._info = probe_image(self.data) or False
+        return self._info or None
+
+    @property
+    def exif_rotation(self):
+        #EXIF - from the headers, PIL for other formats
+        if self._exif_rotation is None:
+            info = self.info
+            self._exif_rotation = info.orientation if info is not None else get_image_exif_rotation(io.BytesIO(self.data))
+        return self._exif_rotation
+
+    @property
+    def reduction(self):
+        """Decode reduction factor, 1 for a full resolution decode"""
+        return jpeg_reduction(self.info, self.min_size)
+
+    @property
+    def img(self):
+        #Decode
+        if self._img is None:
+            flags = REDUCED_DECODE_FLAGS[self.reduction] | cv2.IMREAD_IGNORE_ORIENTATION
+            img = cv2.imdecode(np.frombuffer(self.data, dtype=np.uint8), flags)
+            if img is None:
+                raise ImageDecodeError('Image decode failed ' + str(self.filename))
+            self._img = apply_exif_orientation(img, self.exif_rotation)
+        return self._img
+
+    @property
+    def shape(self):
+        #Oriented (height, width, 3) of the original image - from the headers when available
+        if self.info is not None:
+            return self.info.shape
+        return self.img.shape
+
+    @property
+    def scale(self):
+        """(x, y) factors from img pixels to original image pixels, None for a full resolution decode"""
+        if self.reduction == 1:
+            return None
+        return self.shape[1] / self.img.shape[1], self.shape[0] / self.img.shape[0]
+
+    @classmethod
+    def from_upload(cls, image, min_size=None):
+        """Decode a Flask FileStorage without touching the disk"""
+        return cls(image.read(), image.filename, min_size)
 
 def get_image_exif_rotation(image):
-    """Get image exif rotation"""
+    """Get image exif rotation - image is a path or a file object (JPEG/PNG headers are read directly)"""
+    info = probe_image(image)
+    if info is not None:
+        return info.orientation
     img = Image.open(image)
     exif_data = img._getexif()
     if not exif_data:
@@ -96,49 +163,3 @@ def get_image_exif_rotation(image):
         return 0
     else:
         return exif_data[274]
-
-def minmax_to_all_corners(x_min, y_min, x_max, y_max, clockwise=False):
-        """Converts (x1,y1,x2,y2) to four points."""
-        if clockwise:
-            new_poly = [[x_min, y_min], [x_max, y_min],
-                        [x_max, y_max], [x_min, y_max]]
-        else:
-            new_poly = [[x_min, y_min], [x_min, y_max],
-                        [x_max, y_max], [x_max, y_min]]
-        return new_poly
-
-def rotate_box(box, exif_rotation, img_shape):
-    """Bounding Box(BB) rotation for translating four image BBs back to the original image."""
-    #Height/width
-    img_width = img_shape[1]
-    img_height = img_shape[0]
-
-    #Get min/max x/y
-    x_min = min(float(box[0][0]), float(box[1][0]), float(box[2][0]), float(box[3][0]))
-    x_max = max(float(box[0][0]), float(box[1][0]), float(box[2][0]), float(box[3][0]))
-
-    y_min = min(float(box[0][1]), float(box[1][1]), float(box[2][1]), float(box[3][1]))
-    y_max = max(float(box[0][1]), float(box[1][1]), float(box[2][1]), float(box[3][1]))
-
-    if exif_rotation == 0 or exif_rotation == 1:
-        new_x_min = x_min
-        new_x_max = x_max
-        new_y_min = y_min
-        new_y_max = y_max
-    elif exif_rotation == 6:
-        new_x_min = y_min
-        new_x_max = y_max
-        new_y_min = img_width - x_max
-        new_y_max = img_width - x_min
-    elif exif_rotation == 3:
-        new_x_min = img_width - x_max
-        new_x_max = img_width - x_min
-        new_y_min = img_height - y_max
-        new_y_max = img_height - y_min
-    elif exif_rotation == 8:
-        new_x_min = img_height - y_max
-        new_x_max = img_height - y_min
-        new_y_min = x_min
-        new_y_max = x_max
-
-    return minmax_to_all_corners(new_x_min, new_y_min, new_x_max, new_y_max)        
\ No newline at end of file
@@ -0,0 +1,141 @@
+#Headless monitoring of tower-site cameras: one detector run continuously on the newest frame of every stream
+#Run: python3 stream_monitor.py --model antenna_detection --stream cam1=rtsp://... --stream cam2=site2.mp4 --fps 2
+import sys
+import json
+import time
+import signal
+import logging
+import argparse
+import datetime
+import threading
+
+import torch
+
+import models.model_paths as paths
+import models.object_detector.yolo_detection as yd
+from models.object_detector.detection_config import parse_quality
+from models.object_detector.detections import RESPONSE_FORMATS
+from models.object_detector.streams import StreamReader, StreamMonitor
+from models.thresholds import ThresholdStore
+from models.metrics import metrics
+
+
+#Weights, names, cfg, model name and class filter of each detector (as served by image_api)
+MODELS = {'grounding_detection': (paths.gr_weights_path, paths.gr_names_path, paths.gr_config_path, 'grounding', []),
+          'satellite_dish_detection': (paths.sd_weights_path, paths.sd_names_path, paths.sd_config_path, 'satellite_dish', []),
+          'cablejack_detection': (paths.cj_weights_path, paths.cj_names_path, paths.cj_config_path, 'cable_jack', []),
+          'antenna_detection': (paths.ad_weights_path, paths.ad_names_path, paths.ad_config_path, 'antenna_detection', []),
+          'fireextinguisher_detection': (paths.fe_weights_path, paths.fe_names_path, paths.fe_config_path, 'fire_ext', []),
+          'screwnuts_detection': (paths.sn_weights_path, paths.sn_names_path, paths.sn_config_path, 'screw_nuts', ['double_nut'])}
+
+logger = logging.getLogger('stream_monitor')
+
+
+def parse_pairs(values, option):
+    """NAME=VALUE arguments as a dict"""
+    pairs = {}
+    for value in values:
+        name, sep, rest = value.partition('=')
+        if not sep or not name or not rest:
+            raise ValueError('{} expects NAME=VALUE, got {!r}'.format(option, value))
+        pairs[name] = rest
+    return pairs
+
+
+# model - endpoint name, out - text file the NDJSON lines are written to, thresholds - ThresholdStore
+# response_format - legacy or compact
+def result_writer(model, out, thresholds, response_format='legacy'):
+    """on_result callback writing one JSON line per processed frame, filtered and with confidence intervals"""
+    _, _, _, model_name, filter_list = MODELS[model]
+    lock = threading.Lock()
+
+    def write(frame, detections, lag_ms):
+        if len(filter_list) > 0:
+            detections = detections.filter_classes(filter_list)
+        th = thresholds.get(model_name)
+        detections = detections.with_conf_intervals(th['th1'], th['th2'])
+        line = json.dumps({'stream': frame.stream, 'frame': frame.index,
+                           'time': datetime.datetime.fromtimestamp(frame.captured_at).isoformat(),
+                           'lag_ms': round(lag_ms, 1), 'detections': detections.to_list(response_format)})
+        with lock:
+            out.write(line + '\n')
+            out.flush()
+    return write
+
+
+def log_metrics(stop, interval):
+    """Log the stream metrics every interval seconds until stop is set"""
+    while not stop.wait(interval):
+        logger.info('Metrics: {}'.format(json.dumps(metrics.snapshot())))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Continuous detection on camera streams (RTSP) or video files')
+    parser.add_argument('--model', choices=sorted(MODELS), default='antenna_detection', help='Detector run on every stream')
+    parser.add_argument('--stream', action='append', default=[], metavar='NAME=SOURCE',
+                        help='Stream name and RTSP/HTTP URL or video file (repeat for each camera)')
+    parser.add_argument('--fps', type=float, default=1.0, help='Frames per second analysed per stream (0 - every frame)')
+    parser.add_argument('--stream_fps', action='append', default=[], metavar='NAME=FPS', help='Frames per second of one stream')
+    parser.add_argument('--max_batch_size', type=int, default=8, help='Max frames (one per stream) per forward pass')
+    parser.add_argument('--loop', action='store_true', help='Restart video files at their end (files stand in for cameras)')
+    parser.add_argument('--no_realtime', action='store_true', help='Read video files as fast as possible instead of at their frame rate')
+    parser.add_argument('--quality', default=None, help='fast or accurate (default: the model config)')
+    parser.add_argument('--format', choices=RESPONSE_FORMATS, default='legacy', help='Detections format of the output lines')
+    parser.add_argument('-o', '--output', default='-', help='NDJSON output file (- for stdout)')
+    parser.add_argument('--duration', type=float, default=0, help='Seconds to run (0 - until interrupted or all files end)')
+    parser.add_argument('--metrics_interval', type=float, default=60, help='Seconds between metrics log lines (0 - only at exit)')
+    parser.add_argument('-g', '--use_gpu', action='store_true', help='Enable GPU usage')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    args = parser.parse_args()
+
+    try:
+        streams = parse_pairs(args.stream, '--stream')
+        stream_fps = {name: float(fps) for name, fps in parse_pairs(args.stream_fps, '--stream_fps').items()}
+        quality = parse_quality(args.quality)
+    except ValueError as e:
+        parser.error(str(e))
+    if not streams:
+        parser.error('at least one --stream NAME=SOURCE is required')
+    unknown = set(stream_fps) - set(streams)
+    if unknown:
+        parser.error('--stream_fps for unknown streams {}'.format(sorted(unknown)))
+
+    logging.getLogger().addHandler(logging.StreamHandler(sys.stderr))
+    if not args.use_gpu:
+        torch.backends.cudnn.enabled = False
+        torch.cuda.is_available = lambda: False
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    weights, names, cfg, model_name, _ = MODELS[args.model]
+    detector = yd.YoloDetector(weights=weights, names=names, cfg=cfg, name=model_name)
+
+    readers = [StreamReader(name, source, fps=stream_fps.get(name, args.fps) or None,
+                            realtime=False if args.no_realtime else None, loop=args.loop, logger=logger)
+               for name, source in streams.items()]
+
+    #Confidence interval thresholds, hot reloaded as in the API
+    thresholds = ThresholdStore(paths.th_path, models=paths.model_names, logger=logger)
+
+    out = sys.stdout if args.output == '-' else open(args.output, 'a')
+    monitor = StreamMonitor(detector, readers, quality=quality, max_batch_size=args.max_batch_size,
+                            on_result=result_writer(args.model, out, thresholds, args.format))
+
+    #Stop on Ctrl+C, SIGTERM or after --duration
+    stop = threading.Event()
+    signal.signal(signal.SIGINT, lambda signum, frame: stop.set())
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    if args.duration > 0:
+        timer = threading.Timer(args.duration, stop.set)
+        timer.daemon = True
+        timer.start()
+    if args.metrics_interval > 0:
+        threading.Thread(target=log_metrics, args=(stop, args.metrics_interval), daemon=True).start()
+
+    logger.info('Monitoring {} streams with {}'.format(len(readers), args.model))
+    start = time.time()
+    monitor.run(stop)
+    stop.set()
+    logger.info('Stopped after {:.0f}s, metrics: {}'.format(time.time() - start, json.dumps(metrics.snapshot())))
+    if out is not sys.stdout:
+        out.close()
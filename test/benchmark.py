@@ -0,0 +1,772 @@
+#Manual benchmarks and parity checks for the detection service (not part of test_api.sh)
+#Run from anywhere: python3 test/benchmark.py <command> [options]; python3 test/benchmark.py -h lists the commands
+import os
+import sys
+import glob
+import time
+import argparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import cv2
+import torch
+
+
+def load_detectors():
+    """Endpoint name -> YoloDetector, loaded the way the API loads them"""
+    import image_api
+    image_api.init_models()
+    return {'grounding_detection':image_api.ground_pred,
+            'satellite_dish_detection':image_api.satd_pred,
+            'cablejack_detection':image_api.cjack_pred,
+            'antenna_detection':image_api.antenna_pred,
+            'fireextinguisher_detection':image_api.fireext_pred,
+            'screwnuts_detection':image_api.screwnuts_pred}
+
+
+def load_images(pattern):
+    """(path, BGR image) for every image matching pattern"""
+    return [(path, cv2.imread(path)) for path in sorted(glob.glob(pattern))]
+
+
+def timed(func, repeat):
+    """(last result, mean seconds) of repeat calls"""
+    start = time.time()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.time() - start) / repeat
+
+
+def max_abs_diff(a, b):
+    return (a - b).abs().max().item() if a.shape == b.shape else float('inf')
+
+
+def bench_fused(args):
+    """Per-model forward passes vs one fused pass over the same-cfg models"""
+    from models.object_detector.fused import FusedDetectors
+
+    detectors = load_detectors()
+    detectors = {name: detectors[name] for name in args.models}
+    fused = FusedDetectors(detectors)
+    if not fused.groups:
+        print('No models share a cfg topology, nothing to fuse')
+        return
+    total_seq = total_fused = 0.0
+    for path, img0 in load_images(args.images):
+        configs = {name: detector.config for name, detector in detectors.items()}
+        keys = {name: detector.input_key(configs[name]) for name, detector in detectors.items()}
+        groups, singles = fused.plan(list(detectors), keys)
+        img = detectors[args.models[0]].preprocess(img0, configs[args.models[0]])
+
+        ref, t_seq = timed(lambda: {name: detector.infer(img, configs[name]) for name, detector in detectors.items()}, args.repeat)
+
+        def run_fused():
+            preds = {}
+            for group_names, model in groups:
+                preds.update(fused.infer(model, group_names, img, {n: configs[n] for n in group_names}))
+            preds.update({name: detectors[name].infer(img, configs[name]) for name in singles})
+            return preds
+        out, t_fused = timed(run_fused, args.repeat)
+
+        diff = max(max_abs_diff(ref[name], out[name]) for name in detectors)
+        same = all(detectors[name].postprocess(ref[name], img.shape[2:], img0.shape, configs[name]) ==
+                   detectors[name].postprocess(out[name], img.shape[2:], img0.shape, configs[name]) for name in detectors)
+        print('{}: per-model {:.3f}s, fused {:.3f}s ({:.2f}x), max abs diff {:.2e}, detections {}'.format(
+            os.path.basename(path), t_seq, t_fused, t_seq / t_fused, diff, 'same' if same else 'DIFFERENT'))
+        total_seq += t_seq
+        total_fused += t_fused
+    print('Fused groups: {}'.format([names for names, _ in fused.groups]))
+    print('Total: per-model {:.3f}s, fused {:.3f}s ({:.2f}x)'.format(total_seq, total_fused, total_seq / total_fused))
+
+
+def bench_batching(args):
+    """Concurrent requests to one model, each on its own vs coalesced by BatchScheduler"""
+    from concurrent.futures import ThreadPoolExecutor
+    from models.metrics import metrics
+
+    detector = load_detectors()[args.model]
+    images = [img0 for _, img0 in load_images(args.images)] * args.repeat
+
+    def run_all(func):
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            return list(pool.map(func, images))
+
+    ref, t_single = timed(lambda: run_all(lambda img0: detector.detect(detector.preprocess(img0), img0.shape)), 1)
+    detector.enable_batching(max_batch_size=args.batch_size, max_wait_ms=args.wait_ms)
+    out, t_batch = timed(lambda: run_all(detector.scheduler.submit), 1)
+    detector.scheduler.shutdown()
+
+    same = sum(a == b for a, b in zip(ref, out))
+    print('{} requests, concurrency {}: unbatched {:.2f} img/s, batched {:.2f} img/s ({:.2f}x)'.format(
+        len(images), args.concurrency, len(images) / t_single, len(images) / t_batch, t_single / t_batch))
+    print('Identical detections: {}/{} (padding to a common shape can move boxes near the border)'.format(same, len(images)))
+    for name, value in metrics.snapshot().items():
+        print(name, value)
+
+
+def detections_match(a, b, box_tol, conf_tol):
+    """Same number of detections and, in class/position order, boxes within box_tol px and confidences within conf_tol"""
+    if len(a) != len(b):
+        return False
+    order = lambda d: sorted(range(len(d)), key=lambda i: (d.classes[i], d.boxes[i].tolist()))
+    for i, j in zip(order(a), order(b)):
+        if a.classes[i] != b.classes[j] or abs(a.boxes[i] - b.boxes[j]).max() > box_tol:
+            return False
+        if abs(float(a.scores[i]) - float(b.scores[j])) > conf_tol:
+            return False
+    return True
+
+
+def bench_fuse(args):
+    """Conv+BN fused (and TorchScript) models vs the unfused model: detections parity and latency"""
+    import models.object_detector.yolo_detection as yd
+
+    detectors = load_detectors()
+    images = load_images(args.images)
+    failures = 0
+    for name in args.models:
+        detector = detectors[name]
+        config = detector.config
+        if detector.model is None:
+            print('{}: runs the {} backend, skipped'.format(name, detector.backend))
+            continue
+        if not config.fuse:
+            print('{}: fuse is disabled in the detection config, skipped'.format(name))
+            continue
+        reference = yd.build_model(detector._cfg, detector._weights, detector._device, img_size=config.img_size,
+                                   half=detector._half, warmup_augment=config.augment, fuse=False)
+        variants = [('fused', detector.model)]
+        if args.torchscript:
+            variants.append(('torchscript', yd.TracedModel(detector.model)))
+
+        times = {'unfused': 0.0}
+        for path, img0 in images:
+            img = detector.preprocess(img0, config)
+            ref, t = timed(lambda: reference(img, augment=config.tta)[0], args.repeat)
+            times['unfused'] += t
+            ref_dets = detector.postprocess(ref, img.shape[2:], img0.shape, config)
+            for variant, model in variants:
+                if variant == 'torchscript':
+                    model(img, augment=config.tta)  # trace outside the timing
+                out, t = timed(lambda: model(img, augment=config.tta)[0], args.repeat)
+                times[variant] = times.get(variant, 0.0) + t
+                out_dets = detector.postprocess(out.float(), img.shape[2:], img0.shape, config)
+                ok = detections_match(ref_dets, out_dets, args.box_tol, args.conf_tol)
+                failures += not ok
+                print('{} {} {}: {} detections, max abs diff {:.2e}, {}'.format(
+                    name, os.path.basename(path), variant, len(out_dets), max_abs_diff(ref, out.float()),
+                    'match' if ok else 'MISMATCH'))
+        print('{} latency per image: {}'.format(name, ', '.join('{} {:.3f}s'.format(k, v / len(images)) for k, v in times.items())))
+        del reference
+    print('Parity: {}'.format('OK' if not failures else '{} MISMATCHES'.format(failures)))
+    sys.exit(1 if failures else 0)
+
+
+def bench_backends(args):
+    """Exported backends (models/object_detector/export.py) vs the torch model: detections parity and latency"""
+    from models.object_detector.backends import load_backend
+
+    detectors = load_detectors()
+    images = load_images(args.images)
+    failures = 0
+    for name in args.models:
+        detector = detectors[name]
+        config = detector.config
+        if detector.model is None:
+            print('{}: runs the {} backend, skipped'.format(name, detector.backend))
+            continue
+        variants = []
+        for backend in args.backends:
+            try:
+                variants.append((backend, load_backend(backend, detector._cfg, detector._weights, detector._device)))
+            except FileNotFoundError as e:
+                print('{} {}: {}'.format(name, backend, e))
+                failures += 1
+
+        times = {'torch': 0.0}
+        for path, img0 in images:
+            img = detector.preprocess(img0, config)
+            ref, t = timed(lambda: detector.model(img, augment=config.tta)[0], args.repeat)
+            times['torch'] += t
+            ref_dets = detector.postprocess(ref, img.shape[2:], img0.shape, config)
+            for backend, model in variants:
+                model(img, augment=config.tta)  # first run of a new shape outside the timing
+                out, t = timed(lambda: model(img, augment=config.tta)[0], args.repeat)
+                times[backend] = times.get(backend, 0.0) + t
+                out_dets = detector.postprocess(out, img.shape[2:], img0.shape, config)
+                ok = detections_match(ref_dets, out_dets, args.box_tol, args.conf_tol)
+                failures += not ok
+                print('{} {} {}: {} detections, max abs diff {:.2e}, {}'.format(
+                    name, os.path.basename(path), backend, len(out_dets), max_abs_diff(ref, out),
+                    'match' if ok else 'MISMATCH'))
+        print('{} latency per image: {}'.format(name, ', '.join('{} {:.3f}s'.format(k, v / len(images)) for k, v in times.items())))
+    print('Parity: {}'.format('OK' if not failures else '{} MISMATCHES'.format(failures)))
+    sys.exit(1 if failures else 0)
+
+
+def load_labelled(directory):
+    """(path, BGR image, nx5 array of class, x1, y1, x2, y2 in pixels) for a YOLO format validation set.
+
+    Labels are looked up like yolov3 training does: the image path with images -> labels and a .txt extension.
+    """
+    import numpy as np
+
+    samples = []
+    for path in sorted(glob.glob(os.path.join(directory, '*'))):
+        if os.path.splitext(path)[1].lower() not in ('.jpg', '.jpeg', '.png', '.bmp'):
+            continue
+        img0 = cv2.imread(path)
+        h, w = img0.shape[:2]
+        label_path = os.path.splitext(path.replace('images', 'labels'))[0] + '.txt'
+        labels = np.zeros((0, 5))
+        if os.path.exists(label_path):
+            labels = np.loadtxt(label_path, ndmin=2).reshape(-1, 5)
+            cx, cy, bw, bh = labels[:, 1] * w, labels[:, 2] * h, labels[:, 3] * w, labels[:, 4] * h
+            labels = np.stack([labels[:, 0], cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], 1)
+        samples.append((path, img0, labels))
+    return samples
+
+
+def evaluate(detector, config, samples, iou=0.5):
+    """mAP@iou over samples, precision/recall at the config's conf_thres and mean seconds per image"""
+    import numpy as np
+    from yolov3.utils.utils import batched_non_max_suppression, scale_coords, box_iou, ap_per_class
+
+    stats, seconds = [], 0.0
+    for _, img0, labels in samples:
+        start = time.time()
+        img = detector.preprocess(img0, config)
+        pred = detector.infer(img, config)
+        seconds += time.time() - start
+        det = batched_non_max_suppression(pred, 0.001, config.iou_thres, multi_label=False, classes=config.classes_filter,
+                                          agnostic=config.agnostic_nms, method=config.nms)[0]
+        if det is None:
+            det = torch.zeros((0, 6))
+        det[:, :4] = scale_coords(img.shape[2:], det[:, :4], img0.shape).round()
+
+        #Greedy matching by confidence, one detection per target
+        correct = np.zeros(len(det), dtype=bool)
+        targets = torch.from_numpy(labels).float()
+        matched = set()
+        if len(det) and len(targets):
+            ious = box_iou(det[:, :4], targets[:, 1:])
+            for i in range(len(det)):
+                candidates = (targets[:, 0] == det[i, 5]) & (ious[i] >= iou)
+                for j in ious[i].argsort(descending=True).tolist():
+                    if candidates[j] and j not in matched:
+                        matched.add(j)
+                        correct[i] = True
+                        break
+        stats.append((correct, det[:, 4].numpy(), det[:, 5].numpy(), labels[:, 0]))
+
+    correct, conf, pred_cls, target_cls = [np.concatenate(x, 0) for x in zip(*stats)]
+    ap = ap_per_class(correct[:, None], conf, pred_cls, target_cls)[2] if len(target_cls) else np.zeros((1, 1))
+    kept = conf >= config.conf_thres
+    tp = correct[kept].sum()
+    return {'map': float(ap[:, 0].mean()),
+            'precision': float(tp / max(kept.sum(), 1)),
+            'recall': float(tp / max(len(target_cls), 1)),
+            'seconds': seconds / max(len(samples), 1)}
+
+
+def bench_tta(args):
+    """Accuracy/latency trade-off of test-time augmentation per model on labelled validation sets"""
+    import copy
+
+    detectors = load_detectors()
+    print('{:<28} {:<22} {:>8} {:>8} {:>8} {:>10}'.format('model', 'augmentations', 'mAP@0.5', 'P', 'R', 's/img'))
+    for item in args.data:
+        name, directory = item.split('=', 1)
+        detector = detectors[name]
+        samples = load_labelled(directory)
+        if not samples:
+            print('{}: no images in {}'.format(name, directory))
+            continue
+        base = detector.config
+
+        #No TTA, all configured augmentations and each augmentation on its own
+        variants = [('none (fast)', base.for_quality('fast')), ('all (accurate)', base.for_quality('accurate'))]
+        if len(base.augmentations) > 1:
+            for flip, scale in base.augmentations:
+                config = base.for_quality('accurate')
+                config.augmentations = ((flip, scale),)
+                variants.append(('{}scale {}'.format('flip+' if flip else '', scale), config))
+
+        results = []
+        for label, config in variants:
+            result = evaluate(detector, config, samples)
+            results.append((label, result))
+            print('{:<28} {:<22} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.3f}'.format(
+                name, label, result['map'], result['precision'], result['recall'], result['seconds']))
+        fast, accurate = results[0][1], results[1][1]
+        print('{:<28} TTA: mAP {:+.3f} for {:.2f}x latency{}'.format(
+            name, accurate['map'] - fast['map'], accurate['seconds'] / max(fast['seconds'], 1e-9),
+            ' - consider "augment": false for this model' if accurate['map'] - fast['map'] < args.min_gain else ''))
+
+
+def legacy_decode(yolo_layers, heads, img_size, nb, augmentations):
+    """YOLOLayer inference decode as it was before decode_heads: per head copies, then concat and de-augment copies"""
+    outputs = []
+    for layer, p in zip(yolo_layers, heads):
+        bs, _, ny, nx = p.shape
+        grid, anchor_wh = layer.get_grids(nx, ny, p.device)
+        p = p.view(bs, layer.na, layer.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()
+        io = p.clone()
+        io[..., :2] = torch.sigmoid(io[..., :2]) + grid
+        io[..., 2:4] = torch.exp(io[..., 2:4]) * anchor_wh
+        io[..., :4] *= layer.stride
+        torch.sigmoid_(io[..., 4:])
+        outputs.append(io.view(bs, -1, layer.no))
+    x = torch.cat(outputs, 1)
+    if augmentations:
+        x = torch.split(x, nb, dim=0)
+        for xi, (flip, scale) in zip(x[1:], augmentations):
+            xi[..., :4] /= scale
+            if flip:
+                xi[..., 0] = img_size[1] - xi[..., 0]
+        x = torch.cat(x, 1)
+    return x
+
+
+def bench_decode(args):
+    """YOLO head decode in isolation: decode_heads vs the previous copy-per-step decode, on random head outputs"""
+    from yolov3.models import Darknet, DEFAULT_AUGMENTATIONS, decode_heads
+
+    model = Darknet(args.cfg).eval()
+    layers = [model.module_list[i] for i in model.yolo_layers]
+    augmentations = DEFAULT_AUGMENTATIONS if args.augment else ()
+    bs = args.batch_size * (1 + len(augmentations))
+    failures = 0
+    for h, w in args.shapes:
+        heads = [torch.randn(bs, layer.na * layer.no, h // layer.stride, w // layer.stride) for layer in layers]
+        ref, t_ref = timed(lambda: legacy_decode(layers, heads, (h, w), args.batch_size, augmentations), args.repeat)
+        out, t_new = timed(lambda: decode_heads(layers, heads, (h, w), args.batch_size, augmentations), args.repeat)
+        diff = max_abs_diff(ref, out)
+        failures += not diff < 1e-3
+        print('{}x{} batch {}{}: legacy {:.2f}ms, decode_heads {:.2f}ms ({:.2f}x), output {:.1f}MB, max abs diff {:.2e}{}'.format(
+            h, w, args.batch_size, ' TTA' if augmentations else '', t_ref * 1000, t_new * 1000, t_ref / max(t_new, 1e-9),
+            out.numel() * out.element_size() / 2 ** 20, diff, '' if diff < 1e-3 else ' MISMATCH'))
+    sys.exit(1 if failures else 0)
+
+
+def bench_memory(args):
+    """Peak activation memory per input shape, batch size and TTA, with and without releasing dead layer outputs"""
+    from models.memory_report import peak_activation_memory
+    from models.object_detector.yolo_detection import model_memory_bytes
+    from yolov3.models import Darknet
+
+    model = Darknet(args.cfg).eval()
+    releases = model.releases
+    print('{}: weights {:.1f}MB'.format(args.cfg, model_memory_bytes(model) / 2 ** 20))
+    print('{:<12} {:>6} {:>5} {:>14} {:>14}'.format('shape', 'batch', 'TTA', 'peak MB', 'keep all MB'))
+    for h, w in args.shapes:
+        for batch_size in args.batch_sizes:
+            for augment in ([False, True] if args.augment else [False]):
+                img = torch.zeros((batch_size, 3, h, w))
+                peak = peak_activation_memory(model, img, augment=augment)
+                model.releases = [[] for _ in releases]  # keep every routed output until the end, as before
+                keep_all = peak_activation_memory(model, img, augment=augment)
+                model.releases = releases
+                print('{:<12} {:>6} {:>5} {:>14.1f} {:>14.1f}'.format(
+                    '{}x{}'.format(h, w), batch_size, 'yes' if augment else 'no', peak / 2 ** 20, keep_all / 2 ** 20))
+
+
+def synthetic_predictions(batch_size, candidates, nc, anchors=22743, seed=0):
+    """Decoded model output with `candidates` boxes above 0.3 confidence per image, in clusters of about 10 overlapping boxes"""
+    g = torch.Generator().manual_seed(seed)
+    pred = torch.zeros((batch_size, anchors, 5 + nc))
+    centers = torch.rand((batch_size, candidates // 10 + 1, 2), generator=g) * 600
+    cluster = torch.randint(0, centers.shape[1], (batch_size, candidates), generator=g)
+    pred[:, :candidates, :2] = centers.gather(1, cluster[..., None].expand(-1, -1, 2)) + torch.randn((batch_size, candidates, 2), generator=g) * 5
+    pred[:, :candidates, 2:4] = 20 + torch.rand((batch_size, candidates, 2), generator=g) * 60
+    pred[:, :candidates, 4] = 0.31 + torch.rand((batch_size, candidates), generator=g) * 0.69
+    pred[:, candidates:, 4] = 0.01
+    pred[..., 5:] = 0.5 + torch.rand((batch_size, anchors, nc), generator=g) * 0.5
+    return pred
+
+
+def bench_nms(args):
+    """Per-image non_max_suppression loop vs batched_non_max_suppression by number of candidate boxes"""
+    from yolov3.utils.utils import non_max_suppression, batched_non_max_suppression
+
+    print('{:>10} {:>6} {:<7} {:>10} {:>10} {:>12} {:>8}'.format(
+        'candidates', 'batch', 'nms', 'loop ms', 'batched ms', 'top-k ms', 'same'))
+    failures = 0
+    for candidates in args.candidates:
+        for batch_size in args.batch_sizes:
+            pred = synthetic_predictions(batch_size, candidates, args.classes)
+            for method in ('merge', 'vision'):
+                loop = lambda: [non_max_suppression(pred[i:i + 1].clone(), 0.3, args.iou_thres, multi_label=False)[0]
+                                for i in range(batch_size)] if method == 'merge' else None
+                ref, t_loop = timed(loop, args.repeat)
+                out, t_batched = timed(lambda: batched_non_max_suppression(
+                    pred.clone(), 0.3, args.iou_thres, multi_label=False, method=method), args.repeat)
+                _, t_top_k = timed(lambda: batched_non_max_suppression(
+                    pred.clone(), 0.3, args.iou_thres, multi_label=False, method=method, max_candidates=args.top_k), args.repeat)
+                same = '-' if ref is None else all(a.shape == b.shape and max_abs_diff(a, b) < 1e-3 for a, b in zip(ref, out))
+                failures += same is False
+                print('{:>10} {:>6} {:<7} {:>10} {:>10.2f} {:>12.2f} {:>8}'.format(
+                    candidates, batch_size, method, '-' if ref is None else '{:.2f}'.format(t_loop * 1000),
+                    t_batched * 1000, t_top_k * 1000, str(same)))
+    sys.exit(1 if failures else 0)
+
+
+def bench_int8(args):
+    """int8 backend vs the float model: accuracy on labelled images, latency and weight memory"""
+    import copy
+    from models.memory_report import process_memory
+    from models.object_detector.backends import artefact_path, load_backend
+    from models.object_detector.yolo_detection import model_memory_bytes
+
+    detectors = load_detectors()
+    failures = 0
+    print('{:<28} {:<6} {:>8} {:>8} {:>8} {:>10} {:>12} {:>12}'.format(
+        'model', 'model', 'mAP@0.5', 'P', 'R', 's/img', 'weights MB', 'load RSS MB'))
+    for item in args.data:
+        name, directory = item.split('=', 1)
+        detector = detectors[name]
+        samples = load_labelled(directory)
+        if not samples or detector.model is None:
+            print('{}: no images in {} or no float model'.format(name, directory))
+            continue
+        config = detector.config.for_quality(args.quality) if args.quality else detector.config
+
+        #Same detector with the int8 graph as its forward callable
+        rss = process_memory()['rss']
+        quantized = copy.copy(detector)
+        quantized._forward = load_backend('int8', detector._cfg, detector._weights, detector._device)
+        load_rss = process_memory()['rss'] - rss
+
+        results = {}
+        for label, det, weight_bytes, rss_bytes in (
+                ('float', detector, model_memory_bytes(detector.model), None),
+                ('int8', quantized, os.path.getsize(artefact_path(detector._weights, 'int8')), load_rss)):
+            evaluate(det, config, samples[:1])  # warm up outside the timing
+            results[label] = result = evaluate(det, config, samples)
+            print('{:<28} {:<6} {:>8.3f} {:>8.3f} {:>8.3f} {:>10.3f} {:>12.1f} {:>12}'.format(
+                name, label, result['map'], result['precision'], result['recall'], result['seconds'],
+                weight_bytes / 2 ** 20, '-' if rss_bytes is None else '{:.1f}'.format(rss_bytes / 2 ** 20)))
+        drop = results['float']['map'] - results['int8']['map']
+        ok = drop <= args.max_drop
+        failures += not ok
+        print('{:<28} int8: mAP {:+.3f} for {:.2f}x latency, {}'.format(
+            name, -drop, results['int8']['seconds'] / max(results['float']['seconds'], 1e-9),
+            'OK' if ok else 'REGRESSION (max drop {})'.format(args.max_drop)))
+    sys.exit(1 if failures else 0)
+
+
+def synthetic_photo(megapixels, orientation, seed=0):
+    """JPEG bytes of a smooth noisy 4:3 picture with an EXIF orientation, camera sized EXIF/thumbnail segment included"""
+    import io
+    import numpy as np
+    from PIL import Image
+
+    rng = np.random.default_rng(seed)
+    height = int((megapixels * 1e6 * 3 / 4) ** 0.5)
+    width = height * 4 // 3
+    img = cv2.resize(rng.integers(0, 255, (height // 64, width // 64, 3), dtype=np.uint8), (width, height))
+    img = cv2.add(img, rng.integers(0, 16, img.shape, dtype=np.uint8))
+    exif = Image.Exif()
+    exif[274] = orientation
+    exif[0x010E] = 'x' * 32000  # ImageDescription - phones write tens of KB of metadata before the frame header
+    buf = io.BytesIO()
+    Image.fromarray(img).save(buf, 'JPEG', quality=90, exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def bench_probe(args):
+    """Header probe (models/image_probe.py) vs PIL EXIF parse plus pixel decode for orientation and size"""
+    import io
+    import numpy as np
+    from PIL import Image
+    from models.image_probe import probe_image
+
+    def decode_path(data):
+        exif = Image.open(io.BytesIO(data))._getexif() or {}
+        img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)  # applies the orientation
+        return exif.get(274, 0), img.shape
+
+    if args.images:
+        samples = [(os.path.basename(path), open(path, 'rb').read()) for path in sorted(glob.glob(args.images))]
+    else:
+        samples = [('{} MP'.format(mp), synthetic_photo(mp, 6)) for mp in args.megapixels]
+
+    print('{:<24} {:>10} {:>14} {:>12} {:>10} {:>6}'.format('image', 'MB', 'PIL+decode ms', 'probe ms', 'speedup', 'same'))
+    for name, data in samples:
+        ref, t_ref = timed(lambda: decode_path(data), args.repeat)
+        info, t_probe = timed(lambda: probe_image(data), args.repeat)
+        same = info is not None and (info.orientation, info.shape) == (ref[0], ref[1])
+        print('{:<24} {:>10.1f} {:>14.1f} {:>12.3f} {:>9.0f}x {:>6}'.format(
+            name, len(data) / 2 ** 20, t_ref * 1000, t_probe * 1000, t_ref / t_probe, str(same)))
+
+
+INGEST_PEAK_SCRIPT = """
+import sys
+sys.path.insert(0, sys.argv[1])
+from models.utils import DecodedImage
+from models.object_detector.yolo_detection import letterbox_image
+def status_kb(field):
+    for line in open('/proc/self/status'):
+        if line.startswith(field + ':'):
+            return int(line.split()[1])
+data = open(sys.argv[2], 'rb').read()
+min_size = int(sys.argv[3]) or None
+before = status_kb('VmRSS')
+letterbox_image(DecodedImage(data, min_size=min_size).img, int(sys.argv[4]))
+print((status_kb('VmHWM') - before) * 1024)
+"""
+
+
+def ingest_peak_rss(data, min_size, img_size):
+    """Bytes the peak RSS of a fresh interpreter rises by while decoding and letterboxing data (Linux)"""
+    import subprocess
+    import tempfile
+
+    with tempfile.NamedTemporaryFile(suffix='.jpg') as f:
+        f.write(data)
+        f.flush()
+        out = subprocess.check_output([sys.executable, '-c', INGEST_PEAK_SCRIPT, ROOT, f.name, str(min_size or 0), str(img_size)])
+    return int(out.decode().split()[-1])
+
+
+def bench_ingest(args):
+    """Upload decode plus letterbox at full resolution vs reduced JPEG decode: time and peak RSS"""
+    from models.utils import DecodedImage
+    from models.object_detector.yolo_detection import letterbox_image
+
+    if args.images:
+        samples = [(os.path.basename(path), open(path, 'rb').read()) for path in sorted(glob.glob(args.images))]
+    else:
+        samples = [('{} MP'.format(mp), synthetic_photo(mp, 6)) for mp in args.megapixels]
+
+    def ingest(data, min_size):
+        image = DecodedImage(data, min_size=min_size)
+        return letterbox_image(image.img, args.img_size).shape, image.reduction
+
+    print('{:<24} {:>8} {:<8} {:>10} {:>10} {:>14} {:>14}'.format(
+        'image', 'MB', 'decode', 'reduction', 'ms', 'peak RSS MB', 'input'))
+    for name, data in samples:
+        for mode, min_size in (('full', None), ('reduced', args.img_size)):
+            ingest(data, min_size)  # warm up
+            (shape, reduction), t = timed(lambda: ingest(data, min_size), args.repeat)
+            peak = ingest_peak_rss(data, min_size, args.img_size)
+            print('{:<24} {:>8.1f} {:<8} {:>10} {:>10.1f} {:>14.1f} {:>14}'.format(
+                name, len(data) / 2 ** 20, mode, '1/{}'.format(reduction), t * 1000, peak / 2 ** 20,
+                'x'.join(str(v) for v in shape[1:])))
+
+
+def bench_preprocess(args):
+    """letterbox + transpose + float + /255 vs the fused letterbox into reused input buffers: equality, time, allocations"""
+    import tracemalloc
+    import numpy as np
+    from yolov3.utils.datasets import letterbox
+    from models.object_detector.letterbox import input_buffers
+
+    def reference(img0, auto):
+        img = letterbox(img0, new_shape=args.img_size, auto=auto)[0]
+        img = torch.from_numpy(np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))).float()
+        img /= 255.0
+        return img.unsqueeze(0)
+
+    def allocated(func):
+        """Peak bytes numpy/cv2 allocate in one call (torch tensors are not traced)"""
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return peak
+
+    rng = np.random.default_rng(0)
+    samples = [(os.path.basename(path), img0) for path, img0 in load_images(args.images)]
+    samples += [('{}x{}'.format(w, h), rng.integers(0, 256, (h, w, 3), dtype=np.uint8))
+                for w, h in (tuple(int(v) for v in size.split('x')) for size in args.sizes)]
+
+    print('{:<24} {:<10} {:>12} {:>12} {:>10} {:>12} {:>12} {:>6}'.format(
+        'image', 'pad', 'input', 'current ms', 'fused ms', 'current KB', 'fused KB', 'same'))
+    failures = 0
+    for name, img0 in samples:
+        for pad, auto in (('rectangle', True), ('square', False)):
+            fused = lambda: input_buffers.letterbox(img0, args.img_size, auto)
+            same = torch.equal(reference(img0, auto), fused())
+            failures += not same
+            ref, t_ref = timed(lambda: reference(img0, auto), args.repeat)
+            out, t_fused = timed(fused, args.repeat)
+            print('{:<24} {:<10} {:>12} {:>12.2f} {:>10.2f} {:>12.0f} {:>12.0f} {:>6}'.format(
+                name, pad, 'x'.join(str(v) for v in out.shape[2:]), t_ref * 1000, t_fused * 1000,
+                allocated(lambda: reference(img0, auto)) / 1024, allocated(fused) / 1024, str(same)))
+    sys.exit(1 if failures else 0)
+
+
+def synthetic_video(path, seconds, fps=25, size=(1280, 720)):
+    """mp4 of a test image panning sideways (for decode benchmarks)"""
+    import numpy as np
+    img = cv2.resize(cv2.imread('test/antenna.jpg'), size)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'mp4v'), fps, size)
+    for i in range(int(seconds * fps)):
+        writer.write(np.roll(img, 4 * i, 1))
+    writer.release()
+
+
+def bench_video(args):
+    """Frame sampling of video_detection (grab, retrieve sampled frames) vs LoadImages style read-then-skip"""
+    import tempfile
+    import numpy as np
+    from yolov3.utils.datasets import letterbox
+    from models.object_detector.video import VideoFrames
+    from models.object_detector.letterbox import input_buffers
+
+    path = args.video
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(), 'synthetic.mp4')
+        synthetic_video(path, args.seconds)
+
+    def read_then_skip(sample_rate):
+        # As predict(video=True): every frame read and letterboxed, then unsampled ones dropped
+        cap = cv2.VideoCapture(path)
+        step = max(1, int(-(-cap.get(cv2.CAP_PROP_FPS) // sample_rate)))
+        kept, frame = 0, 0
+        while True:
+            ok, img0 = cap.read()
+            if not ok:
+                break
+            img = letterbox(img0, new_shape=args.img_size)[0]
+            if frame % step == 0:
+                img = torch.from_numpy(np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))).float() / 255.0
+                kept += 1
+            frame += 1
+        cap.release()
+        return kept
+
+    def grab_sampled(sample_rate):
+        frames = VideoFrames(path, sample_rate)
+        kept = 0
+        for _, _, img0 in frames:
+            input_buffers.letterbox(img0, args.img_size)
+            kept += 1
+        frames.close()
+        return kept
+
+    print('{:<12} {:>8} {:>16} {:>14} {:>10}'.format('sample_rate', 'frames', 'read+skip ms', 'sampled ms', 'speedup'))
+    for sample_rate in args.sample_rates:
+        kept, t_ref = timed(lambda: read_then_skip(sample_rate), args.repeat)
+        same, t_new = timed(lambda: grab_sampled(sample_rate), args.repeat)
+        print('{:<12} {:>8} {:>16.0f} {:>14.0f} {:>9.1f}x{}'.format(
+            sample_rate, same, t_ref * 1000, t_new * 1000, t_ref / t_new, '' if kept == same else ' (frame count differs)'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Detection service benchmarks')
+    parser.add_argument('--threads', type=int, default=None, help='torch intra-op threads')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    p = subparsers.add_parser('fused', help='Fused multi-model inference vs per-model passes')
+    p.add_argument('--images', default='test/*.jpg', help='Glob of input images')
+    p.add_argument('--repeat', type=int, default=1, help='Timed repetitions per image')
+    p.add_argument('--models', nargs='+', default=['grounding_detection', 'satellite_dish_detection', 'cablejack_detection',
+                                                   'antenna_detection', 'fireextinguisher_detection'])
+    p.set_defaults(func=bench_fused)
+
+    p = subparsers.add_parser('batching', help='Micro-batching scheduler vs one forward per request')
+    p.add_argument('--images', default='test/*.jpg', help='Glob of input images')
+    p.add_argument('--repeat', type=int, default=1, help='Times every image is sent')
+    p.add_argument('--model', default='grounding_detection')
+    p.add_argument('--concurrency', type=int, default=4, help='Concurrent clients')
+    p.add_argument('--batch_size', type=int, default=8)
+    p.add_argument('--wait_ms', type=float, default=10)
+    p.set_defaults(func=bench_batching)
+
+    p = subparsers.add_parser('fuse', help='Conv+BN fusion and TorchScript parity (within tolerance) and latency')
+    p.add_argument('--images', default='test/*.jpg', help='Glob of input images')
+    p.add_argument('--repeat', type=int, default=1, help='Timed repetitions per image')
+    p.add_argument('--models', nargs='+', default=['grounding_detection', 'satellite_dish_detection', 'cablejack_detection',
+                                                   'antenna_detection', 'fireextinguisher_detection', 'screwnuts_detection'])
+    p.add_argument('--torchscript', action='store_true', help='Also check the traced and frozen TorchScript graphs')
+    p.add_argument('--box_tol', type=float, default=1.0, help='Max box corner difference in pixels')
+    p.add_argument('--conf_tol', type=float, default=1e-3, help='Max confidence difference')
+    p.set_defaults(func=bench_fuse)
+
+    p = subparsers.add_parser('backends', help='Exported torchscript/onnxruntime backends parity (within tolerance) and latency')
+    p.add_argument('--images', default='test/*.jpg', help='Glob of input images')
+    p.add_argument('--repeat', type=int, default=1, help='Timed repetitions per image')
+    p.add_argument('--models', nargs='+', default=['grounding_detection', 'satellite_dish_detection', 'cablejack_detection',
+                                                   'antenna_detection', 'fireextinguisher_detection', 'screwnuts_detection'])
+    p.add_argument('--backends', nargs='+', choices=['torchscript', 'onnxruntime'], default=['torchscript', 'onnxruntime'])
+    p.add_argument('--box_tol', type=float, default=1.0, help='Max box corner difference in pixels')
+    p.add_argument('--conf_tol', type=float, default=1e-3, help='Max confidence difference')
+    p.set_defaults(func=bench_backends)
+
+    p = subparsers.add_parser('tta', help='Accuracy/latency of test-time augmentation per model on labelled images')
+    p.add_argument('--data', nargs='+', required=True, metavar='ENDPOINT=DIR',
+                   help='Validation images per model, e.g. grounding_detection=val/grounding/images (YOLO format labels)')
+    p.add_argument('--min_gain', type=float, default=0.01, help='mAP gain below which TTA is reported as not paying off')
+    p.set_defaults(func=bench_tta)
+
+    p = subparsers.add_parser('decode', help='YOLO head decode in isolation (random head outputs, no weights needed)')
+    p.add_argument('--cfg', default='yolov3/cfg/yolov3-spp-1cls.cfg')
+    p.add_argument('--shapes', nargs='+', type=lambda v: tuple(int(x) for x in v.split('x')),
+                   default=[(608, 608), (448, 608), (352, 608)], help='Input shapes HEIGHTxWIDTH')
+    p.add_argument('--batch_size', type=int, default=1)
+    p.add_argument('--augment', action='store_true', help='Decode with the default test-time augmentations')
+    p.add_argument('--repeat', type=int, default=100, help='Timed repetitions per shape')
+    p.set_defaults(func=bench_decode)
+
+    p = subparsers.add_parser('memory', help='Peak activation memory per input shape (for sizing containers)')
+    p.add_argument('--cfg', default='yolov3/cfg/yolov3-spp-1cls.cfg')
+    p.add_argument('--shapes', nargs='+', type=lambda v: tuple(int(x) for x in v.split('x')),
+                   default=[(608, 608), (480, 608), (352, 608)], help='Input shapes HEIGHTxWIDTH')
+    p.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 4])
+    p.add_argument('--augment', action='store_true', help='Also measure with the default test-time augmentations')
+    p.set_defaults(func=bench_memory)
+
+    p = subparsers.add_parser('nms', help='Per-image vs batched NMS time by number of candidate boxes (synthetic)')
+    p.add_argument('--candidates', nargs='+', type=int, default=[100, 500, 1000, 2000, 4000], help='Boxes above conf_thres per image')
+    p.add_argument('--batch_sizes', nargs='+', type=int, default=[1, 8])
+    p.add_argument('--classes', type=int, default=2)
+    p.add_argument('--iou_thres', type=float, default=0.6)
+    p.add_argument('--top_k', type=int, default=500, help='nms_top_k of the top-k column')
+    p.add_argument('--repeat', type=int, default=5)
+    p.set_defaults(func=bench_nms)
+
+    p = subparsers.add_parser('int8', help='Accuracy regression, latency and memory of the int8 backend vs the float model')
+    p.add_argument('--data', nargs='+', required=True, metavar='ENDPOINT=DIR',
+                   help='Labelled images per model, e.g. grounding_detection=val/grounding/images (YOLO format labels)')
+    p.add_argument('--quality', choices=['fast', 'accurate'], default=None, help='Request quality (default: the config)')
+    p.add_argument('--max_drop', type=float, default=0.01, help='Largest accepted mAP drop of the int8 model')
+    p.set_defaults(func=bench_int8)
+
+    p = subparsers.add_parser('probe', help='JPEG/PNG header probe vs PIL plus decode for EXIF orientation and image size')
+    p.add_argument('--images', default=None, help='Glob of images (default: synthetic phone photos)')
+    p.add_argument('--megapixels', nargs='+', type=float, default=[12, 24, 48], help='Sizes of the synthetic photos')
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_probe)
+
+    p = subparsers.add_parser('ingest', help='Full vs reduced JPEG decode plus letterbox of uploads: time and peak RSS')
+    p.add_argument('--images', default=None, help='Glob of images (default: synthetic phone photos)')
+    p.add_argument('--megapixels', nargs='+', type=float, default=[12, 24, 48], help='Sizes of the synthetic photos')
+    p.add_argument('--img_size', type=int, default=608)
+    p.add_argument('--repeat', type=int, default=3)
+    p.set_defaults(func=bench_ingest)
+
+    p = subparsers.add_parser('preprocess', help='Fused letterbox into reused input buffers vs letterbox plus conversions')
+    p.add_argument('--images', default='test/*.jpg', help='Glob of input images')
+    p.add_argument('--sizes', nargs='+', default=['640x480', '1280x720', '1920x1080', '4000x3000'],
+                   help='Random images of these sizes (WxH) besides --images')
+    p.add_argument('--img_size', type=int, default=608)
+    p.add_argument('--repeat', type=int, default=20)
+    p.set_defaults(func=bench_preprocess)
+
+    p = subparsers.add_parser('video', help='Frame sampling of video_detection vs reading and letterboxing every frame')
+    p.add_argument('--video', default=None, help='Video file (default: a synthetic 720p clip)')
+    p.add_argument('--seconds', type=float, default=10, help='Length of the synthetic clip')
+    p.add_argument('--sample_rates', nargs='+', type=float, default=[1, 5, 25], help='Frames per second analysed')
+    p.add_argument('--img_size', type=int, default=608)
+    p.add_argument('--repeat', type=int, default=1)
+    p.set_defaults(func=bench_video)
+
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    args.func(args)
@@ -0,0 +1,5 @@
+#Tests import the service modules (models, yolov3) from the repository root: python -m pytest test
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,92 @@
+import threading
+
+import pytest
+import torch
+
+from models.metrics import MetricsRegistry
+from models.object_detector.batching import PAD_VALUE, BatchScheduler
+
+
+class Config:
+    pass
+
+
+class FakeDetector:
+    """Preprocess gives a 1x3xHxW input filled with the image's value; a forward returns each image's input shape"""
+
+    _name = 'fake'
+
+    def __init__(self, fail=False):
+        self.config = Config()
+        self.batches = []
+        self.fail = fail
+
+    def preprocess(self, img0, config):
+        return torch.full((1, 3) + tuple(img0.shape[:2]), img0.fill)
+
+    def infer(self, img, config):
+        if self.fail:
+            raise RuntimeError('forward failed')
+        self.batches.append(img)
+        return img
+
+    def postprocess_batch(self, pred, img_shapes, img0_shapes, config, scales):
+        return [(tuple(shape), scale) for shape, scale in zip(img_shapes, scales)]
+
+    def detect(self, img, img0_shape, config=None, scale=None):
+        return self.postprocess_batch(self.infer(img, config), [img.shape[2:]], [img0_shape], config, [scale])[0]
+
+
+class Image:
+    def __init__(self, height, width, fill=0.0):
+        self.shape = (height, width, 3)
+        self.fill = fill
+
+
+def submit_together(scheduler, images, configs=None):
+    results = [None] * len(images)
+    start = threading.Barrier(len(images))
+
+    def run(i):
+        start.wait()
+        results[i] = scheduler.submit(images[i], configs[i] if configs else None, scale=i)
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(len(images))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_requests_share_a_padded_forward():
+    detector = FakeDetector()
+    scheduler = BatchScheduler(detector, max_batch_size=4, max_wait_ms=200, metrics=MetricsRegistry())
+    results = submit_together(scheduler, [Image(64, 96, 1.0), Image(96, 64, 2.0), Image(64, 64, 3.0)])
+    scheduler.shutdown()
+
+    assert results == [((64, 96), 0), ((96, 64), 1), ((64, 64), 2)]  # each caller gets its own unpadded shape
+    assert len(detector.batches) == 1
+    batch = detector.batches[0]
+    assert batch.shape == (3, 3, 96, 96)
+    pad = torch.tensor(PAD_VALUE, dtype=batch.dtype)
+    for img in batch:  # each image at the top left, padded bottom/right
+        height, width = {1.0: (64, 96), 2.0: (96, 64), 3.0: (64, 64)}[img[0, 0, 0].item()]
+        assert (img[:, :height, :width] == img[0, 0, 0]).all()
+        assert (img[:, height:] == pad).all() and (img[:, :, width:] == pad).all()
+
+
+def test_requests_with_different_configs_do_not_share_a_forward():
+    detector = FakeDetector()
+    scheduler = BatchScheduler(detector, max_batch_size=4, max_wait_ms=200, metrics=MetricsRegistry())
+    old, new = Config(), Config()
+    submit_together(scheduler, [Image(64, 64)] * 4, [old, new, old, new])
+    scheduler.shutdown()
+    assert sorted(len(batch) for batch in detector.batches) == [2, 2]
+
+
+def test_forward_errors_reach_every_caller():
+    scheduler = BatchScheduler(FakeDetector(fail=True), max_batch_size=2, max_wait_ms=50, metrics=MetricsRegistry())
+    with pytest.raises(RuntimeError, match='forward failed'):
+        scheduler.submit(Image(64, 64))
+    scheduler.shutdown()
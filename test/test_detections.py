@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from models.object_detector.detections import Detections, parse_response_format
+from models.utils import apply_exif_orientation
+
+NAMES = ['antenna', 'double_nut']
+
+
+def detections(boxes=((10, 20, 30, 60),), scores=(0.9,), classes=(0,)):
+    return Detections(np.array(boxes, dtype=np.int64).reshape(-1, 4), np.array(scores, dtype=np.float32),
+                      np.array(classes, dtype=np.int64), NAMES)
+
+
+def test_legacy_format_as_the_original_responses():
+    assert detections().with_conf_intervals(0.5, 0.6).to_list() == [
+        {'class': 'antenna', 'conf': str(float(np.float32(0.9))),
+         'coordinates': [['10', '20'], ['10', '60'], ['30', '60'], ['30', '20']], 'conf_interval': 'high'}]
+
+
+def test_compact_format():
+    assert detections().to_list('compact') == [{'class': 'antenna', 'conf': 0.9, 'box': [10, 20, 30, 60]}]
+
+
+def test_low_confidence_objects_are_dropped_and_classes_filtered():
+    dets = detections(boxes=[(0, 0, 1, 1)] * 3, scores=(0.2, 0.5, 0.9), classes=(0, 1, 1))
+    kept = dets.with_conf_intervals(0.5, 0.6)
+    assert kept.scores.tolist() == pytest.approx([0.5, 0.9])
+    assert list(dets.with_conf_intervals(0.5, 0.6, drop_low=False).conf_intervals) == ['low', 'high', 'high']
+    assert kept.filter_classes(['double_nut']).class_names == ['double_nut', 'double_nut']
+
+
+@pytest.mark.parametrize('orientation, box', [
+    (1, [10, 20, 30, 60]),
+    (2, [70, 20, 90, 60]),
+    (3, [70, 40, 90, 80]),
+    (4, [10, 40, 30, 80]),
+    (5, [20, 10, 60, 30]),
+    (6, [20, 70, 60, 90]),
+    (7, [40, 70, 80, 90]),
+    (8, [40, 10, 80, 30]),
+])
+def test_rotate(orientation, box):
+    # boxes of a 100 wide, 100 high upright image go back to the stored (rotated) image
+    rotated = detections().rotate(orientation, (100, 100, 3))
+    assert rotated.boxes.tolist() == [box]
+    assert rotated.oriented
+    assert rotated.to_list()[0]['coordinates'][0] == [float(box[0]), float(box[1])]
+
+
+@pytest.mark.parametrize('orientation', range(1, 9))
+def test_rotate_matches_apply_exif_orientation(orientation):
+    # a box drawn on a stored 60x40 image, found again in the oriented pixels, goes back to where it was drawn
+    stored = np.zeros((40, 60), dtype=np.uint8)
+    stored[5:15, 10:30] = 255
+    oriented = apply_exif_orientation(stored, orientation)
+    ys, xs = np.nonzero(oriented)
+    found = detections(boxes=((xs.min(), ys.min(), xs.max() + 1, ys.max() + 1),))
+    assert found.rotate(orientation, oriented.shape).boxes.tolist() == [[10, 5, 30, 15]]
+
+
+def test_rotate_without_detections():
+    assert Detections.empty(NAMES).rotate(5, (100, 100, 3)).to_list() == []
+    with pytest.raises(ValueError):
+        detections().rotate(9, (100, 100, 3))
+
+
+def test_parse_response_format():
+    assert parse_response_format(None) == 'legacy'
+    assert parse_response_format('compact') == 'compact'
+    with pytest.raises(ValueError):
+        parse_response_format('xml')
@@ -0,0 +1,46 @@
+import glob
+import os
+
+import cv2
+import pytest
+import torch
+
+import models.model_paths as paths
+import models.object_detector.yolo_detection as yd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CFG = os.path.join(ROOT, paths.ad_config_path)
+WEIGHTS = os.path.join(ROOT, paths.ad_weights_path)
+IMAGES = sorted(glob.glob(os.path.join(ROOT, 'test', '*.jpg')))
+IMG_SIZE = 320  # small input, the parity does not depend on it
+
+pytestmark = pytest.mark.skipif(not os.path.exists(WEIGHTS), reason='needs the model weights')
+
+
+@pytest.fixture(scope='module')
+def models():
+    device = torch.device('cpu')
+    return (yd.build_model(CFG, WEIGHTS, device, img_size=IMG_SIZE, fuse=False),
+            yd.build_model(CFG, WEIGHTS, device, img_size=IMG_SIZE, fuse=True))
+
+
+def sorted_detections(pred):
+    det = yd.non_max_suppression(pred, 0.3, 0.6)[0]
+    if det is None:
+        return torch.zeros((0, 6))
+    return det[torch.argsort(det[:, 0] * 1e4 + det[:, 1])]
+
+
+@pytest.mark.parametrize('path', IMAGES, ids=os.path.basename)
+def test_fused_conv_bn_matches_unfused(models, path):
+    # Conv+BN folded at load (build_model fuse=True) keeps the outputs and detections of the unfused model
+    unfused, fused = models
+    img = torch.from_numpy(yd.letterbox_image(cv2.imread(path), IMG_SIZE)).float().div(255).unsqueeze(0)
+    with torch.no_grad():
+        ref, out = unfused(img)[0], fused(img)[0]
+    assert torch.allclose(out, ref, rtol=1e-3, atol=1e-3)
+    ref_dets, out_dets = sorted_detections(ref), sorted_detections(out)
+    assert out_dets.shape == ref_dets.shape
+    assert torch.allclose(out_dets[:, :4], ref_dets[:, :4], rtol=0, atol=1.0)  # pixels
+    assert torch.equal(out_dets[:, 5], ref_dets[:, 5])
+    assert torch.allclose(out_dets[:, 4], ref_dets[:, 4], atol=1e-3)
@@ -0,0 +1,82 @@
+import io
+import tarfile
+import zipfile
+
+import pytest
+
+from models import image_archive
+from models.image_archive import archive_images, archive_kind, file_images
+
+
+def tar_bytes(members, mode='w'):
+    out = io.BytesIO()
+    with tarfile.open(fileobj=out, mode=mode) as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return out.getvalue()
+
+
+def zip_bytes(members):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return out.getvalue()
+
+
+MEMBERS = [('a.jpg', b'first'), ('notes.txt', b'skip'), ('dir/B.PNG', b'second')]
+
+
+@pytest.mark.parametrize('kind, data', [
+    ('tar', tar_bytes(MEMBERS)),
+    ('tar', tar_bytes(MEMBERS, 'w:gz')),
+    ('zip', zip_bytes(MEMBERS)),
+])
+def test_image_members_in_order(kind, data):
+    members = list(archive_images(io.BytesIO(data), kind))
+    assert [(m.name, m.data, m.error) for m in members] == [('a.jpg', b'first', None), ('dir/B.PNG', b'second', None)]
+
+
+def test_tar_is_read_from_a_non_seekable_stream():
+    class Stream(io.RawIOBase):
+        def __init__(self, data):
+            self.data = io.BytesIO(data)
+
+        def readable(self):
+            return True
+
+        def readinto(self, b):
+            chunk = self.data.read(len(b))
+            b[:len(chunk)] = chunk
+            return len(chunk)
+
+    members = list(archive_images(Stream(tar_bytes(MEMBERS)), 'tar'))
+    assert [m.name for m in members] == ['a.jpg', 'dir/B.PNG']
+
+
+@pytest.mark.parametrize('kind, data', [('zip', b'not a zip'), ('tar', b'not a tar' * 100),
+                                        ('tar', tar_bytes(MEMBERS, 'w:gz')[:-30])])
+def test_corrupt_archive_ends_with_an_error_member(kind, data):
+    members = list(archive_images(io.BytesIO(data), kind, 'upload.' + kind))
+    assert members[-1].name == 'upload.' + kind
+    assert members[-1].error.startswith('Archive read failed')
+
+
+def test_oversized_images_are_reported_not_read(monkeypatch):
+    monkeypatch.setattr(image_archive, 'MAX_IMAGE_BYTES', 5)
+    members = list(archive_images(io.BytesIO(zip_bytes(MEMBERS)), 'zip'))
+    assert [(m.data, m.error is None) for m in members] == [(b'first', True), (None, False)]
+    files = list(file_images([('a.jpg', io.BytesIO(b'12345')), ('b.jpg', io.BytesIO(b'123456'))]))
+    assert [(m.data, m.error is None) for m in files] == [(b'12345', True), (None, False)]
+
+
+def test_archive_kind():
+    assert archive_kind('photos.ZIP') == 'zip'
+    assert archive_kind('photos.tar.gz') == 'tar'
+    assert archive_kind('photos.tgz', 'application/zip') == 'tar'
+    assert archive_kind(content_type='application/x-tar; charset=binary') == 'tar'
+    assert archive_kind('photos.rar', 'application/octet-stream') is None
+    with pytest.raises(ValueError):
+        archive_images(io.BytesIO(), 'rar')
@@ -0,0 +1,59 @@
+import io
+import struct
+
+import pytest
+from PIL import Image
+
+from models.image_probe import probe_image
+from models.utils import DecodedImage, ImageDecodeError
+
+
+def encode(fmt, size=(40, 30), orientation=None):
+    img = Image.new('RGB', size, (10, 20, 30))
+    out = io.BytesIO()
+    kwargs = {}
+    if orientation is not None:
+        exif = Image.Exif()
+        exif[274] = orientation
+        kwargs['exif'] = exif.tobytes()
+    img.save(out, fmt, **kwargs)
+    return out.getvalue()
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG'])
+def test_size_without_exif(fmt):
+    info = probe_image(encode(fmt))
+    assert (info.format, info.width, info.height, info.orientation) == (fmt.lower(), 40, 30, 0)
+    assert info.shape == (30, 40, 3)
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG'])
+@pytest.mark.parametrize('orientation, shape', [(1, (30, 40, 3)), (3, (30, 40, 3)), (6, (40, 30, 3)), (8, (40, 30, 3))])
+def test_exif_orientation(fmt, orientation, shape):
+    info = probe_image(encode(fmt, orientation=orientation))
+    assert info.orientation == orientation
+    assert info.shape == shape
+
+
+def test_file_object_position_is_restored():
+    f = io.BytesIO(b'xx' + encode('JPEG'))
+    f.seek(2)
+    assert probe_image(f).width == 40
+    assert f.tell() == 2
+
+
+@pytest.mark.parametrize('data', [b'', b'GIF89a' + b'\x00' * 20, encode('JPEG')[:20], encode('PNG')[:12],
+                                  b'\xff\xd8\xff\xe1' + struct.pack('>H', 60000)])
+def test_other_or_truncated_data_gives_none(data):
+    assert probe_image(data) is None
+
+
+@pytest.mark.parametrize('orientation', [2, 4, 5, 7])
+def test_decoded_shape_matches_the_headers(orientation):
+    image = DecodedImage(encode('JPEG', orientation=orientation))
+    assert image.img.shape == image.info.shape
+
+
+def test_unreadable_image_is_a_decode_error():
+    with pytest.raises(ImageDecodeError):
+        DecodedImage(b'junk', 'x.jpg').img
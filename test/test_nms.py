@@ -0,0 +1,46 @@
+import pytest
+import torch
+
+from yolov3.utils.utils import batched_non_max_suppression, image_then_score, non_max_suppression
+
+
+def predictions(batch_size, candidates, nc=2, anchors=3000, seed=0):
+    """Decoded output with clusters of overlapping boxes above 0.3 confidence"""
+    g = torch.Generator().manual_seed(seed)
+    pred = torch.zeros((batch_size, anchors, 5 + nc))
+    centers = torch.rand((batch_size, candidates // 10 + 1, 2), generator=g) * 600
+    cluster = torch.randint(0, centers.shape[1], (batch_size, candidates), generator=g)
+    pred[:, :candidates, :2] = centers.gather(1, cluster[..., None].expand(-1, -1, 2)) + torch.randn((batch_size, candidates, 2), generator=g) * 5
+    pred[:, :candidates, 2:4] = 20 + torch.rand((batch_size, candidates, 2), generator=g) * 60
+    pred[:, :candidates, 4] = 0.31 + torch.rand((batch_size, candidates), generator=g) * 0.69
+    pred[:, candidates:, 4] = 0.01
+    pred[..., 5:] = 0.5 + torch.rand((batch_size, anchors, nc), generator=g) * 0.5
+    return pred
+
+
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_batched_merge_nms_equals_the_per_image_loop(batch_size):
+    pred = predictions(batch_size, 500)
+    pred[-1, :, 4] = 0.01  # an image without candidates
+    expected = [non_max_suppression(pred[i:i + 1].clone(), 0.3, 0.6, multi_label=False)[0] for i in range(batch_size)]
+    out = batched_non_max_suppression(pred.clone(), 0.3, 0.6, multi_label=False, method='merge')
+    assert out[-1] is None and expected[-1] is None
+    for a, b in zip(expected[:-1], out[:-1]):
+        assert a.shape == b.shape
+        assert torch.allclose(a, b, atol=1e-3)
+
+
+def test_top_k_keeps_the_highest_confidence_boxes_per_image():
+    pred = predictions(2, 500)
+    out = batched_non_max_suppression(pred.clone(), 0.3, 0.6, multi_label=False, method='vision', max_candidates=50)
+    for i in range(2):
+        conf = (pred[i, :, 4:5] * pred[i, :, 5:]).max(1)[0]
+        kept = conf.topk(50)[0]
+        assert len(out[i]) <= 50
+        assert out[i][:, 4].min() >= kept.min() - 1e-6
+
+
+def test_image_then_score_order():
+    b = torch.tensor([1, 0, 1, 0, 2])
+    scores = torch.tensor([0.5, 0.4, 0.9, 0.8, 0.1])
+    assert image_then_score(b, scores).tolist() == [3, 1, 2, 0, 4]
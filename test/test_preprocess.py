@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+import torch
+
+from models.object_detector.letterbox import InputBuffers, letterbox_geometry
+from yolov3.utils.datasets import letterbox
+
+
+def reference(img0, img_size, auto):
+    """Input as yolov3 builds it: letterbox, BGR to RGB, HWC to CHW, float, /255"""
+    img = letterbox(img0, new_shape=img_size, auto=auto)[0]
+    img = torch.from_numpy(np.ascontiguousarray(img[:, :, ::-1].transpose(2, 0, 1))).float()
+    return (img / 255.0).unsqueeze(0)
+
+
+@pytest.mark.parametrize('height, width', [(480, 640), (640, 480), (1080, 1920), (608, 608), (37, 1001)])
+@pytest.mark.parametrize('auto', [True, False])
+def test_fused_letterbox_equals_yolov3_letterbox(height, width, auto):
+    img0 = np.random.default_rng(height * width).integers(0, 256, (height, width, 3), dtype=np.uint8)
+    buffers = InputBuffers()
+    expected = reference(img0, 608, auto)
+    assert letterbox_geometry((height, width), 608, auto)[0] == tuple(expected.shape[2:])
+    assert torch.equal(buffers.letterbox(img0, 608, auto), expected)
+    # a reused buffer holds no trace of the previous image
+    buffers.letterbox(255 - img0, 608, auto)
+    assert torch.equal(buffers.letterbox(img0, 608, auto), expected)
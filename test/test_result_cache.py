@@ -0,0 +1,41 @@
+from models import result_cache
+from models.result_cache import ResultCache
+
+OVERHEAD = ResultCache.ENTRY_OVERHEAD
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ResultCache(max_bytes=3 * (10 + OVERHEAD), name='test_cache_lru')
+    for key in 'abc':
+        cache.put(key, 'x' * 10)
+    assert cache.get('a') == 'x' * 10  # a is now the most recently used
+    cache.put('d', 'y' * 10)
+    assert cache.get('b') is None
+    assert [cache.get(key) is not None for key in 'acd'] == [True, True, True]
+    assert len(cache) == 3
+
+
+def test_replacing_a_key_keeps_the_byte_count():
+    cache = ResultCache(max_bytes=2 * (10 + OVERHEAD), name='test_cache_replace')
+    cache.put('a', 'x' * 10)
+    cache.put('a', 'y' * 10)
+    cache.put('b', 'z' * 10)
+    assert cache.get('a') == 'y' * 10 and cache.get('b') == 'z' * 10
+
+
+def test_entries_larger_than_the_cache_are_not_stored():
+    cache = ResultCache(max_bytes=100, name='test_cache_large')
+    cache.put('a', 'x', size=100)
+    assert cache.get('a') is None and len(cache) == 0
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(result_cache.time, 'monotonic', lambda: now[0])
+    cache = ResultCache(ttl=10, name='test_cache_ttl')
+    cache.put('a', 'x')
+    now[0] += 9
+    assert cache.get('a') == 'x'
+    now[0] += 2
+    assert cache.get('a') is None
+    assert len(cache) == 0
@@ -0,0 +1,48 @@
+import json
+
+import pytest
+
+from models.thresholds import ThresholdStore, parse_model_thresholds, parse_thresholds
+
+
+def test_valid_thresholds_are_floats():
+    assert parse_model_thresholds('antenna', {'th1': 0, 'th2': 0.5}) == {'th1': 0.0, 'th2': 0.5}
+
+
+@pytest.mark.parametrize('value', [
+    [0.1, 0.2],
+    {'th1': 0.1},
+    {'th1': '0.1', 'th2': 0.2},
+    {'th1': True, 'th2': 0.2},
+    {'th1': -0.1, 'th2': 0.2},
+    {'th1': 0.1, 'th2': 1.5},
+    {'th1': 0.6, 'th2': 0.5},
+])
+def test_invalid_thresholds_are_rejected(value):
+    with pytest.raises(ValueError):
+        parse_model_thresholds('antenna', value)
+
+
+def test_every_model_needs_thresholds():
+    with pytest.raises(ValueError, match='cable_jack'):
+        parse_thresholds({'antenna': {'th1': 0.1, 'th2': 0.2}}, models=('antenna', 'cable_jack'))
+    with pytest.raises(ValueError):
+        parse_thresholds([], models=())
+
+
+def test_store_keeps_previous_thresholds_on_a_bad_edit(tmp_path):
+    path = tmp_path / 'thresholds.json'
+    path.write_text(json.dumps({'antenna': {'th1': 0.1, 'th2': 0.2}}))
+    store = ThresholdStore(str(path), models=('antenna',), check_interval=None)
+    assert store.get('antenna') == {'th1': 0.1, 'th2': 0.2}
+
+    path.write_text(json.dumps({'antenna': {'th1': 0.9, 'th2': 0.2}}))
+    assert not store.reload()
+    assert store.get('antenna') == {'th1': 0.1, 'th2': 0.2}
+    assert 'th1 of antenna' in store.active()['last_error']
+
+    path.write_text(json.dumps({'antenna': {'th1': 0.3, 'th2': 0.4}}))
+    assert store.reload()
+    assert store.get('antenna') == {'th1': 0.3, 'th2': 0.4}
+    assert store.active()['last_error'] is None
+    assert store.version == 2
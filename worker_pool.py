@@ -0,0 +1,102 @@
+#Pre-fork worker pool for image_api (Linux): models are loaded once in the parent, then N worker
+#processes forked from it serve the same listening socket and share the weight pages copy-on-write
+import os
+import gc
+import sys
+import time
+import socket
+import signal
+import logging
+
+import torch
+
+
+def bind_socket(host, port, backlog=2048):
+    """Listening TCP socket shared by all workers"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+class WorkerPool:
+    """Forks num_workers processes running serve_forever(sock) and restarts the ones that die.
+
+    Each worker limits torch intra-op parallelism to threads_per_worker (default: cores divided
+    by workers), so all workers together use one thread per core. SIGTERM/SIGINT stop the
+    workers, SIGHUP is forwarded to them (config reload).
+    """
+
+    def __init__(self, num_workers, serve_forever, threads_per_worker=None, on_start=None, logger=None):
+        self.num_workers = num_workers
+        self.serve_forever = serve_forever
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.on_start = on_start
+        self.logger = logger or logging.getLogger(__name__)
+        self.workers = set()
+        self._stopping = False
+
+    def _spawn(self, sock):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return pid
+
+        #Worker
+        code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            torch.set_num_threads(self.threads_per_worker)
+            self.serve_forever(sock)
+        except BaseException:
+            self.logger.exception('Worker {} failed'.format(os.getpid()))
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                self.workers.discard(pid)
+
+    def _stop(self, signum, frame):
+        self._stopping = True
+        self._signal_workers(signal.SIGTERM)
+
+    def run(self, sock):
+        """Start the workers and supervise them until stopped"""
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self._signal_workers(signal.SIGHUP))
+
+        #Keep the garbage collector from writing to (and so copying) pages of objects created so far
+        gc.collect()
+        gc.freeze()
+
+        for _ in range(self.num_workers):
+            self._spawn(sock)
+        self.logger.info('Started {} workers, {} torch threads each: {}'.format(
+            self.num_workers, self.threads_per_worker, sorted(self.workers)))
+        if self.on_start:
+            self.on_start(sorted(self.workers))
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            except InterruptedError:
+                continue
+            self.workers.discard(pid)
+            if not self._stopping:
+                self.logger.error('Worker {} exited with status {}, restarting'.format(pid, status))
+                time.sleep(1)
+                self._spawn(sock)
+        self.logger.info('All workers stopped')
@@ -141,6 +141,7 @@ class YOLOLayer(nn.Module):
         self.nx, self.ny = 0, 0  # initialize number of x, y gridpoints
         self.anchor_vec = self.anchors / self.stride
         self.anchor_wh = self.anchor_vec.view(1, self.na, 1, 1, 2)
+        self.grids = {}  # inference (grid, anchor_wh) per (nx, ny, device, dtype), shared read-only by concurrent forwards
 
         if ONNX_EXPORT:
             self.create_grids((img_size[1] // stride, img_size[0] // stride))  # number x, y grid points
@@ -158,6 +159,27 @@ class YOLOLayer(nn.Module):
             self.anchor_vec = self.anchor_vec.to(device)
             self.anchor_wh = self.anchor_wh.to(device)
 
+    def get_grids(self, nx, ny, device, dtype=torch.float32):
+        # Returns cached inference (grid, anchor_wh) for a grid size without mutating layer state (thread safe)
+        key = (nx, ny, str(device), dtype)
+        grids = self.grids.get(key)
+        if grids is None:
+            yv, xv = torch.meshgrid([torch.arange(ny, device=device), torch.arange(nx, device=device)])
+            grid = torch.stack((xv, yv), 2).view((1, 1, ny, nx, 2)).to(dtype)
+            grids = self.grids[key] = (grid, self.anchor_vec.view(1, self.na, 1, 1, 2).to(device, dtype))
+        return grids
+
+    def decode(self, p, io):
+        # Inference decode of raw head output p (bs, na * no, ny, nx) written straight into io, a
+        # (..., na, ny, nx, no) view of the model output whose leading dims split bs - no temporaries
+        ny, nx = p.shape[-2:]
+        grid, anchor_wh = self.get_grids(nx, ny, p.device, io.dtype)
+        p = p.view(io.shape[:-4] + (self.na, self.no, ny, nx)).movedim(-3, -1)
+        torch.sigmoid(p[..., :2], out=io[..., :2]).add_(grid).mul_(self.stride)  # xy
+        torch.exp(p[..., 2:4], out=io[..., 2:4]).mul_(anchor_wh).mul_(self.stride)  # wh yolo method
+        torch.sigmoid(p[..., 4:], out=io[..., 4:])  # conf, cls
+        return io
+
     def forward(self, p, img_size, out):
         ASFF = False  # https://arxiv.org/abs/1911.09516
         if ASFF:
@@ -181,13 +203,17 @@ class YOLOLayer(nn.Module):
 
         elif ONNX_EXPORT:
             bs = 1  # batch size
+            ny, nx = self.ny, self.nx
         else:
             bs, _, ny, nx = p.shape  # bs, 255, 13, 13
-            if (self.nx, self.ny) != (nx, ny):
+            if self.training and (self.nx, self.ny) != (nx, ny):
                 self.create_grids((nx, ny), p.device)
 
+        if not (self.training or ONNX_EXPORT):  # inference, raw outputs are only kept for training
+            return self.decode(p, p.new_empty((bs, self.na, ny, nx, self.no))).view(bs, -1, self.no), None
+
         # p.view(bs, 255, 13, 13) -- > (bs, 3, 13, 13, 85)  # (bs, anchors, grid, grid, classes + xywh)
-        p = p.view(bs, self.na, self.no, self.ny, self.nx).permute(0, 1, 3, 4, 2).contiguous()  # prediction
+        p = p.view(bs, self.na, self.no, ny, nx).permute(0, 1, 3, 4, 2).contiguous()  # prediction
 
         if self.training:
             return p
@@ -206,13 +232,50 @@ class YOLOLayer(nn.Module):
                 torch.sigmoid(p[:, 5:self.no]) * torch.sigmoid(p[:, 4:5])  # conf
             return p_cls, xy * ng, wh
 
-        else:  # inference
-            io = p.clone()  # inference output
-            io[..., :2] = torch.sigmoid(io[..., :2]) + self.grid  # xy
-            io[..., 2:4] = torch.exp(io[..., 2:4]) * self.anchor_wh  # wh yolo method
-            io[..., :4] *= self.stride
-            torch.sigmoid_(io[..., 4:])
-            return io.view(bs, -1, self.no), p  # view [1, 3, 13, 13, 85] as [1, 507, 85]
+
+# Test-time augmentations (flip-lr, scale) used by augment=True, each one adds a copy of the batch
+DEFAULT_AUGMENTATIONS = ((True, 0.9), (False, 0.7))
+
+
+def get_augmentations(augment):
+    # augment: True (default augmentations), False/None (none) or a sequence of (flip-lr, scale)
+    if augment is True:
+        return DEFAULT_AUGMENTATIONS
+    return tuple(augment) if augment else ()
+
+
+def augment_images(x, augmentations):
+    # Original batch followed by one augmented copy per (flip-lr, scale)
+    return torch.cat([x] + [torch_utils.scale_img(x.flip(3) if flip else x, scale) for flip, scale in augmentations], 0)
+
+
+def precompute_grids(yolo_layers, shapes, device, dtype=torch.float32):
+    # Create the cached grids of every YOLO layer for input shapes (height, width), e.g. at load time
+    for layer in yolo_layers:
+        for h, w in shapes:
+            layer.get_grids(w // layer.stride, h // layer.stride, device, dtype)
+
+
+def decode_heads(yolo_layers, heads, img_size, nb=None, augmentations=()):
+    # Inference output (nb, anchors, no) from raw head outputs (Darknet.forward_heads).
+    # The output is allocated once and every head decoded into its slice of it; the outputs of the
+    # augmented copies (batch entries j * nb + b) follow the original's anchors of image b and are
+    # mapped back to the original image in place
+    k = 1 + len(augmentations)
+    nb = nb or heads[0].shape[0] // k
+    sizes = [layer.na * p.shape[2] * p.shape[3] for layer, p in zip(yolo_layers, heads)]
+    x = heads[0].new_empty((nb, k, sum(sizes), yolo_layers[0].no))
+    io, i = x.transpose(0, 1), 0  # (copy, image, anchors, no) view
+    for layer, p, n in zip(yolo_layers, heads, sizes):
+        layer.decode(p, io[:, :, i:i + n].unflatten(2, (layer.na,) + tuple(p.shape[2:])))
+        i += n
+
+    # De-augment results
+    for xi, (flip, scale) in zip(io[1:], augmentations):
+        xi[..., :4] /= scale  # scale
+        if flip:
+            xi[..., 0].neg_().add_(img_size[1])  # flip lr
+    return x.view(nb, -1, x.shape[-1])
 
 
 class Darknet(nn.Module):
@@ -224,6 +287,7 @@ class Darknet(nn.Module):
         self.module_defs = parse_model_cfg(cfg)
         self.module_list, self.routs = create_modules(self.module_defs, img_size)
         self.yolo_layers = get_yolo_layers(self)
+        self.releases = get_releases(self.module_defs)
 
         # Darknet Header https://github.com/AlexeyAB/darknet/issues/2914#issuecomment-496675346
         self.version = np.array([0, 2, 5], dtype=np.int32)  # (int32) version info: major, minor, revision
@@ -238,12 +302,10 @@ class Darknet(nn.Module):
             str = ''
 
         # Augment images (inference and test only)
-        if augment:  # https://github.com/ultralytics/yolov3/issues/931
+        augmentations = get_augmentations(augment)
+        if augmentations:  # https://github.com/ultralytics/yolov3/issues/931
             nb = x.shape[0]  # batch size
-            x = torch.cat((x,
-                           torch_utils.scale_img(x.flip(3), 0.9),  # flip-lr and scale
-                           torch_utils.scale_img(x, 0.7),  # scale
-                           ), 0)
+            x = augment_images(x, augmentations)
 
         for i, module in enumerate(self.module_list):
             name = module.__class__.__name__
@@ -254,11 +316,13 @@ class Darknet(nn.Module):
                     str = ' >> ' + ' + '.join(['layer %g %s' % x for x in zip(l, s)])
                 x = module(x, out)  # WeightedFeatureFusion(), FeatureConcat()
             elif name == 'YOLOLayer':
-                yolo_out.append(module(x, img_size, out))
+                yolo_out.append(module(x, img_size, out) if self.training or ONNX_EXPORT else x)  # raw head, decoded below
             else:  # run module directly, i.e. mtype = 'convolutional', 'upsample', 'maxpool', 'batchnorm2d' etc.
                 x = module(x)
 
             out.append(x if self.routs[i] else [])
+            for j in self.releases[i]:
+                out[j] = []  # release outputs no later layer reads
             if verbose:
                 print('%g/%g %s -' % (i, len(self.module_list), name), list(x.shape), str)
                 str = ''
@@ -268,16 +332,28 @@ class Darknet(nn.Module):
         elif ONNX_EXPORT:  # export
             x = [torch.cat(x, 0) for x in zip(*yolo_out)]
             return x[0], torch.cat(x[1:3], 1)  # scores, boxes: 3780x80, 3780x4
-        else:  # inference or test
-            x, p = zip(*yolo_out)  # inference output, training output
-            x = torch.cat(x, 1)  # cat yolo outputs
-            if augment:  # de-augment results
-                x = torch.split(x, nb, dim=0)
-                x[1][..., :4] /= 0.9  # scale
-                x[1][..., 0] = img_size[1] - x[1][..., 0]  # flip lr
-                x[2][..., :4] /= 0.7  # scale
-                x = torch.cat(x, 1)
-            return x, p
+        else:  # inference or test, raw head outputs are not returned
+            layers = [self.module_list[i] for i in self.yolo_layers]
+            return decode_heads(layers, yolo_out, img_size, nb if augmentations else None, augmentations), None
+
+    def precompute_grids(self, shapes, device, dtype=torch.float32):
+        precompute_grids([self.module_list[i] for i in self.yolo_layers], shapes, device, dtype)
+
+    def forward_heads(self, x):
+        # Raw YOLO head outputs (inputs of the YOLO layers, not decoded) - the graph exported for other runtimes
+        heads, out = [], []
+        for i, module in enumerate(self.module_list):
+            name = module.__class__.__name__
+            if name in ['WeightedFeatureFusion', 'FeatureConcat']:  # sum, concat
+                x = module(x, out)
+            elif name == 'YOLOLayer':
+                heads.append(x)
+            else:
+                x = module(x)
+            out.append(x if self.routs[i] else [])
+            for j in self.releases[i]:
+                out[j] = []  # release outputs no later layer reads
+        return heads
 
     def fuse(self):
         # Fuse Conv2d + BatchNorm2d layers throughout model
@@ -304,6 +380,19 @@ def get_yolo_layers(model):
     return [i for i, x in enumerate(model.module_defs) if x['type'] == 'yolo']  # [82, 94, 106] for yolov3
 
 
+def get_releases(module_defs):
+    # Per layer, the routed outputs it is the last route/shortcut layer to read - dead once it ran
+    last_use = {}
+    for i, mdef in enumerate(module_defs):
+        if mdef['type'] in ('route', 'shortcut'):
+            for l in mdef['layers' if mdef['type'] == 'route' else 'from']:
+                last_use[i + l if l < 0 else l] = i
+    releases = [[] for _ in module_defs]
+    for j, i in sorted(last_use.items()):
+        releases[i].append(j)
+    return releases
+
+
 def load_darknet_weights(self, weights, cutoff=-1):
     # Parses and loads the weights stored in 'weights'
 
@@ -76,20 +76,21 @@ def fuse_conv_and_bn(conv, bn):
                                     kernel_size=conv.kernel_size,
                                     stride=conv.stride,
                                     padding=conv.padding,
-                                    bias=True)
+                                    dilation=conv.dilation,
+                                    groups=conv.groups,
+                                    bias=True).to(conv.weight.device, conv.weight.dtype)
 
-        # prepare filters
-        w_conv = conv.weight.clone().view(conv.out_channels, -1)
-        w_bn = torch.diag(bn.weight.div(torch.sqrt(bn.eps + bn.running_var)))
-        fusedconv.weight.copy_(torch.mm(w_bn, w_conv).view(fusedconv.weight.size()))
+        # prepare filters (per output channel scale, works for grouped convs too)
+        scale = bn.weight.div(torch.sqrt(bn.eps + bn.running_var))
+        fusedconv.weight.copy_(conv.weight * scale.view(-1, 1, 1, 1))
 
         # prepare spatial bias
         if conv.bias is not None:
             b_conv = conv.bias
         else:
-            b_conv = torch.zeros(conv.weight.size(0))
+            b_conv = torch.zeros_like(scale)
         b_bn = bn.bias - bn.weight.mul(bn.running_mean).div(torch.sqrt(bn.running_var + bn.eps))
-        fusedconv.bias.copy_(torch.mm(w_bn, b_conv.reshape(-1, 1)).reshape(-1) + b_bn)
+        fusedconv.bias.copy_(b_conv * scale + b_bn)
 
         return fusedconv
 
@@ -575,6 +575,98 @@ def non_max_suppression(prediction, conf_thres=0.1, iou_thres=0.6, multi_label=T
     return output
 
 
+def image_then_score(b, scores):
+    # Order of rows by image index, then by descending score (one composite key, argsort(stable=True) needs torch >= 1.13)
+    return (b.double() * (scores.max().double() + 1) - scores.double()).argsort()
+
+
+def batched_non_max_suppression(prediction, conf_thres=0.1, iou_thres=0.6, multi_label=True, classes=None,
+                                agnostic=False, method='merge', max_candidates=None):
+    """
+    Performs Non-Maximum Suppression on the inference results of a whole batch (bs, n, no): candidate filtering,
+    scoring and top-k run once for all images; NMS is one call with boxes offset per image on CUDA and one call
+    per image on CPU, so on CPU only the vectorized filtering and max_candidates make it faster than a loop
+    method: 'merge' (kept boxes become the score weighted mean of the boxes they suppress) or 'vision' (plain)
+    max_candidates: optional top-k per image by confidence before NMS
+    Returns per image detections with shape (same as non_max_suppression):
+        nx6 (x1, y1, x2, y2, conf, cls) or None
+    """
+
+    # Box constraints
+    min_wh, max_wh = 2, 4096  # (pixels) minimum and maximum box width and height
+
+    bs, nc = prediction.shape[0], prediction.shape[2] - 5  # batch size, number of classes
+    multi_label &= nc > 1  # multiple labels per box
+    output = [None] * bs
+
+    # Apply conf and width-height constraints, rows stay grouped by image
+    wh = prediction[..., 2:4]
+    b, n = ((prediction[..., 4] > conf_thres) & ((wh > min_wh) & (wh < max_wh)).all(-1)).nonzero(as_tuple=True)
+    x = prediction[b, n]  # candidates, b their image index
+    if not x.shape[0]:
+        return output
+
+    # Compute conf
+    x[..., 5:] *= x[..., 4:5]  # conf = obj_conf * cls_conf
+
+    # Box (center x, center y, width, height) to (x1, y1, x2, y2)
+    box = xywh2xyxy(x[:, :4])
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = (x[:, 5:] > conf_thres).nonzero().t()
+        x, b = torch.cat((box[i], x[i, j + 5].unsqueeze(1), j.float().unsqueeze(1)), 1), b[i]
+    else:  # best class only
+        conf, j = x[:, 5:].max(1)
+        x = torch.cat((box, conf.unsqueeze(1), j.float().unsqueeze(1)), 1)
+
+    # Filter by class
+    if classes:
+        k = (j.view(-1, 1) == torch.tensor(classes, device=j.device)).any(1)
+        x, b = x[k], b[k]
+
+    # Apply finite constraint
+    if not torch.isfinite(x).all():
+        k = torch.isfinite(x).all(1)
+        x, b = x[k], b[k]
+
+    # Top-k per image by confidence
+    if max_candidates:
+        order = image_then_score(b, x[:, 4])
+        counts = torch.bincount(b, minlength=bs)
+        rank = torch.arange(len(order), device=x.device) - (counts.cumsum(0) - counts)[b[order]]
+        k = order[rank < max_candidates].sort()[0]
+        x, b = x[k], b[k]
+
+    # If none remain return
+    if not x.shape[0]:
+        return output
+
+    # NMS, boxes offset by class as in non_max_suppression; rows are grouped by image
+    c = x[:, 5] * 0 if agnostic else x[:, 5]  # classes
+    boxes, scores = x[:, :4].clone() + c.view(-1, 1) * max_wh, x[:, 4]  # boxes (offset by class), scores
+    counts = torch.bincount(b, minlength=bs).tolist()
+    starts = np.cumsum([0] + counts[:-1]).tolist()
+    if x.is_cuda:  # one NMS call, images offset past each other (in float64 to keep the iou precision)
+        offsets = boxes.double() + (b * max(nc, 1) * max_wh).view(-1, 1).double() if bs > 1 else boxes
+        i = torchvision.ops.boxes.nms(offsets, scores, iou_thres)
+        i = i[image_then_score(b[i], scores[i])]
+    else:  # the CPU kernel is quadratic in the number of boxes of a call: one offset call is 3-7x slower than a loop
+        i = torch.cat([torchvision.ops.boxes.nms(boxes[start:start + n], scores[start:start + n], iou_thres) + start
+                       for start, n in zip(starts, counts)])
+    kept = torch.bincount(b[i], minlength=bs).tolist()
+
+    if method == 'merge':  # Merge NMS (boxes merged using weighted mean), per image as non_max_suppression does
+        for ii, start, n in zip(i.split(kept), starts, counts):
+            if len(ii) and n < 3E3:  # update boxes as boxes(i,4) = weights(i,n) * boxes(n,4)
+                weights = (box_iou(boxes[ii], boxes[start:start + n]) > iou_thres) * scores[None, start:start + n]
+                x[ii, :4] = torch.mm(weights / weights.sum(1, keepdim=True), x[start:start + n, :4]).float()  # merged boxes
+
+    for xi, det in enumerate(x[i].split(kept)):
+        output[xi] = det if len(det) else None
+    return output
+
+
 def get_yolo_layers(model):
     bool_vec = [x['type'] == 'yolo' for x in model.module_defs]
     return [i for i, x in enumerate(bool_vec) if x]  # [82, 94, 106] for yolov3